@@ -2,7 +2,9 @@
 
 # imports
 import os, sys
+import time
 import argparse
+import traceback
 import ROOT
 ROOT.PyConfig.IgnoreCommandLineOptions = True # (?)
 
@@ -19,13 +21,42 @@ from PhysicsTools.nanoSkimming.processing.leptonvariables import LeptonVariables
 from PhysicsTools.nanoSkimming.processing.topleptonmva import TopLeptonMvaModule
 from PhysicsTools.nanoSkimming.processing.leptongenvariables import LeptonGenVariablesModule
 from PhysicsTools.nanoSkimming.processing.triggervariables import TriggerVariablesModule
+from PhysicsTools.nanoSkimming.processing.pipelineplanner import planmodules
+from PhysicsTools.nanoSkimming.processing.profiling import ChainProfiler, writesummary
+from PhysicsTools.nanoSkimming.processing.sharding import makeshards, writeshards, readshards, runshards
+from PhysicsTools.nanoSkimming.processing.sharding import shardoutputdir, partialoutputs, mergeoutputs
+from PhysicsTools.nanoSkimming.processing.sharding import mergeshardsummaries, removeshards
 from PhysicsTools.nanoSkimming.tools.sampletools import getsampleparams
+from PhysicsTools.nanoSkimming.tools.lumitools import getentryspan
+from PhysicsTools.nanoSkimming.tools.eventindex import writesidecar, sidecarpath
 
 # read command line arguments
 parser = argparse.ArgumentParser(description='Submission through HTCondor')
-parser.add_argument('-i', '--inputfile', required=True)
+parser.add_argument('-i', '--inputfiles', default=None, nargs='+',
+                    help='Input file(s); with multiple files, the modules are set up only once'
+                        +' and the files are processed one by one, with one output file per input file')
+parser.add_argument('-l', '--filelist', default=None,
+                    help='Text file with input files (one per line), as alternative to (or on top of) -i')
 parser.add_argument('-n', '--nentries', type=int, default=-1)
 parser.add_argument('-d', '--dropbranches', default='../data/dropbranches/fourtops.txt')
+parser.add_argument('--sidecar', default=False, action='store_true',
+                    help='Write a sidecar file with the event keys next to each output file'
+                        +' (see tools/eventindex.py)')
+parser.add_argument('--profile', default=False, action='store_true',
+                    help='Profile the modules and write a timing summary into each output file'
+                        +' and next to it as a json file (see processing/profiling.py)')
+parser.add_argument('--profilehist', default=False, action='store_true',
+                    help='With --profile, also store a histogram of the per-event latency of each module')
+parser.add_argument('--planreport', default=False, action='store_true',
+                    help='Print an estimate of the branch read volume for the planned module order'
+                        +' (reads the filter input branches of the first events of the first input file;'
+                        +' see processing/pipelineplanner.py)')
+parser.add_argument('--ncores', type=int, default=1,
+                    help='Number of worker processes; the input files (or entry ranges within them)'
+                        +' are split over the workers and the partial outputs are merged per input file'
+                        +' (see processing/sharding.py)')
+parser.add_argument('--shardfile', default=None, help='(internal) json file with the shards of a job')
+parser.add_argument('--shard', type=int, default=None, help='(internal) index of the shard to process')
 # parser.add_argument('-j', '--json', default=None)
 args = parser.parse_args()
 
@@ -35,16 +66,32 @@ for arg in vars(args):
     print('  - {}: {}'.format(arg,getattr(args,arg)))
 
 # set input files and output directory
-inputfile = args.inputfile
-inputfiles = [args.inputfile]
+inputfiles = []
+if args.inputfiles is not None: inputfiles += args.inputfiles
+if args.filelist is not None:
+    with open(args.filelist) as f:
+        lines = [line.strip() for line in f]
+    inputfiles += [line for line in lines if line and not line.startswith('#')]
+if len(inputfiles)==0:
+    raise Exception('ERROR: no input files provided (use -i and/or -l).')
+inputfile = inputfiles[0]
 outputdir = os.getenv('TMPDIR')
 # note: the os.getenv('TMPDIR') points to the standard working directory
 #       on the HTCondor worker node where this job was submitted.
 #       the copying of the resulting output file to the desired output directory
 #       is handled in the submit script instead!
+
+# in a worker process, only process the shard assigned to it
+# (see the splitting over worker processes below)
+shard = None
+if args.shard is not None:
+    shard = readshards(args.shardfile)[args.shard]
+    inputfiles = [inputfile for (inputfile, _, _) in shard]
+    inputfile = inputfiles[0]
+    outputdir = shardoutputdir(outputdir, args.shard)
 # get sample parameters
-# (note: no check is done on consistency between samples,
-#  only first sample is used)
+# (note: the modules are set up for the first sample;
+#  the other samples are checked for consistency before processing them)
 sampleparams = getsampleparams(inputfile)
 year = sampleparams['year']
 dtype = sampleparams['dtype']
@@ -65,6 +112,34 @@ if dtype=='data':
     if not os.path.exists(jsonfile):
         raise Exception('ERROR: json file not found.')
 
+# define entry range to process
+# (for data, a pre-pass over the run and luminosityBlock branches
+#  finds the first and last entry in a certified lumisection,
+#  so that leading and trailing uncertified stretches are not read at all.)
+def getentryrange(inputfile):
+    firstentry = 0
+    maxentries = None if args.nentries<=0 else args.nentries
+    if jsonfile is None: return (firstentry, maxentries)
+    try: span = getentryspan(inputfile, jsonfile)
+    except Exception as e:
+        print('WARNING: json pre-pass failed ({}), will process all entries.'.format(e))
+        return (firstentry, maxentries)
+    if span is None:
+        print('Json pre-pass: no certified lumisection found, will process no entries.')
+        return (0, 0)
+    firstentry = span[0]
+    nspan = span[1] - span[0]
+    maxentries = nspan if maxentries is None else min(maxentries, nspan)
+    print('Json pre-pass: will process entries {} to {}.'.format(firstentry, firstentry+maxentries))
+    return (firstentry, maxentries)
+
+def getcut(maxentries):
+    # get the cut to pass to the PostProcessor for an entry range
+    # (a zero-entry range is processed with a cut that rejects all events,
+    #  so that an empty output tree is still written;
+    #  maxEntries=0 cannot be used for this, as the PostProcessor treats it as no limit)
+    return '0' if maxentries==0 else None
+
 # define branches to drop and keep
 dropbranches = args.dropbranches
 if not os.path.exists(dropbranches):
@@ -72,6 +147,45 @@ if not os.path.exists(dropbranches):
 if not os.path.exists(dropbranches):
     raise Exception('ERROR: dropbranches file not found.')
 
+# split the processing over multiple worker processes if requested
+# (each worker re-runs this script on its own shard of the input files or entry ranges,
+#  with its own modules; the partial outputs are merged again per input file,
+#  see processing/sharding.py)
+if( args.ncores>1 and args.shard is None ):
+    starttime = time.time()
+    entryranges = dict([(f, getentryrange(f)) for f in inputfiles])
+    shards = makeshards(inputfiles, args.ncores, entryranges=entryranges)
+    shardfile = os.path.join(outputdir, 'shards.json')
+    writeshards(shards, shardfile)
+    print('Processing {} file(s) with {} worker processes.'.format(len(inputfiles), len(shards)))
+    exitcodes = runshards([sys.executable] + sys.argv + ['--shardfile', shardfile], len(shards), outputdir)
+    failed = []
+    for (inputfile, partialfiles) in partialoutputs(shards, outputdir):
+        outputfile = os.path.join(outputdir, os.path.basename(inputfile))
+        if not all([os.path.exists(f) for f in partialfiles]):
+            failed.append(inputfile)
+            continue
+        try:
+            summary = None
+            if args.profile: summary = mergeshardsummaries(partialfiles, time.time()-starttime)
+            mergeoutputs(outputfile, partialfiles)
+            if summary is not None:
+                summary['inputfiles'] = [inputfile]
+                summary['outputfile'] = os.path.basename(outputfile)
+                summary['outputsize'] = os.path.getsize(outputfile)
+                writesummary(summary, outputfile)
+            if args.sidecar: print('Writing sidecar {}'.format(writesidecar(outputfile)))
+        except Exception:
+            print('ERROR: merging of the output of file {} failed:'.format(inputfile))
+            traceback.print_exc()
+            failed.append(inputfile)
+            if os.path.exists(outputfile): os.remove(outputfile)
+    removeshards(outputdir, len(shards))
+    os.remove(shardfile)
+    print('Processed {} file(s), of which {} failed.'.format(len(inputfiles), len(failed)))
+    for f in failed: print('  - {}'.format(f))
+    sys.exit(1 if len(failed)>0 else 0)
+
 # set up JetMET module
 yeardict = {
     '2016PreVFP': 'UL2016_preVFP',
@@ -133,19 +247,83 @@ modules += ([
 ])
 if dtype!='data': modules.append(LeptonGenVariablesModule())
 
+# plan the order of the modules
+# (filters first, so that producers only run for events that pass them;
+#  see processing/pipelineplanner.py)
+# (the branch read volume is only estimated on request,
+#  as it needs an extra read of the first input file, and only once for multi-core jobs)
+planreportfile = inputfiles[0] if( args.planreport and args.shard in [None, 0] ) else None
+modules = planmodules(modules, inputfile=planreportfile)
+
 # set other arguments
 postfix = '' # (just some naming postfix for output file)
 
-# define a PostProcessor
-p = PostProcessor(
-    outputdir,
-    inputfiles,
-    modules = modules,
-    maxEntries = None if args.nentries<=0 else args.nentries,
-    postfix = postfix,
-    branchsel = dropbranches,
-    jsonInput = jsonfile
-)
+# process the input files one by one with the same modules
+# (note: the modules are only set up once, so that the startup cost
+#  is not paid again for each file; a failure in one file is reported
+#  but does not stop the processing of the other files)
+failed = []
+for i, inputfile in enumerate(inputfiles):
+    print('Processing file {} ({}/{})'.format(inputfile, i+1, len(inputfiles)))
+    outputfile = os.path.join(outputdir, os.path.basename(inputfile).replace('.root', postfix+'.root'))
+    try:
+        # check consistency with the first sample
+        fileparams = getsampleparams(inputfile)
+        for key in ['year', 'dtype', 'runperiod']:
+            if fileparams.get(key)!=sampleparams.get(key):
+                raise Exception('ERROR: {} of file {} ({}) does not match the first file ({}).'.format(
+                                key, inputfile, fileparams.get(key), sampleparams.get(key)))
+
+        # define entry range to process
+        # (in a worker process, given by its shard)
+        if shard is None: (firstentry, maxentries) = getentryrange(inputfile)
+        else: (_, firstentry, maxentries) = shard[i]
+
+        # profile the modules if requested
+        # (a new profiler for each file, so that each summary covers only its own file)
+        profiler = None
+        filemodules = modules
+        if args.profile:
+            profiler = ChainProfiler(modules, histogram=args.profilehist)
+            filemodules = profiler.modules
+
+        # define a PostProcessor
+        p = PostProcessor(
+            outputdir,
+            [inputfile],
+            modules = filemodules,
+            maxEntries = maxentries,
+            firstEntry = firstentry,
+            cut = getcut(maxentries),
+            postfix = postfix,
+            branchsel = dropbranches,
+            jsonInput = jsonfile
+        )
+
+        # run the PostProcessor
+        p.run()
+
+        # write the profiling summary into the output file
+        # (note: before writing the sidecar file, since this modifies the output file)
+        if profiler is not None:
+            profiler.write(outputfile, inputfiles=[inputfile])
+
+        # write a sidecar file with the event keys of the output file
+        # (used by later merging and lumisection accounting to avoid reading the trees again;
+        #  in a worker process, this is done after merging the partial outputs instead)
+        if( args.sidecar and shard is None ):
+            print('Writing sidecar {}'.format(writesidecar(outputfile)))
+
+    except Exception:
+        print('ERROR: processing of file {} failed:'.format(inputfile))
+        traceback.print_exc()
+        failed.append(inputfile)
+        # remove partial output, so that it is not copied to the output directory
+        partial = [outputfile, os.path.splitext(outputfile)[0]+'.perf.json', sidecarpath(outputfile)]
+        for f in partial:
+            if os.path.exists(f): os.remove(f)
 
-# run the PostProcessor
-p.run()
+# print a summary
+print('Processed {} file(s), of which {} failed.'.format(len(inputfiles), len(failed)))
+for f in failed: print('  - {}'.format(f))
+if len(failed)>0: sys.exit(1)
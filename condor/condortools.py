@@ -93,7 +93,7 @@ def makeJobDescription(name, exe,
         f.write(f"output = {current_dir}/{logfolder}/{stdout}\n")
         f.write(f"error = {current_dir}/{logfolder}/{stderr}\n")
         f.write(f"log = {current_dir}/{logfolder}/{log}\n\n")
-        # f.write('request_cpus = {}\n'.format(cpus)) # don't specify if not necessary
+        if cpus > 1: f.write('request_cpus = {}\n'.format(cpus)) # don't specify if not necessary
         # f.write('request_memory = {}\n'.format(mem)) # don't specify if not necessary
         # f.write('request_disk = {}\n\n'.format(disk)) # don't specify if not necessary
         # f.write('should_transfer_files = yes\n\n')
@@ -21,6 +21,10 @@
 #   If you have sourced the 'source.sh' script in the project's main directory,
 #   you can simply run 'jobCheck [+args]' from anywhere, 
 #   without specifying "python" or the path to this script.
+#   With '--ledger', the files of failed jobs submitted with condor/submit.py
+#   are marked as failed in the job ledger of their production
+#   (found through the tag written by each job, see jobledger.py),
+#   so that they are resubmitted with 'submit.py --resubmit <ledger>'.
 # Note:
 #   Should work for both condor and qsub log files.
 #   The latter has not been used in a long time however, so not sure.
@@ -31,6 +35,8 @@ import os
 import argparse
 import glob
 
+import jobledger as jl
+
 
 def check_start_done( filename, 
                       starting_tag='###starting###',
@@ -126,6 +132,8 @@ if __name__=='__main__':
                         help='Ignore starting and done tags, only check for errors.')
     parser.add_argument('--noerrors', action='store_true',
                         help='Ignore errors, only check starting and done tags.')
+    parser.add_argument('--ledger', action='store_true',
+                        help='Mark the files of failed jobs as failed in their job ledger (see jobledger.py).')
     args = parser.parse_args()
 
     # print arguments
@@ -147,6 +155,7 @@ if __name__=='__main__':
 
     # loop over files
     nerror = 0
+    failedjobs = {}
     for fname in files:
         # initialize
         error_start_done = 0
@@ -160,8 +169,25 @@ if __name__=='__main__':
         if not args.noerrors: 
             error_content = check_error_content(fname)
         if(error_start_done + error_content > 0): nerror += 1
+        # collect the ledger entries of failed jobs
+        if( args.ledger and error_start_done + error_content > 0 ):
+            with open(fname) as f: tags = jl.parsejobtags(f.read())
+            for (ledgerfile, jobid) in tags:
+                if ledgerfile not in failedjobs: failedjobs[ledgerfile] = []
+                failedjobs[ledgerfile].append((jobid, fname))
 
     # print results
     print('number of files scanned: {}'.format(nfiles))
     print('number of files with error: {}'.format(nerror))
     print('number of files without apparent error: {}'.format(nfiles-nerror))
+
+    # update the job ledgers
+    for ledgerfile, jobs in sorted(failedjobs.items()):
+        if not os.path.exists(ledgerfile):
+            print('WARNING: ledger {} not found, skipping.'.format(ledgerfile))
+            continue
+        ledger = jl.readledger(ledgerfile)
+        nfailed = 0
+        for (jobid, fname) in jobs: nfailed += jl.markfailed(ledger, jobid, log=fname)
+        jl.writeledger(ledger, ledgerfile)
+        print('marked {} files of {} jobs as failed in ledger {}'.format(nfailed, len(jobs), ledgerfile))
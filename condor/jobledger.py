@@ -0,0 +1,157 @@
+#
+# functionality for keeping track of the jobs of a production in a json ledger #
+#
+
+# general use:
+# for each production (i.e. one dataset submitted with submit.py), a ledger is written
+# that records for each input file its expected output file, the job it was submitted in,
+# the number of submission attempts and its status.
+# the status of the files can be updated by checking their output files
+# ('done' if the output file exists and can be read, 'missing' or 'corrupt' otherwise),
+# and by the results of jobcheck.py (files of jobs with errors in their logs
+# and without a valid output file are marked 'failed').
+# a resubmission (submit.py --resubmit <ledger>) only submits the files that are not done,
+# into the same output directory as the original submission.
+# each job writes a tag with the ledger and its job id to its error log,
+# so that jobcheck.py can find the ledger entries that belong to a log file, e.g.:
+#   echo "###starting### jobledger /path/to/ledger.json 0.12" >&2
+# example:
+#   ledger = newledger(dataset, outputdir, options)
+#   jobids = addsubmission(ledger, jobs)
+#   writeledger(ledger, 'ledgers/production.json')
+
+import os
+import json
+import time
+
+
+LEDGER_VERSION = 1
+
+# tag written by each job to its error log
+# (the starting tag of jobcheck.py, followed by the ledger and the job id)
+STARTING_TAG = '###starting###'
+LEDGER_TAG = 'jobledger'
+
+
+def newledger(dataset, outputdir, options):
+    # make a new (empty) ledger for a production
+    # options is a dict with the options needed to remake the job commands
+    return {'version': LEDGER_VERSION,
+            'dataset': dataset,
+            'outputdir': outputdir,
+            'created': time.time(),
+            'options': options,
+            'submissions': [],
+            'files': {}}
+
+
+def readledger(ledgerfile):
+    # read a ledger from a json file
+    with open(ledgerfile) as f: ledger = json.load(f)
+    if ledger.get('version')!=LEDGER_VERSION:
+        msg = 'ERROR: ledger {} has version {},'.format(ledgerfile, ledger.get('version'))
+        msg += ' while version {} is expected.'.format(LEDGER_VERSION)
+        raise Exception(msg)
+    return ledger
+
+
+def writeledger(ledger, ledgerfile):
+    # write a ledger to a json file
+    # (first to a temporary file, so that the ledger is never left half-written)
+    ledgerdir = os.path.dirname(os.path.abspath(ledgerfile))
+    if not os.path.exists(ledgerdir): os.makedirs(ledgerdir)
+    tmpfile = ledgerfile + '.tmp'
+    with open(tmpfile, 'w') as f: json.dump(ledger, f, indent=2)
+    os.replace(tmpfile, ledgerfile)
+
+
+def outputfile(ledger, inputfile):
+    # get the expected output file for an input file
+    return os.path.join(ledger['outputdir'], os.path.basename(inputfile))
+
+
+def addsubmission(ledger, jobs):
+    # add a submission of a list of jobs (each job is a list of input files)
+    # returns the list of job ids (of the form <submission>.<job>)
+    isubmission = len(ledger['submissions'])
+    jobids = ['{}.{}'.format(isubmission, ijob) for ijob in range(len(jobs))]
+    ledger['submissions'].append({'time': time.time(),
+                                  'jobs': dict(zip(jobids, jobs))})
+    for jobid, job in zip(jobids, jobs):
+        for inputfile in job:
+            entry = ledger['files'].get(inputfile, {'attempts': 0})
+            entry['output'] = outputfile(ledger, inputfile)
+            entry['job'] = jobid
+            entry['attempts'] += 1
+            entry['status'] = 'submitted'
+            entry.pop('log', None)
+            ledger['files'][inputfile] = entry
+    return jobids
+
+
+def checkoutput(path, treename='Events'):
+    # check an output file
+    # returns 'done' if it exists and its tree can be read, 'missing' or 'corrupt' otherwise
+    if not os.path.exists(path): return 'missing'
+    if os.path.getsize(path)==0: return 'corrupt'
+    try:
+        import uproot
+        with uproot.open(path) as f:
+            if treename not in f: return 'corrupt'
+            f[treename].num_entries
+    except Exception: return 'corrupt'
+    return 'done'
+
+
+def updatestatus(ledger):
+    # update the status of all files in a ledger by checking their output files
+    # (files marked as failed by jobcheck.py keep that status unless their output is valid)
+    # returns a dict with the number of files per status
+    for entry in ledger['files'].values():
+        status = checkoutput(entry['output'])
+        if( status=='missing' and entry['status']=='failed' ): continue
+        entry['status'] = status
+    return countstatus(ledger)
+
+
+def countstatus(ledger):
+    # get the number of files per status
+    counts = {}
+    for entry in ledger['files'].values():
+        counts[entry['status']] = counts.get(entry['status'], 0) + 1
+    return counts
+
+
+def markfailed(ledger, jobid, log=None):
+    # mark the files of a job that do not have a valid output file as failed
+    # (used by jobcheck.py for jobs with errors in their logs)
+    # returns the number of files marked as failed
+    nfailed = 0
+    for entry in ledger['files'].values():
+        if entry.get('job')!=jobid: continue
+        if checkoutput(entry['output'])=='done': continue
+        entry['status'] = 'failed'
+        if log is not None: entry['log'] = log
+        nfailed += 1
+    return nfailed
+
+
+def pendingfiles(ledger):
+    # get the input files that are not done (in their original order)
+    return [f for f, entry in ledger['files'].items() if entry['status']!='done']
+
+
+def jobtag(ledgerfile, jobid):
+    # get the tag to write to the error log of a job
+    return '{} {} {} {}'.format(STARTING_TAG, LEDGER_TAG, os.path.abspath(ledgerfile), jobid)
+
+
+def parsejobtags(text):
+    # find the job tags in the content of an error log
+    # returns a list of (ledger file, job id)
+    tags = []
+    for line in text.splitlines():
+        parts = line.split()
+        if( len(parts)==4 and parts[0]==STARTING_TAG and parts[1]==LEDGER_TAG ):
+            tags.append((parts[2], parts[3]))
+    return tags
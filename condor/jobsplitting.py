@@ -0,0 +1,138 @@
+#
+# functionality for splitting input files into jobs with a balanced workload #
+#
+
+# general use:
+# instead of chopping the list of input files in batches of a fixed number of files,
+# the files are bin-packed into jobs based on an estimate of their cost:
+# the number of events in their Events tree (read from the metadata with uproot),
+# or their size on disk if the number of events is not read.
+# the number of jobs follows from a target per job (number of files, number of events,
+# or runtime, the latter using a measured throughput in events per second),
+# and each file is assigned to the job with the lowest estimated cost so far,
+# starting from the most expensive files (longest-processing-time-first scheduling),
+# so that the longest job is close to the typical job instead of dominating the total runtime.
+# example:
+#   infos = getfileinfo(files, readentries=True)
+#   jobs = splitjobs(infos, eventsperjob=1e6)
+# the measured throughput can be taken from the performance summaries of earlier runs
+# (see python/processing/profiling.py), e.g.:
+#   eventspersecond = measuredthroughput(['/path/to/earlier/output'])
+
+import os
+import json
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+
+def getnentries(inputfile, treename='Events'):
+    # get the number of entries in the tree of a file
+    # (only the metadata of the tree is read)
+    import uproot
+    with uproot.open(inputfile) as f:
+        if treename not in f: return 0
+        return f[treename].num_entries
+
+
+def getfileinfo(files, readentries=False, nthreads=8):
+    # get the size (and optionally the number of entries) of each file
+    # returns a list of dicts with keys 'file', 'size' and 'nentries'
+    # (nentries is None if not read or if reading failed)
+    infos = [{'file': f, 'size': os.path.getsize(f), 'nentries': None} for f in files]
+    if readentries:
+        def read(info):
+            try: info['nentries'] = getnentries(info['file'])
+            except Exception as e:
+                print('WARNING: could not read number of entries of {}: {}'.format(info['file'], e))
+        with ThreadPoolExecutor(max_workers=nthreads) as executor:
+            list(executor.map(read, infos))
+    return infos
+
+
+def measuredthroughput(inputs):
+    # get the measured throughput (in events per second) from earlier runs
+    # inputs is a list of directories (searched recursively) or files
+    # with performance summaries (.perf.json files, see python/processing/profiling.py)
+    # returns None if no summaries are found
+    jsonfiles = []
+    for inp in inputs:
+        if os.path.isdir(inp):
+            for root, dirs, fnames in os.walk(inp):
+                jsonfiles += [os.path.join(root, f) for f in fnames if f.endswith('.perf.json')]
+        elif os.path.exists(inp): jsonfiles.append(inp)
+    nevents = 0
+    walltime = 0.
+    for jsonfile in jsonfiles:
+        with open(jsonfile) as f: summary = json.load(f)
+        nevents += summary['nevents']
+        walltime += summary['walltime']
+    if( nevents==0 or walltime<=0 ): return None
+    print('Measured throughput: {:.1f} events/s (from {} summaries)'.format(
+          nevents/walltime, len(jsonfiles)))
+    return nevents/walltime
+
+
+def filecost(info, eventsperbyte=None):
+    # estimated cost of a file (in number of events)
+    # if the number of entries was not read, it is estimated from the size,
+    # using the average number of events per byte of the files where it was read
+    # (or the size itself if not available)
+    if info['nentries'] is not None: return info['nentries']
+    if eventsperbyte is not None: return info['size']*eventsperbyte
+    return info['size']
+
+
+def splitjobs(infos, filesperjob=None, eventsperjob=None, runtimeperjob=None, eventspersecond=None):
+    # bin-pack files into jobs with a balanced estimated cost
+    # input arguments:
+    # - infos: list of file info dicts (see getfileinfo)
+    # - filesperjob: target number of files per job (on average)
+    # - eventsperjob: target number of events per job
+    # - runtimeperjob: target runtime per job (in seconds), needs eventspersecond
+    # - eventspersecond: throughput (e.g. from measuredthroughput)
+    # (exactly one of filesperjob, eventsperjob and runtimeperjob must be given;
+    #  the number of jobs is determined from it, and the files are distributed
+    #  over the jobs to balance their cost)
+    # returns a list of jobs, where each job is a list of files (in their original order)
+    if len(infos)==0: return []
+    targets = [t for t in [filesperjob, eventsperjob, runtimeperjob] if t is not None]
+    if len(targets)!=1:
+        raise Exception('ERROR: exactly one of filesperjob, eventsperjob and runtimeperjob must be given.')
+    if runtimeperjob is not None:
+        if eventspersecond is None:
+            raise Exception('ERROR: a target runtime per job needs a throughput in events per second.')
+        eventsperjob = runtimeperjob*eventspersecond
+
+    # estimate the cost of each file
+    withentries = [info for info in infos if info['nentries'] is not None]
+    eventsperbyte = None
+    if( len(withentries)>0 and sum([info['size'] for info in withentries])>0 ):
+        eventsperbyte = ( float(sum([info['nentries'] for info in withentries]))
+                          / sum([info['size'] for info in withentries]) )
+    if( eventsperjob is not None and eventsperbyte is None ):
+        raise Exception('ERROR: a target number of events per job needs the number of entries of the files.')
+    costs = [filecost(info, eventsperbyte=eventsperbyte) for info in infos]
+
+    # determine the number of jobs
+    if filesperjob is not None: njobs = int(math.ceil(len(infos)/float(filesperjob)))
+    else: njobs = int(math.ceil(sum(costs)/float(eventsperjob)))
+    njobs = max(1, min(njobs, len(infos)))
+
+    # distribute the files over the jobs, most expensive files first
+    jobs = [[] for _ in range(njobs)]
+    jobcosts = [0.]*njobs
+    for i in sorted(range(len(infos)), key=lambda i: -costs[i]):
+        ijob = jobcosts.index(min(jobcosts))
+        jobs[ijob].append(i)
+        jobcosts[ijob] += costs[i]
+    jobs = [[infos[i]['file'] for i in sorted(job)] for job in jobs]
+
+    # print a summary
+    jobcosts = sorted(jobcosts)
+    unit = 'events' if eventsperbyte is not None else 'bytes'
+    print('Split {} files into {} jobs (estimated {} per job: min {:.3g}, median {:.3g}, max {:.3g})'.format(
+          len(infos), njobs, unit, jobcosts[0], jobcosts[len(jobcosts)//2], jobcosts[-1]))
+    if( eventspersecond is not None and eventsperbyte is not None ):
+        print('Estimated runtime per job: median {:.1f} min, max {:.1f} min'.format(
+              jobcosts[len(jobcosts)//2]/eventspersecond/60., jobcosts[-1]/eventspersecond/60.))
+    return jobs
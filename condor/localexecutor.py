@@ -0,0 +1,137 @@
+#
+# functionality for running commands locally in parallel, as an alternative to condor submission #
+#
+
+# general use:
+# commands are added as tasks to a LocalExecutor (one task is a list of commands
+# that are run sequentially in a bash shell, similar to the executable of a condor job),
+# and all tasks are run with a bounded number of parallel processes when calling run().
+# the output of each task is written to a log file, the exit codes are collected,
+# failed tasks can be retried, and a summary table is printed at the end.
+# the functions submitCommandAsLocalJob and submitCommandsAsLocalJobs mirror
+# the corresponding functions in condortools, so that they can be used as drop-in alternative
+# when the batch system is saturated, e.g.:
+#   executor = LocalExecutor(jobs=16)
+#   for cmd in cmds:
+#       submitCommandAsLocalJob('cjob_name', cmd, logfolder='local_logs', executor=executor)
+#   executor.run()
+
+import os
+import sys
+import time
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+
+class LocalTask(object):
+    # a single task: a list of commands run sequentially in a bash shell
+
+    def __init__(self, name, commands, logfile):
+        self.name = name
+        self.commands = commands
+        self.logfile = logfile
+        self.exitcode = None
+        self.attempts = 0
+        self.duration = 0.
+
+    def run(self):
+        # run the commands, stopping at the first failing one
+        # (note: the log file is overwritten at each attempt)
+        self.attempts += 1
+        script = ''.join(['{{ {}\n}} || exit $?\n'.format(cmd) for cmd in self.commands])
+        start = time.time()
+        with open(self.logfile, 'w') as log:
+            log.write('# attempt {}\n'.format(self.attempts))
+            for cmd in self.commands: log.write('# {}\n'.format(cmd))
+            log.flush()
+            proc = subprocess.run(['bash', '-c', script], stdout=log, stderr=subprocess.STDOUT)
+        self.duration = time.time() - start
+        self.exitcode = proc.returncode
+        return self.exitcode
+
+
+class LocalExecutor(object):
+    # run tasks locally with a bounded number of parallel processes
+
+    def __init__(self, jobs=None, logfolder='local_logs', retries=0, verbose=True):
+        # input arguments:
+        # - jobs: maximum number of tasks running in parallel (default: number of cores)
+        # - logfolder: folder for the log files of the tasks
+        # - retries: number of times to retry a failed task
+        # - verbose: print a line when a task finishes
+        self.jobs = jobs if jobs is not None else (os.cpu_count() or 1)
+        self.logfolder = logfolder
+        self.retries = retries
+        self.verbose = verbose
+        self.tasks = []
+
+    def submit(self, name, commands):
+        # add a task with a list of commands (or a single command)
+        # note: the task is only run when calling run()
+        if isinstance(commands, str): commands = [commands]
+        if not os.path.exists(self.logfolder): os.makedirs(self.logfolder)
+        name = os.path.splitext(name)[0]
+        logfile = os.path.join(self.logfolder, '{}_{}.log'.format(name, len(self.tasks)))
+        task = LocalTask(name, commands, logfile)
+        self.tasks.append(task)
+        return task
+
+    def runtask(self, task):
+        # run a single task, with retries if it fails
+        while True:
+            task.run()
+            if task.exitcode==0 or task.attempts>self.retries: break
+            if self.verbose:
+                print('Task {} failed with exit code {}, retrying...'.format(task.logfile, task.exitcode))
+        if self.verbose:
+            status = 'finished' if task.exitcode==0 else 'failed (exit code {})'.format(task.exitcode)
+            print('Task {} {} in {:.1f} s'.format(task.logfile, status, task.duration))
+        return task
+
+    def run(self):
+        # run all tasks that were not run yet
+        # returns:
+        # the number of failed tasks
+        tasks = [task for task in self.tasks if task.exitcode is None]
+        if len(tasks)==0: return 0
+        print('Running {} tasks with {} parallel processes...'.format(len(tasks), self.jobs))
+        # (note: threads are sufficient here, as the work is done in subprocesses)
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            list(executor.map(self.runtask, tasks))
+        self.printsummary(tasks)
+        return len([task for task in tasks if task.exitcode!=0])
+
+    def printsummary(self, tasks=None):
+        # print a summary table of the tasks
+        if tasks is None: tasks = self.tasks
+        nfailed = len([task for task in tasks if task.exitcode!=0])
+        print('Summary of local tasks ({} finished, {} failed):'.format(len(tasks)-nfailed, nfailed))
+        print('  {:<8} {:>9} {:>8} {:>10}  {}'.format('status', 'exit code', 'attempts', 'time (s)', 'log file'))
+        for task in tasks:
+            status = 'ok' if task.exitcode==0 else 'FAILED'
+            print('  {:<8} {:>9} {:>8} {:>10.1f}  {}'.format(
+                  status, task.exitcode, task.attempts, task.duration, task.logfile))
+
+
+def submitCommandAsLocalJob(name, command,
+    stdout=None, stderr=None, log=None,
+    cpus=1, mem=1024, disk=10240,
+    scriptfolder="", logfolder="", executor=None):
+    # add a single command as a task to a local executor
+    # (same arguments as condortools.submitCommandAsCondorJob;
+    #  the arguments stdout, stderr, log, cpus, mem, disk and scriptfolder are ignored,
+    #  the logfolder is only used if no executor is given)
+    # note: if no executor is given, the command is run immediately.
+    submitCommandsAsLocalJobs(name, [[command]], logfolder=logfolder, executor=executor)
+
+
+def submitCommandsAsLocalJobs(name, commands,
+    stdout=None, stderr=None, log=None,
+    cpus=1, mem=1024, disk=10240,
+    scriptfolder="", logfolder="", executor=None):
+    # add multiple sets of commands as tasks to a local executor (one task per set)
+    # (same arguments as condortools.submitCommandsAsCondorJobs, see submitCommandAsLocalJob)
+    runnow = (executor is None)
+    if runnow: executor = LocalExecutor(jobs=1, logfolder=logfolder if logfolder else 'local_logs')
+    for commandset in commands: executor.submit(name, commandset)
+    if runnow: executor.run()
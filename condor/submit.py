@@ -13,6 +13,8 @@ from datetime import datetime
 
 # local imports
 import condortools as ct
+from jobsplitting import getfileinfo, measuredthroughput, splitjobs
+import jobledger as jl
 
 
 def hascmsenv():
@@ -22,76 +24,187 @@ def hascmsenv():
     return False
 
 
+def makejobcommands(files, options, outputdir, tag):
+    ### make the commands for a single job
+    # note: the processor sets up the modules only once and then loops over the files,
+    #       so that the startup cost is paid once per job instead of once per file
+    cmd = "python {}".format(options['processor'])
+    cmd += " -i {}".format(' '.join(files))
+    cmd += " -n {}".format(options['nentries'])
+    if options['sidecar']: cmd += " --sidecar"
+    if options['profile']: cmd += " --profile"
+    if options['profilehist']: cmd += " --profilehist"
+    if options['ncores'] > 1: cmd += " --ncores {}".format(options['ncores'])
+    # add a default command for copying files from tmpdir to outdir
+    # (note: preserve the modification times, as sidecar files are only
+    #  considered valid if the modification time of the ROOT file is unchanged)
+    copy_cmd = "cp -p $TMPDIR/* {}/".format(outputdir)
+    # write the starting and done tags to the error log (see jobcheck.py),
+    # where the starting tag also identifies the job in the ledger (see jobledger.py)
+    return ['echo "{}" >&2'.format(tag),
+            cmd + ' && echo "###done###" >&2',
+            copy_cmd]
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Submit skimmer via HTCondor')
-    parser.add_argument('-s', '--samplelist', required=True, type=os.path.abspath,
+    parser.add_argument('-s', '--samplelist', default=None, type=os.path.abspath,
                         help='File with dataset names to process.'
                             +' Note: each dataset must be a locally accessible path (i.e. on /pnfs or your /user).')
+    parser.add_argument('-r', '--resubmit', default=None, nargs='+',
+                        help='Ledger file(s) of earlier submissions (instead of --samplelist);'
+                            +' only the files without a valid output are submitted again.')
+    parser.add_argument('-l', '--ledgerdir', default='ledgers',
+                        help='Directory to write the ledgers of new submissions to (default: ledgers).')
     parser.add_argument('-p', '--processor', default='condor/condorrun.py',
-                        help='Python script to run on each file (default: condorrun.py in the condor subdirectory).')
+                        help='Python script to run on each batch of files, taking the input files with -i'
+                            +' (default: condorrun.py in the condor subdirectory).')
     parser.add_argument('-o', '--outputdir', default=f'/pnfs/iihe/cms/store/user/{os.getenv("USER")}/nanoaodskims',
                         help='Output directory (default: <your pnfs space>/nanoaodskims)')
     parser.add_argument('-n', '--nentries', default=-1, type=int,
                         help='Number of entries to process per unit')
-    parser.add_argument('-b', '--batchsize', default=50,
-                        help='Number of files processed in each job.')
+    parser.add_argument('-b', '--batchsize', default=50, type=int,
+                        help='Number of files processed in each job (on average;'
+                            +' the files are distributed over the jobs to balance their size).')
+    parser.add_argument('--eventsperjob', default=None, type=int,
+                        help='Target number of events per job (instead of --batchsize).')
+    parser.add_argument('--runtimeperjob', default=None, type=float,
+                        help='Target runtime per job in minutes (instead of --batchsize),'
+                            +' needs --eventspersecond or --perfinputs.')
+    parser.add_argument('--eventspersecond', default=None, type=float,
+                        help='Throughput per job in events per second, for --runtimeperjob.')
+    parser.add_argument('--perfinputs', default=None, nargs='+',
+                        help='Directories with performance summaries of earlier runs (see --profile),'
+                            +' to measure the throughput for --runtimeperjob.')
+    parser.add_argument('--readentries', default=False, action='store_true',
+                        help='Balance the jobs in number of events rather than file size'
+                            +' (automatic with --eventsperjob and --runtimeperjob).')
+    parser.add_argument('--sidecar', default=False, action='store_true',
+                        help='Write a sidecar file with the event keys next to each output file.')
+    parser.add_argument('--profile', default=False, action='store_true',
+                        help='Profile the modules and store a timing summary with each output file.')
+    parser.add_argument('--profilehist', default=False, action='store_true',
+                        help='With --profile, also store per-event latency histograms.')
+    parser.add_argument('--ncores', default=1, type=int,
+                        help='Number of cores per job (the files of a job, or entry ranges within them,'
+                            +' are split over this number of worker processes).')
     args = parser.parse_args()
 
-    # read datasets
-    datasets = [dataset.strip() for dataset in open(args.samplelist)]          
-    datasets = [dataset.split()[0] for dataset in datasets if dataset and not dataset.startswith('#')]
-    print('Found following datasets:')
-    for d in datasets: print('  - {}'.format(d))
-
-    # set output directory
-    outputbase = args.outputdir
-
-    # get current time (for formatting output directory)
-    dateTimeObj = datetime.now()
-    datestring = dateTimeObj.strftime("%Y%m%d_%H%M%S")
-
-    for dataset in datasets:
-        
-        # format output directory
-        dataset = dataset.rstrip('/')
-        split_dataset = dataset.split('/')[-1]
-        outputdir = os.path.join(outputbase, split_dataset, datestring)
-        if not os.path.exists(outputdir): os.makedirs(outputdir)
-
-        # find all files in the provided dataset directory
-        # note: this part is based on a convention where the dataset might
-        #       contain an arbitrarily deep chain of subfolders,
-        #       but always only one at each level
-        #       (until the final depth with the actual root files is reached).
-        #       this might need an update in the future, e.g. using os.walk.
-        datasetcontent = os.listdir(dataset)
-        while os.path.isdir(os.path.join(dataset, datasetcontent[0])):
-            dataset = os.path.join(dataset, datasetcontent[0])
+    # check arguments
+    if( args.samplelist is None and args.resubmit is None ):
+        raise Exception('ERROR: either --samplelist or --resubmit must be provided.')
+
+    # set the job splitting parameters
+    # (see jobsplitting.py)
+    filesperjob = args.batchsize
+    readentries = args.readentries
+    runtimeperjob = None
+    eventspersecond = args.eventspersecond
+    if( args.eventsperjob is not None or args.runtimeperjob is not None ):
+        filesperjob = None
+        readentries = True
+    if args.runtimeperjob is not None:
+        runtimeperjob = args.runtimeperjob*60.
+        if( eventspersecond is None and args.perfinputs is not None ):
+            eventspersecond = measuredthroughput(args.perfinputs)
+        if eventspersecond is None:
+            raise Exception('ERROR: --runtimeperjob needs --eventspersecond or --perfinputs'
+                            +' (with performance summaries).')
+
+    # find the files to submit for each production
+    # (a production is a dataset submitted into one output directory,
+    #  with a ledger keeping track of its files, see jobledger.py)
+    productions = []
+
+    # case of resubmission: take the files without a valid output from the ledger
+    # (note: make sure that no jobs of the earlier submission are still running)
+    if args.resubmit is not None:
+        for ledgerfile in args.resubmit:
+            ledger = jl.readledger(ledgerfile)
+            counts = jl.updatestatus(ledger)
+            print('Status of {}: {}'.format(ledgerfile,
+                  ', '.join(['{} {}'.format(n, status) for status, n in sorted(counts.items())])))
+            # remove corrupt output files (and files next to them), so that they can be replaced
+            for entry in ledger['files'].values():
+                if entry['status']!='corrupt': continue
+                for ext in ['.root', '.evtidx.npz', '.perf.json']:
+                    f = os.path.splitext(entry['output'])[0] + ext
+                    if os.path.exists(f): os.remove(f)
+            files = jl.pendingfiles(ledger)
+            jl.writeledger(ledger, ledgerfile)
+            if len(files)==0:
+                print('All files are done, nothing to resubmit.')
+                continue
+            productions.append((ledger, ledgerfile, files))
+
+    # case of new submission: take all files in the datasets
+    else:
+        # read datasets
+        datasets = [dataset.strip() for dataset in open(args.samplelist)]
+        datasets = [dataset.split()[0] for dataset in datasets if dataset and not dataset.startswith('#')]
+        print('Found following datasets:')
+        for d in datasets: print('  - {}'.format(d))
+
+        # set output directory
+        outputbase = args.outputdir
+
+        # get current time (for formatting output directory)
+        dateTimeObj = datetime.now()
+        datestring = dateTimeObj.strftime("%Y%m%d_%H%M%S")
+
+        # set the options for the job commands
+        # (stored in the ledger, so that resubmissions use the same ones)
+        options = {'processor': args.processor,
+                   'nentries': args.nentries,
+                   'sidecar': args.sidecar,
+                   'profile': args.profile,
+                   'profilehist': args.profilehist,
+                   'ncores': args.ncores}
+
+        for dataset in datasets:
+
+            # format output directory
+            dataset = dataset.rstrip('/')
+            split_dataset = dataset.split('/')[-1]
+            outputdir = os.path.join(outputbase, split_dataset, datestring)
+            if not os.path.exists(outputdir): os.makedirs(outputdir)
+
+            # find all files in the provided dataset directory
+            # note: this part is based on a convention where the dataset might
+            #       contain an arbitrarily deep chain of subfolders,
+            #       but always only one at each level
+            #       (until the final depth with the actual root files is reached).
+            #       this might need an update in the future, e.g. using os.walk.
             datasetcontent = os.listdir(dataset)
+            while os.path.isdir(os.path.join(dataset, datasetcontent[0])):
+                dataset = os.path.join(dataset, datasetcontent[0])
+                datasetcontent = os.listdir(dataset)
+
+            # make sure they are indeed nanoAOD files
+            datasetcontent = glob.glob(os.path.join(dataset, "*NanoAOD*.root"))
+
+            # make a new ledger
+            ledger = jl.newledger(dataset, outputdir, options)
+            ledgerfile = os.path.join(args.ledgerdir, '{}_{}.json'.format(split_dataset, datestring))
+            productions.append((ledger, ledgerfile, datasetcontent))
 
-        # make sure they are indeed nanoAOD files
-        datasetcontent = glob.glob(os.path.join(dataset, "*NanoAOD*.root"))
+    # submit the productions
+    for (ledger, ledgerfile, files) in productions:
 
-        cmds = []
-        for file in datasetcontent:
-            cmd = "python {}".format(args.processor)
-            cmd += " -i {}".format(file)
-            cmd += " -n {}".format(args.nentries)
-            cmds.append(cmd)
+        # split the files into jobs with a balanced workload
+        infos = getfileinfo(sorted(files), readentries=readentries)
+        jobfiles = splitjobs(infos, filesperjob=filesperjob, eventsperjob=args.eventsperjob,
+                             runtimeperjob=runtimeperjob, eventspersecond=eventspersecond)
 
-        # add a default command for copying files from tmpdir to outdir
-        copy_cmd = "cp $TMPDIR/* {}/".format(outputdir)
+        # record the jobs in the ledger (before submitting them)
+        jobids = jl.addsubmission(ledger, jobfiles)
+        jl.writeledger(ledger, ledgerfile)
+        print('Ledger written to {}'.format(ledgerfile))
 
+        # make the commands and submit them
+        options = ledger['options']
         batched = []
-        batchsize = args.batchsize
-        i=0
-        while i * batchsize < len(cmds):
-            batch = []
-            if ((i+1)* batchsize > len(cmds)):
-                batch.extend(cmds[i * batchsize:])
-            else:
-                batch.extend(cmds[i * batchsize:(i+1) * batchsize])
-            batch.append(copy_cmd)
-            i += 1
-            batched.append(batch)
-        ct.submitCommandsetsAsCondorCluster("SkimNano", batched, scriptfolder="Scripts/condor/")
+        for jobid, files in zip(jobids, jobfiles):
+            tag = jl.jobtag(ledgerfile, jobid)
+            batched.append(makejobcommands(files, options, ledger['outputdir'], tag))
+        ct.submitCommandsetsAsCondorCluster("SkimNano", batched, cpus=options['ncores'], scriptfolder="Scripts/condor/")
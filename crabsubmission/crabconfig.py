@@ -16,6 +16,7 @@ dataset = os.environ['CRAB_DATASET']
 outputDir = os.environ['CRAB_OUTPUTDIR']
 processor = os.environ['CRAB_PROCESSOR']
 script = os.environ['CRAB_SCRIPT']
+ncores = int(os.environ.get('CRAB_NCORES', 1))
 (_, sample, version, tier) = dataset.split('/')
 # (first value is just an empty string because dataset starts with /)
 shortsample = sample.split('_')[0]
@@ -58,7 +59,11 @@ config.JobType.outputFiles             = ['skimmed.root']
 config.JobType.sendExternalFolder      = True
 # config.JobType.sendPythonFolder        = True
 config.JobType.allowUndistributedCMSSW = True
-config.JobType.numCores                = 1
+config.JobType.numCores                = ncores
+# (note: with more than one core, the input of each job is split over
+#  this number of worker processes in crabrun.py, see processing/sharding.py)
+if ncores > 1: config.JobType.maxMemoryMB = 2000 * ncores
+# (note: each worker process needs its own memory, so scale the default of 2000 MB)
 config.JobType.maxJobRuntimeMin        = 1315 if 'SIM' in dataset else 2630
 # (note: default is 1315, which appears to be slightly too short
 #  for some data files, so used double runtime limit here)
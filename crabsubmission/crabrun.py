@@ -2,6 +2,7 @@
 
 # imports
 import os, sys
+import time
 import argparse
 import ROOT
 ROOT.PyConfig.IgnoreCommandLineOptions = True # (?)
@@ -9,6 +10,7 @@ ROOT.PyConfig.IgnoreCommandLineOptions = True # (?)
 # import tools from NanoAODTools
 from PhysicsTools.NanoAODTools.postprocessing.framework.postprocessor import PostProcessor
 from PhysicsTools.NanoAODTools.postprocessing.framework.crabhelper import inputFiles
+from PhysicsTools.NanoAODTools.postprocessing.framework.jobreport import JobReport
 import PhysicsTools.NanoAODTools.postprocessing.modules.jme.jetmetHelperRun2 as jme
 import PhysicsTools.NanoAODTools.postprocessing.modules.common.muonScaleResProducer as muoncorr
 
@@ -20,12 +22,24 @@ from PhysicsTools.nanoSkimming.processing.leptonvariables import LeptonVariables
 from PhysicsTools.nanoSkimming.processing.topleptonmva import TopLeptonMvaModule
 from PhysicsTools.nanoSkimming.processing.leptongenvariables import LeptonGenVariablesModule
 from PhysicsTools.nanoSkimming.processing.triggervariables import TriggerVariablesModule
+from PhysicsTools.nanoSkimming.processing.pipelineplanner import planmodules
+from PhysicsTools.nanoSkimming.processing.profiling import ChainProfiler, writesummary
+from PhysicsTools.nanoSkimming.processing.sharding import makeshards, writeshards, readshards, runshards
+from PhysicsTools.nanoSkimming.processing.sharding import shardoutputdir, partialoutputs, mergeoutputs
+from PhysicsTools.nanoSkimming.processing.sharding import mergeshardsummaries, removeshards
 from PhysicsTools.nanoSkimming.tools.sampletools import getsampleparams
+from PhysicsTools.nanoSkimming.tools.lumitools import getentryspan
 
 
 # read command line arguments
 parser = argparse.ArgumentParser(description='Submit via CRAB')
 parser.add_argument('-n', '--nentries', default=-1, type=int)
+parser.add_argument('--profile', default=False, action='store_true')
+parser.add_argument('--profilehist', default=False, action='store_true')
+parser.add_argument('--planreport', default=False, action='store_true')
+parser.add_argument('--ncores', default=1, type=int)
+parser.add_argument('--shardfile', default=None) # (internal, see processing/sharding.py)
+parser.add_argument('--shard', default=None, type=int) # (internal, see processing/sharding.py)
 args, unknown = parser.parse_known_args()
 
 # print arguments
@@ -41,6 +55,14 @@ outputdir = '.'
 # (must be set to current directory for CRAB jobs to run properly;
 #  the actual correct output directory is managed by CRAB)
 
+# in a worker process, only process the shard assigned to it
+# (see the splitting over worker processes below)
+shard = None
+if args.shard is not None:
+    shard = readshards(args.shardfile)[args.shard]
+    inputfiles = [inputfile for (inputfile, _, _) in shard]
+    outputdir = shardoutputdir(outputdir, args.shard)
+
 # get sample parameters
 # (note: no check is done on consistency between samples,
 #  only first sample is used)
@@ -75,6 +97,39 @@ if dtype=='data':
     if not os.path.exists(jsonfile):
         raise Exception('ERROR: json file not found.')
 
+# define entry range to process
+# (for data, a pre-pass over the run and luminosityBlock branches
+#  finds the first and last entry in a certified lumisection,
+#  so that leading and trailing uncertified stretches are not read at all.)
+def getentryrange(inputfile):
+    firstentry = 0
+    maxentries = None if args.nentries<=0 else args.nentries
+    if jsonfile is None: return (firstentry, maxentries)
+    try: span = getentryspan(inputfile, jsonfile)
+    except Exception as e:
+        print('WARNING: json pre-pass failed ({}), will process all entries.'.format(e))
+        return (firstentry, maxentries)
+    if span is None:
+        print('Json pre-pass: no certified lumisection found, will process no entries.')
+        return (0, 0)
+    firstentry = span[0]
+    nspan = span[1] - span[0]
+    maxentries = nspan if maxentries is None else min(maxentries, nspan)
+    print('Json pre-pass: will process entries {} to {}.'.format(firstentry, firstentry+maxentries))
+    return (firstentry, maxentries)
+
+def getcut(maxentries):
+    # get the cut to pass to the PostProcessor for an entry range
+    # (a zero-entry range is processed with a cut that rejects all events,
+    #  so that an empty output tree is still written;
+    #  maxEntries=0 cannot be used for this, as the PostProcessor treats it as no limit)
+    return '0' if maxentries==0 else None
+
+firstentry = 0
+maxentries = None if args.nentries<=0 else args.nentries
+if( len(inputfiles)==1 and shard is None ):
+    (firstentry, maxentries) = getentryrange(inputfiles[0])
+
 # define branches to drop and keep
 dropbranches = '../data/dropbranches/hhto4b.txt'
 if not os.path.exists(dropbranches):
@@ -83,6 +138,43 @@ if not os.path.exists(dropbranches):
 if not os.path.exists(dropbranches):
     raise Exception('ERROR: dropbranches file not found.')
 
+# split the processing over multiple worker processes if requested
+# (each worker re-runs this script on its own shard of the input files or entry ranges,
+#  with its own modules; the partial outputs are merged again into a single output file,
+#  and the job report is written for it, see processing/sharding.py)
+if( args.ncores>1 and args.shard is None ):
+    starttime = time.time()
+    entryranges = {inputfiles[0]: (firstentry, maxentries)}
+    if len(inputfiles)>1: entryranges = dict([(f, getentryrange(f)) for f in inputfiles])
+    shards = makeshards(inputfiles, args.ncores, entryranges=entryranges)
+    shardfile = 'shards.json'
+    writeshards(shards, shardfile)
+    print('Processing {} file(s) with {} worker processes.'.format(len(inputfiles), len(shards)))
+    exitcodes = runshards([sys.executable] + sys.argv + ['--shardfile', shardfile], len(shards), outputdir)
+    nfailed = len([code for code in exitcodes if code!=0])
+    if nfailed>0:
+        raise Exception('ERROR: {} out of {} worker processes failed.'.format(nfailed, len(shards)))
+    partialfiles = []
+    for (_, files) in partialoutputs(shards, outputdir): partialfiles += files
+    summary = None
+    if args.profile: summary = mergeshardsummaries(partialfiles, time.time()-starttime)
+    mergeoutputs(haddname, partialfiles)
+    if summary is not None:
+        summary['inputfiles'] = inputfiles
+        summary['outputfile'] = haddname
+        summary['outputsize'] = os.path.getsize(haddname)
+        writesummary(summary, haddname)
+    if jobreport:
+        report = JobReport()
+        for inputfile in inputfiles:
+            nevents = sum([n for s in shards for (f, _, n) in s if f==inputfile])
+            report.addInputFile(inputfile, nevents)
+        report.addOutputFile(haddname)
+        report.save()
+    removeshards(outputdir, len(shards))
+    os.remove(shardfile)
+    sys.exit(0)
+
 # set up JetMET module
 yeardict = {
     '2016PreVFP': 'UL2016_preVFP',
@@ -143,12 +235,56 @@ modules += ([
     muonCorrector
 ])
 if dtype!='data': modules.append(LeptonGenVariablesModule())
+
+# plan the order of the modules
+# (filters first, so that producers only run for events that pass them;
+#  see processing/pipelineplanner.py)
+# (the branch read volume is only estimated on request,
+#  as it needs an extra read of the first input file, and only once for multi-core jobs)
+planreportfile = inputfiles[0] if( args.planreport and args.shard in [None, 0] ) else None
+modules = planmodules(modules, inputfile=planreportfile)
+
+# in a worker process, process each part of the shard separately,
+# without merging and job report (this is done afterwards for the full job)
+if shard is not None:
+    for (inputfile, firstentry, maxentries) in shard:
+        profiler = None
+        filemodules = modules
+        if args.profile:
+            profiler = ChainProfiler(modules, histogram=args.profilehist)
+            filemodules = profiler.modules
+        p = PostProcessor(
+            outputdir,
+            [inputfile],
+            modules = filemodules,
+            maxEntries = maxentries,
+            firstEntry = firstentry,
+            cut = getcut(maxentries),
+            postfix = '',
+            branchsel = dropbranches,
+            provenance = provenance,
+            jsonInput = jsonfile
+        )
+        p.run()
+        if profiler is not None:
+            profiler.write(os.path.join(outputdir, os.path.basename(inputfile)), inputfiles=[inputfile])
+    sys.exit(0)
+
+# profile the modules if requested
+# (see processing/profiling.py)
+profiler = None
+if args.profile:
+    profiler = ChainProfiler(modules, histogram=args.profilehist)
+    modules = profiler.modules
+
 # define a PostProcessor
 p = PostProcessor(
     outputdir,
     inputfiles,
     modules = modules,
-    maxEntries = None if args.nentries<=0 else args.nentries,
+    maxEntries = maxentries,
+    firstEntry = firstentry,
+    cut = getcut(maxentries),
     branchsel = dropbranches,
     fwkJobReport = jobreport,
     haddFileName = haddname,
@@ -158,3 +294,9 @@ p = PostProcessor(
 
 # run the PostProcessor
 p.run()
+
+# write the profiling summary into the merged output file
+# (only skimmed.root is retrieved from CRAB jobs, see crabconfig.py,
+#  so the summary is stored inside it as a TObjString named perfsummary)
+if profiler is not None:
+    profiler.write(haddname, inputfiles=inputfiles)
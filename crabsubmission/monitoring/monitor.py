@@ -129,7 +129,7 @@ def make_progress_bar(progress_values):
     return html
 
 
-def web( data, webpath, force=False ):
+def web( data, webpath, force=False, perfdata=None ):
     ### convert sample completion info into a html document for web display.
     # input arguments:
     # - data: a dictionary as generated by the main section.
@@ -147,6 +147,8 @@ def web( data, webpath, force=False ):
     # - webpath: directory where the resulting index.html file should be stored.
     #            if it does not exist yet, it will be created;
     #            if it already exists and contains an index.html file, that file will be overwritten.
+    # - perfdata: aggregated job performance data (see perfmonitor.py),
+    #             displayed below the sample status if provided.
 
     # initializations
     now = datetime.now()
@@ -240,6 +242,12 @@ def web( data, webpath, force=False ):
         page += '</tr>\n'
 
     page += '</table>\n'    
+
+    # add the performance overview
+    if perfdata is not None:
+        from perfmonitor import perfhtml
+        page += perfhtml(perfdata)
+
     page += '</body>\n'
     page += '</html>'
 
@@ -266,6 +274,9 @@ if __name__ == '__main__':
       help='Write web page even if the info for some samples could not be retrieved')
     parser.add_argument('--printraw', default=False, action='store_true',
       help='Print raw output of crab status command.')
+    parser.add_argument('--perfinputs', default=None, nargs='+', type=os.path.abspath,
+      help='Output directories to search for job performance summaries (see perfmonitor.py)'
+          +' (default: no performance overview)')
     args = parser.parse_args()
 
     # print arguments
@@ -413,6 +424,11 @@ if __name__ == '__main__':
     print('Loop over all samples completed.')
     print('Retrieved following data:')
     print(data)
-    web(data, webpath, force=args.force)
+    perfdata = None
+    if args.perfinputs is not None:
+        # (imported here since it needs NanoAODTools, see perfmonitor.py)
+        from perfmonitor import collectperf
+        perfdata = collectperf(args.perfinputs)
+    web(data, webpath, force=args.force, perfdata=perfdata)
     print('Sample status written to {}.'.format(webpath))
     print('Done.')
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+
+#####################################################################
+# collect the per-job performance summaries and make a web overview #
+#####################################################################
+
+# basic how to use:
+# - submit the jobs with the '--profile' option (see crabsubmission/submit.py or condor/submit.py),
+#   so that each output file contains a performance summary (see python/processing/profiling.py).
+# - run this script with 'python3 perfmonitor.py -i <output directories or files>'.
+#   the inputs can be directories (searched recursively for ROOT files and .perf.json files),
+#   single files, or glob patterns.
+# - the summaries are grouped per sample and era (taken from the input file names of each job)
+#   and the result is stored as a html document in ~/public_html/<webpage>/performance.html.
+# - the same overview can be added to the CRAB status page made by monitor.py,
+#   using its '--perfinputs' argument.
+# further notes on usage:
+# - run with 'python3 perfmonitor.py -h' for a list of all available args.
+# - the suggested CRAB settings (unitsPerJob and maxJobRuntimeMin, see crabconfig.py)
+#   are based on the 90% quantile of the wall time per input file
+#   and the maximum wall time per input file, for a given target job runtime.
+
+
+import os, sys, glob, json
+import math
+import argparse
+import numpy as np
+
+# import local tools
+from PhysicsTools.nanoSkimming.processing.profiling import readsummary, mergesummaries
+
+
+def findsummaries(inputs):
+    ### find all files that can contain a performance summary
+    # input arguments:
+    # - inputs: list of directories, files or glob patterns
+    # returns:
+    # a sorted list of files
+    # note: if both a ROOT file and its .perf.json file are found,
+    #       only the latter is used (it is faster to read and contains the same summary).
+    files = []
+    for inp in inputs:
+        if os.path.isdir(inp):
+            for root, dirs, fnames in os.walk(inp):
+                files += [os.path.join(root, f) for f in fnames
+                          if f.endswith('.root') or f.endswith('.perf.json')]
+        elif os.path.exists(inp): files.append(inp)
+        else: files += glob.glob(inp)
+    files = set(files)
+    jsonstems = set([f[:-len('.perf.json')] for f in files if f.endswith('.perf.json')])
+    files = [f for f in files if not( f.endswith('.root') and f[:-len('.root')] in jsonstems )]
+    return sorted(files)
+
+
+def readjobsummary(path):
+    ### read the performance summary of a single job
+    # returns:
+    # the summary as a dict (with the path added), or None if not available
+    summary = None
+    if path.endswith('.json'):
+        with open(path) as f: summary = json.load(f)
+    else:
+        try: summary = readsummary(path)
+        except Exception as e:
+            print('WARNING: could not read {}: {}'.format(path, e))
+    if summary is not None: summary['path'] = path
+    return summary
+
+
+def samplekey(summary):
+    ### determine the sample and era of a job
+    # (from the logical file name of the first input file, i.e.
+    #  /store/mc/<campaign>/<sample>/... or /store/data/<era>/<primary dataset>/...;
+    #  if not available, the directory structure of the output file is used instead)
+    inputfiles = summary.get('inputfiles', [])
+    if len(inputfiles)>0:
+        lfn = inputfiles[0]
+        if '/store/' in lfn:
+            parts = lfn[lfn.index('/store/'):].split('/')
+            if len(parts)>4: return (parts[4], parts[3])
+    parts = os.path.abspath(summary['path']).split('/')
+    return (parts[-3] if len(parts)>2 else '', parts[-2])
+
+
+def quantile(values, q):
+    ### quantile of a list of values (0 for an empty list)
+    if len(values)==0: return 0.
+    return float(np.quantile(values, q))
+
+
+def aggregate(summaries, targetruntime=8.):
+    ### aggregate the job summaries per sample and era
+    # input arguments:
+    # - summaries: list of job summaries (see readjobsummary)
+    # - targetruntime: target job runtime in hours, used for the suggested CRAB settings
+    # returns:
+    # a dict matching sample/era names to dicts with aggregated quantities
+    groups = {}
+    for summary in summaries:
+        (sample, era) = samplekey(summary)
+        groups.setdefault('{}/{}'.format(sample, era), []).append(summary)
+    perfdata = {}
+    for name, jobs in sorted(groups.items()):
+        merged = mergesummaries(jobs)
+        throughputs = [job['nevents']/job['walltime'] for job in jobs if job['walltime']>0]
+        walltimes = [job['walltime'] for job in jobs]
+        nfiles = [max(1, len(job.get('inputfiles', []))) for job in jobs]
+        walltimeperfile = [w/n for w, n in zip(walltimes, nfiles)]
+        # suggested CRAB settings
+        unitsperjob = max(1, int(targetruntime*3600./max(quantile(walltimeperfile, 0.9), 1.)))
+        maxruntime = int(math.ceil(1.5*max(walltimeperfile)*unitsperjob/60.))
+        perfdata[name] = {
+          'njobs': len(jobs),
+          'nevents': merged['nevents'],
+          'walltime': merged['walltime'],
+          'cputime': merged['cputime'],
+          'throughput': merged['nevents']/merged['walltime'] if merged['walltime']>0 else 0.,
+          'throughputs': throughputs,
+          'medianwalltime': quantile(walltimes, 0.5),
+          'maxwalltime': max(walltimes),
+          'peakrss': merged['peakrss'],
+          'bytesread': merged['bytesread'],
+          'outputsize': merged['outputsize'],
+          'modules': merged['modules'],
+          'othertime': merged['othertime'],
+          'unitsperjob': unitsperjob,
+          'maxjobruntimemin': maxruntime,
+          'slowestjobs': sorted([(job['walltime'], job['nevents'], job['path']) for job in jobs],
+                                reverse=True)[:5],
+        }
+    return perfdata
+
+
+def collectperf(inputs, targetruntime=8.):
+    ### find, read and aggregate all job summaries
+    # input arguments:
+    # - inputs: list of directories, files or glob patterns (see findsummaries)
+    # - targetruntime: see aggregate
+    files = findsummaries(inputs)
+    summaries = [readjobsummary(f) for f in files]
+    summaries = [s for s in summaries if s is not None]
+    print('Found {} job performance summaries in {} files.'.format(len(summaries), len(files)))
+    return aggregate(summaries, targetruntime=targetruntime)
+
+
+def make_histogram(values, nbins=20):
+    ### make a html bar chart of the distribution of a list of values
+    if len(values)==0: return '<td>(no jobs)</td>'
+    (counts, edges) = np.histogram(values, bins=nbins, range=(0, max(values)*1.05))
+    html = '<td><table cellpadding="0" cellspacing="0" style="width:100%">'
+    for count, low, high in zip(counts, edges[:-1], edges[1:]):
+        width = 100.*count/max(counts)
+        html += '<tr><td style="width:25%;font-size:11px">{:.0f} - {:.0f}</td>'.format(low, high)
+        html += '<td><div style="width:{:.1f}%;height:10px;background-color:deepskyblue"></div></td>'.format(width)
+        html += '<td style="width:10%;font-size:11px">{}</td></tr>'.format(count)
+    html += '</table></td>'
+    return html
+
+
+def perfhtml(perfdata):
+    ### convert aggregated performance data into a html section for web display
+    # input arguments:
+    # - perfdata: a dict as returned by aggregate
+    page = '<div id="performance"><h1>Performance</h1></div>\n'
+    if len(perfdata)==0:
+        page += '<table class="divide" cellpadding="5px" cellspacing="0">\n'
+        page += '<tr><td>(nothing to display)</td></tr>\n'
+        page += '</table>\n'
+        return page
+
+    # overview table
+    columns = ['sample / era', 'jobs', 'events', 'events/s', 'median events/s per job',
+               'cpu efficiency', 'median wall time (min)', 'max wall time (min)',
+               'peak memory (MB)', 'input read (GB)', 'output size (GB)',
+               'suggested unitsPerJob', 'suggested maxJobRuntimeMin']
+    page += '<table class="divide" cellpadding="5px" cellspacing="0">\n'
+    page += '<tr>' + ''.join(['<th>{}</th>'.format(c) for c in columns]) + '</tr>\n'
+    for name, perf in perfdata.items():
+        values = [name, perf['njobs'], perf['nevents'],
+                  '{:.1f}'.format(perf['throughput']),
+                  '{:.1f}'.format(np.median(perf['throughputs']) if len(perf['throughputs'])>0 else 0.),
+                  '{:.2f}'.format(perf['cputime']/perf['walltime'] if perf['walltime']>0 else 0.),
+                  '{:.1f}'.format(perf['medianwalltime']/60.),
+                  '{:.1f}'.format(perf['maxwalltime']/60.),
+                  '{:.0f}'.format(perf['peakrss']/1e6),
+                  '{:.2f}'.format(perf['bytesread']/1e9),
+                  '{:.2f}'.format(perf['outputsize']/1e9),
+                  perf['unitsperjob'], perf['maxjobruntimemin']]
+        page += '<tr>' + ''.join(['<td>{}</td>'.format(v) for v in values]) + '</tr>\n'
+    page += '</table>\n'
+
+    # details per sample
+    for name, perf in perfdata.items():
+        page += '<h3>{}</h3>\n'.format(name)
+        page += '<table class="divide" cellpadding="5px" cellspacing="0">\n'
+        page += '<tr><th>throughput per job (events/s)</th><th>time per module</th></tr>\n'
+        page += '<tr style="vertical-align:top">'
+        page += make_histogram(perf['throughputs'])
+        # time per module
+        page += '<td><table cellpadding="2px" cellspacing="0">'
+        walltime = max(perf['walltime'], 1e-9)
+        nevents = max(perf['nevents'], 1)
+        for module in perf['modules']:
+            page += '<tr><td>{}</td><td>{:.1f}% of wall time</td><td>{:.1f} us/event</td></tr>'.format(
+                    module['name'], 100.*module['totaltime']/walltime,
+                    1e6*module['times'].get('analyze', 0.)/nevents)
+        page += '<tr><td>other (I/O and framework)</td><td>{:.1f}% of wall time</td><td></td></tr>'.format(
+                100.*perf['othertime']/walltime)
+        page += '</table>'
+        # slowest jobs
+        page += '<br>Slowest jobs:<table cellpadding="2px" cellspacing="0">'
+        for (jobwalltime, jobnevents, path) in perf['slowestjobs']:
+            page += '<tr><td>{:.1f} min</td><td>{} events</td><td>{}</td></tr>'.format(
+                    jobwalltime/60., jobnevents, path)
+        page += '</table></td>'
+        page += '</tr>\n'
+        page += '</table>\n'
+    return page
+
+
+if __name__ == '__main__':
+
+    # parse arguments
+    parser = argparse.ArgumentParser('Monitor job performance')
+    parser.add_argument('-i', '--inputs', required=True, nargs='+',
+      help='Output directories, files or glob patterns to search for performance summaries')
+    parser.add_argument('-w', '--webpage', default='crab_status',
+      help='Name of the webpage where the results will be displayed')
+    parser.add_argument('-t', '--targetruntime', default=8., type=float,
+      help='Target job runtime in hours, used for the suggested CRAB settings')
+    args = parser.parse_args()
+
+    # print arguments
+    print('Running with following configuration:')
+    for arg in vars(args):
+        print('  - {}: {}'.format(arg,getattr(args,arg)))
+
+    # collect the performance data
+    perfdata = collectperf(args.inputs, targetruntime=args.targetruntime)
+    for name, perf in perfdata.items():
+        print('{}: {} jobs, {} events, {:.1f} events/s, max wall time {:.1f} min'.format(
+              name, perf['njobs'], perf['nevents'], perf['throughput'], perf['maxwalltime']/60.)
+              + ' (suggested unitsPerJob: {}, maxJobRuntimeMin: {})'.format(
+              perf['unitsperjob'], perf['maxjobruntimemin']))
+
+    # write the web page
+    home = os.path.expanduser("~")
+    webpath = os.path.join(home, 'public_html', args.webpage)
+    if not os.path.exists(webpath): os.makedirs(webpath)
+    page = '<html>\n<body>\n' + perfhtml(perfdata) + '</body>\n</html>'
+    with open(os.path.join(webpath, 'performance.html'), 'w') as f:
+        f.write(page)
+    print('Performance overview written to {}.'.format(webpath))
@@ -49,6 +49,13 @@ if __name__=='__main__':
                         help='Output directory (relative to default storage site CRAB output directory)')
     parser.add_argument('-n', '--nentries', default=-1, type=int,
                         help='Number of entries to process per unit')
+    parser.add_argument('--profile', default=False, action='store_true',
+                        help='Profile the modules and store a timing summary in each output file')
+    parser.add_argument('--profilehist', default=False, action='store_true',
+                        help='With --profile, also store per-event latency histograms')
+    parser.add_argument('--ncores', default=1, type=int,
+                        help='Number of cores per job (the input files or entry ranges of a job'
+                            +' are split over this number of worker processes)')
     args = parser.parse_args()
 
     # print arguments
@@ -75,6 +82,9 @@ if __name__=='__main__':
     argstr = ''
     if args.nentries > 0: argstr += '--nentries {}'.format(args.nentries)
     else: argstr += '--nentries {}'.format(args.nentries)
+    if args.profile: argstr += ' --profile'
+    if args.profilehist: argstr += ' --profilehist'
+    if args.ncores > 1: argstr += ' --ncores {}'.format(args.ncores)
     writesh(shname, args.processor, argstr=argstr)
 
     # loop over datasets
@@ -91,6 +101,7 @@ if __name__=='__main__':
         os.environ['CRAB_PROCESSOR'] = args.processor
         os.environ['CRAB_SCRIPT'] = shname
         os.environ['CRAB_OUTPUTDIR'] = args.outputdir
+        os.environ['CRAB_NCORES'] = str(args.ncores)
 
         # submit
         os.system('crab submit -c {}'.format(args.crabconfig))
@@ -16,7 +16,12 @@ removing duplicates identified by event number, run number and luminosity block.
 """
 
 import os
+import sys
 import math
+import shutil
+import tempfile
+import subprocess
+import concurrent.futures
 from functools import partial
 from typing import Any
 from typing import List
@@ -24,12 +29,88 @@ import numpy as np
 import awkward as ak
 import uproot
 
+from PhysicsTools.nanoSkimming.tools.eventindex import EventIndex, packeventkeys, firstoccurrence
+from PhysicsTools.nanoSkimming.tools.eventindex import geteventkeys, writesidecar
+
 try:
     import tqdm
     HAS_TQDM = True
 except ImportError:
     HAS_TQDM = False
 
+try:
+    import resource
+    HAS_RESOURCE = True
+except ImportError:
+    HAS_RESOURCE = False
+
+
+def peak_memory() -> int | None:
+    """
+    Returns the peak resident memory of the current process in bytes,
+    or None if it cannot be determined on this platform.
+    """
+    if not HAS_RESOURCE:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # (reported in kilobytes on linux, but in bytes on macOS)
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+# index columns identifying an event
+INDEX_COLUMNS = ["event", "run", "luminosityBlock"]
+
+
+def write_chunk(output_file: Any, tree_name: str, chunk: ak.Array) -> None:
+    """
+    Writes a *chunk* of events (as returned by :py:meth:`uproot.TTree.iterate`)
+    to the tree *tree_name* in *output_file*, creating the tree if needed.
+    """
+    chunk = dict(zip(chunk.fields, ak.unzip(chunk)))
+    if tree_name in output_file: output_file[tree_name].extend(chunk)
+    else: output_file[tree_name] = chunk
+
+
+def deduplicate_keys(index: EventIndex, hi: np.ndarray, lo: np.ndarray, first_file: bool) -> np.ndarray:
+    """
+    Determines which events (given by packed keys *hi* and *lo*, see :py:func:`packeventkeys`)
+    are duplicates and updates the *index* with the other ones.
+    Events of the first file are never considered duplicates.
+    Events of the other files are duplicates if they are in the index,
+    or if they appeared before in the same array.
+    (The latter makes the result independent of how the files are split into chunks.)
+    Returns a boolean mask that is True for duplicates.
+    """
+    if first_file:
+        index.addkeys(hi, lo)
+        return np.zeros(len(hi), dtype=bool)
+    duplicate = index.containskeys(hi, lo) | ~firstoccurrence(hi, lo)
+    index.addkeys(hi[~duplicate], lo[~duplicate])
+    return duplicate
+
+
+def iterate_keys(
+    input_path: str,
+    tree_name: str,
+    step_size: int,
+    use_sidecars: bool = False,
+):
+    """
+    Iterates over the packed event keys (see :py:func:`packeventkeys`) of *input_path*
+    in chunks of *step_size* entries, yielding (hi, lo) tuples.
+    If *use_sidecars* is True, the keys are taken from the sidecar file of *input_path*
+    (which is created first if it is missing or outdated),
+    else the index columns are read from the tree.
+    """
+    if use_sidecars:
+        keys = geteventkeys(input_path, treename=tree_name, updatesidecar=True)
+        for start in range(0, keys["nentries"], step_size):
+            yield (keys["hi"][start:start+step_size], keys["lo"][start:start+step_size])
+        return
+    with uproot.open(input_path) as f:
+        for arrays in f[tree_name].iterate(INDEX_COLUMNS, step_size=step_size, library="np"):
+            yield packeventkeys(arrays["run"], arrays["luminosityBlock"], arrays["event"])
+
 
 def haddnanodata(
     output_path: str,
@@ -39,6 +120,9 @@ def haddnanodata(
     keep_branches: List[str] | None = None,
     step_size: int = 100000,
     verbose: bool = False,
+    jobs: int = 1,
+    use_sidecars: bool = False,
+    write_sidecar: bool = False,
 ) -> tuple[int, int]:
 
     """
@@ -59,6 +143,19 @@ def haddnanodata(
     If set, the three index branches (event, run, luminosityBlock) should be accepted.
     For more info, see https://uproot.readthedocs.io/en/latest/uproot.behaviors.TTree.TTree.html#arrays
     The number of written and overlapping events is returned in a 2-tuple.
+    Duplicates are looked up in an :py:class:`EventIndex` of packed 128-bit
+    (run, luminosityBlock, event) keys, so each chunk costs O(chunk) on average,
+    independent of the number of events merged so far.
+    Peak memory is bounded by the size of one chunk plus the index (24 bytes per written event);
+    both are printed if *verbose* is True.
+    As before, the first file is written completely;
+    events of the other files are removed if they were written before.
+    If *jobs* is larger than 1, the merging is parallelized with
+    :py:func:`haddnanodata_parallel`, which gives an identical output.
+    If *use_sidecars* is True, the event keys needed before copying the events
+    (only in the parallel version) are taken from the sidecar files of the inputs
+    instead of the trees (see :py:func:`geteventkeys`).
+    If *write_sidecar* is True, a sidecar file is written for the output file.
     """
     
     # expand variables
@@ -93,19 +190,28 @@ def haddnanodata(
             msg = 'WARNING: overwriting existing file {}...'.format(output_path)
             print(msg)
             os.remove(output_path)
+
+    # run the parallel version if requested
+    if jobs > 1:
+        return haddnanodata_parallel(output_path, input_paths, tree_name=tree_name,
+                 keep_branches=keep_branches, step_size=step_size, verbose=verbose, jobs=jobs,
+                 use_sidecars=use_sidecars, write_sidecar=write_sidecar)
     output_file = uproot.create(output_path)
 
     # get input trees
     trees = [uproot.open(input_path)[tree_name] for input_path in input_paths]
     tree1 = trees[0]
 
-    # read index columns over the full reference file
-    index = tree1.arrays(index_columns)
+    # make the index of written events
+    index = EventIndex()
 
     # prepare counts
     n_written = 0
     n_overlap = 0
 
+    # prepare the keys of written events (for the sidecar)
+    written_keys = []
+
     # iteration helper
     def iterate(tree, ntree, ntrees):
         if verbose:
@@ -115,36 +221,288 @@ def haddnanodata(
             if( verbose and HAS_TQDM ) else (lambda gen: gen) )
         return progress(tree.iterate(step_size=step_size, filter_name=keep_branches))
 
+    # index helper
+    def keys(chunk):
+        return packeventkeys(ak.to_numpy(chunk["run"]), ak.to_numpy(chunk["luminosityBlock"]),
+                             ak.to_numpy(chunk["event"]))
+
     # fill chunks of the first tree
     for chunk in iterate(tree1, 1, len(trees)):
         # update counts
         n_written += len(chunk)
+        # update the index
+        (hi, lo) = keys(chunk)
+        deduplicate_keys(index, hi, lo, first_file=True)
+        if write_sidecar: written_keys.append((hi, lo))
         # extend the output tree
-        chunk = dict(zip(chunk.fields, ak.unzip(chunk)))
-        if tree_name in output_file: output_file[tree_name].extend(chunk)
-        else: output_file[tree_name] = chunk
+        write_chunk(output_file, tree_name, chunk)
 
     # fill chunks of the other trees
     for idx, tree in enumerate(trees[1:]):
         for chunk in iterate(tree, idx+2, len(trees)):
-            # determine a mask of events in tree that are also in tree1
-            mask = np.isin(chunk[index_columns], index, assume_unique=True)
+            # determine a mask of events in tree that were already written
+            # (and update the index)
+            (hi, lo) = keys(chunk)
+            mask = deduplicate_keys(index, hi, lo, first_file=False)
             chunk = chunk[~mask]
+            if write_sidecar: written_keys.append((hi[~mask], lo[~mask]))
             # update counts
             n_written += len(chunk)
-            n_overlap += ak.sum(mask)
+            n_overlap += int(np.sum(mask))
             # skip the chunk if all events are overlapping
-            if ak.all(mask): continue
+            if np.all(mask): continue
             # extend the output tree
-            chunk = dict(zip(chunk.fields, ak.unzip(chunk)))
-            output_file[tree_name].extend(chunk)
-            # update the index
-            chunkindex = {key: chunk[key] for key in index_columns}
-            chunkindex = ak.Array(chunkindex)
-            index = ak.concatenate((index, chunkindex))
+            write_chunk(output_file, tree_name, chunk)
+
+    # write the sidecar for the output file
+    output_file.close()
+    if write_sidecar:
+        hi = np.concatenate([np.zeros(0, dtype=np.uint64)] + [k[0] for k in written_keys])
+        lo = np.concatenate([np.zeros(0, dtype=np.uint64)] + [k[1] for k in written_keys])
+        writesidecar(output_path, treename=tree_name,
+          keys={"hi": hi, "lo": lo, "runlumis": np.unique(hi), "nentries": n_written})
+
+    if verbose:
+        print(f"written {n_written} and found {n_overlap} overlapping event(s)")
+        msg = f"event index: {len(index)} keys in {len(index.levels)} level(s), {index.nbytes/1e6:.1f} MB"
+        memory = peak_memory()
+        if memory is not None:
+            msg += f"; peak memory: {memory/1e6:.1f} MB"
+        print(msg)
+
+    return n_written, n_overlap
+
+
+def partition_of(hi: np.ndarray, n_partitions: int) -> np.ndarray:
+    """
+    Returns the partition (between 0 and *n_partitions* - 1) of each packed run/lumi key in *hi*
+    (see :py:func:`packeventkeys`).
+    The keys are hashed, so that consecutive lumisections are spread over the partitions
+    and the partitions have approximately equal numbers of events.
+    Since duplicate events always have the same run and luminosityBlock,
+    each partition can be deduplicated independently.
+    """
+    # (multiplicative hashing; uint64 arithmetic wraps around, which is intended here)
+    with np.errstate(over="ignore"):
+        hashed = np.asarray(hi, dtype=np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+    return ((hashed >> np.uint64(32)) % np.uint64(n_partitions)).astype(np.int64)
+
+
+def keys_path(tmp_dir: str, file_idx: int, partition: int) -> str:
+    """
+    Returns the path of the temporary file with the keys of partition *partition*
+    of input file *file_idx* (see :py:func:`split_keys`).
+    """
+    return os.path.join(tmp_dir, f"keys_{file_idx}_{partition}.npz")
+
+
+def split_keys(
+    input_path: str,
+    file_idx: int,
+    tree_name: str,
+    n_partitions: int,
+    step_size: int,
+    tmp_dir: str,
+    use_sidecars: bool = False,
+) -> int:
+    """
+    Reads the packed event keys of *input_path* once (from the index columns,
+    or from its sidecar file if *use_sidecars* is True, see :py:func:`iterate_keys`),
+    and splits them over *n_partitions* run/lumi partitions (see :py:func:`partition_of`).
+    The entry numbers and keys of each partition are written to a temporary file
+    in *tmp_dir* (see :py:func:`keys_path`), in their original order.
+    Returns the number of entries in *input_path*.
+    """
+    parts = [[] for _ in range(n_partitions)]
+    offset = 0
+    for (hi, lo) in iterate_keys(input_path, tree_name, step_size, use_sidecars=use_sidecars):
+        partition = partition_of(hi, n_partitions)
+        for idx in range(n_partitions):
+            selected = np.flatnonzero(partition == idx)
+            parts[idx].append((selected + offset, hi[selected], lo[selected]))
+        offset += len(hi)
+    for idx, part in enumerate(parts):
+        entries = np.concatenate([np.zeros(0, dtype=np.int64)] + [p[0] for p in part])
+        hi = np.concatenate([np.zeros(0, dtype=np.uint64)] + [p[1] for p in part])
+        lo = np.concatenate([np.zeros(0, dtype=np.uint64)] + [p[2] for p in part])
+        np.savez(keys_path(tmp_dir, file_idx, idx), entries=entries, hi=hi, lo=lo)
+    return offset
+
+
+def deduplicate_partition(
+    n_files: int,
+    partition: int,
+    tmp_dir: str,
+) -> tuple[List[np.ndarray], int, int | None]:
+    """
+    Deduplicates the events of run/lumi partition *partition*,
+    using the keys written by :py:func:`split_keys` for each of the *n_files* input files
+    (so that no input file is read again).
+    Returns a 3-tuple with a list of the duplicate entry numbers for each input file,
+    the number of keys in the index, and the peak memory of the process.
+    """
+    index = EventIndex()
+    duplicates = []
+    for file_idx in range(n_files):
+        with np.load(keys_path(tmp_dir, file_idx, partition)) as keys:
+            mask = deduplicate_keys(index, keys["hi"], keys["lo"], first_file=(file_idx == 0))
+            duplicates.append(keys["entries"][mask])
+    return duplicates, len(index), peak_memory()
+
+
+def write_segment(
+    input_path: str,
+    output_path: str,
+    tree_name: str,
+    keep_branches: List[str] | None,
+    entry_range: tuple[int, int],
+    duplicates: np.ndarray,
+    step_size: int,
+) -> int:
+    """
+    Copies the entries in *entry_range* of *input_path* to a new file *output_path*,
+    except for the entry numbers in *duplicates*.
+    Returns the number of written events.
+    """
+    n_written = 0
+    offset = entry_range[0]
+    with uproot.open(input_path) as f, uproot.create(output_path) as output_file:
+        for chunk in f[tree_name].iterate(step_size=step_size, filter_name=keep_branches,
+                                          entry_start=entry_range[0], entry_stop=entry_range[1]):
+            entries = np.arange(offset, offset + len(chunk))
+            offset += len(chunk)
+            chunk = chunk[~np.isin(entries, duplicates)]
+            # (note: also empty chunks are written, so that every segment contains the tree)
+            write_chunk(output_file, tree_name, chunk)
+            n_written += len(chunk)
+    return n_written
+
+
+def concatenate_files(
+    output_path: str,
+    input_paths: List[str],
+    tree_name: str = "Events",
+    step_size: int = 100000,
+) -> None:
+    """
+    Concatenates the trees *tree_name* in *input_paths* (in order) into *output_path*.
+    Uses haddnano.py or hadd if available (which copy the compressed data),
+    and falls back to reading and writing all events with uproot otherwise.
+    """
+    for command in ["haddnano.py", "hadd"]:
+        if shutil.which(command) is not None:
+            subprocess.check_call([command, output_path] + input_paths, stdout=subprocess.DEVNULL)
+            return
+    with uproot.create(output_path) as output_file:
+        for input_path in input_paths:
+            with uproot.open(input_path) as f:
+                tree = f[tree_name]
+                # (skip the counter branches that uproot creates itself when writing)
+                filter_name = None
+                if hasattr(tree, "branches"):
+                    counters = set([b.count_branch.name for b in tree.branches if b.count_branch is not None])
+                    filter_name = [b.name for b in tree.branches if b.name not in counters]
+                for chunk in tree.iterate(step_size=step_size, filter_name=filter_name):
+                    write_chunk(output_file, tree_name, chunk)
+
+
+def haddnanodata_parallel(
+    output_path: str,
+    input_paths: List[str],
+    tree_name: str = "Events",
+    keep_branches: List[str] | None = None,
+    step_size: int = 100000,
+    verbose: bool = False,
+    jobs: int = 2,
+    use_sidecars: bool = False,
+    write_sidecar: bool = False,
+) -> tuple[int, int]:
+
+    """
+    Parallel version of :py:func:`haddnanodata` with *jobs* worker processes,
+    giving an identical output (same events in the same order).
+    Not meant to be called directly (the checks on the arguments are done in haddnanodata).
+    It runs in three steps:
+    - the index columns of each input file (or its sidecar file if *use_sidecars* is True)
+      are read once, by one worker per file, and split over *jobs* run/lumi partitions
+      (written to temporary files); each partition is then deduplicated
+      in a separate worker with its own (small) index.
+      This gives the entry numbers of all duplicate events in each input file.
+    - the input files are split into segments of consecutive entries,
+      which are copied (without duplicates) to temporary files in parallel.
+    - the temporary files are concatenated in order.
+    The number of written and overlapping events is returned in a 2-tuple.
+    """
+
+    tmp_dir = tempfile.mkdtemp(prefix="haddnanodata_", dir=os.path.dirname(output_path))
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+
+            # read the keys of each file once and split them over the partitions
+            # (note: with use_sidecars, missing sidecars are created here)
+            if verbose:
+                print(f"Reading the event keys of {len(input_paths)} file(s) with {jobs} worker(s)")
+            futures = [executor.submit(split_keys, input_path, file_idx, tree_name, jobs, step_size,
+                                       tmp_dir, use_sidecars=use_sidecars)
+                       for file_idx, input_path in enumerate(input_paths)]
+            num_entries = [future.result() for future in futures]
+
+            # deduplicate the partitions
+            if verbose:
+                print(f"Deduplicating {jobs} run/lumi partition(s) with {jobs} worker(s)")
+            futures = [executor.submit(deduplicate_partition, len(input_paths), partition, tmp_dir)
+                       for partition in range(jobs)]
+            duplicates = [[] for _ in input_paths]
+            index_sizes = []
+            memories = []
+            for future in futures:
+                (partition_duplicates, index_size, memory) = future.result()
+                for file_idx, file_duplicates in enumerate(partition_duplicates):
+                    duplicates[file_idx].append(file_duplicates)
+                index_sizes.append(index_size)
+                memories.append(memory)
+            duplicates = [np.sort(np.concatenate(d)) for d in duplicates]
+            n_overlap = int(sum([len(d) for d in duplicates]))
+
+            # define the segments
+            segment_size = max(step_size, int(math.ceil(sum(num_entries) / jobs)))
+            segments = []
+            for file_idx, n in enumerate(num_entries):
+                for start in range(0, n, segment_size):
+                    segments.append((file_idx, (start, min(n, start + segment_size))))
+
+            # copy the segments to temporary files
+            segment_paths = [os.path.join(tmp_dir, f"segment_{i}.root") for i in range(len(segments))]
+            if verbose:
+                print(f"Writing {len(segments)} segment(s) with {jobs} worker(s)")
+            futures = []
+            for segment_path, (file_idx, entry_range) in zip(segment_paths, segments):
+                file_duplicates = duplicates[file_idx]
+                file_duplicates = file_duplicates[(file_duplicates >= entry_range[0])
+                                                  & (file_duplicates < entry_range[1])]
+                futures.append(executor.submit(write_segment, input_paths[file_idx], segment_path,
+                                               tree_name, keep_branches, entry_range,
+                                               file_duplicates, step_size))
+            n_written = int(sum([future.result() for future in futures]))
+
+        # concatenate the segments
+        if verbose:
+            print(f"Concatenating {len(segments)} segment(s)")
+        if len(segment_paths) == 1: shutil.move(segment_paths[0], output_path)
+        else: concatenate_files(output_path, segment_paths, tree_name=tree_name, step_size=step_size)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    # write the sidecar for the output file
+    if write_sidecar:
+        writesidecar(output_path, treename=tree_name, step_size=step_size)
 
     if verbose:
         print(f"written {n_written} and found {n_overlap} overlapping event(s)")
+        msg = f"event index: at most {max(index_sizes)} keys per partition"
+        if None not in memories:
+            msg += f"; peak memory per worker: {max(memories)/1e6:.1f} MB"
+        print(msg)
 
     return n_written, n_overlap
 
@@ -181,6 +539,24 @@ if __name__ == "__main__":
         default=100000,
         help="step size for iterations; default: 100000",
     )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="number of parallel worker processes; default: 1",
+    )
+    parser.add_argument(
+        "--use-sidecars",
+        default=False, action="store_true",
+        help="read event keys from sidecar files of the input files where possible"
+             " (creating them if needed)",
+    )
+    parser.add_argument(
+        "--write-sidecar",
+        default=False, action="store_true",
+        help="write a sidecar file with the event keys of the output file",
+    )
     parser.add_argument(
         "--verbose",
         "-v",
@@ -207,4 +583,7 @@ if __name__ == "__main__":
         tree_name=args.tree,
         keep_branches=keep_branches,
         step_size=args.step_size,
-        verbose=args.verbose )
+        verbose=args.verbose,
+        jobs=args.jobs,
+        use_sidecars=args.use_sidecars,
+        write_sidecar=args.write_sidecar )
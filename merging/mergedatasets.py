@@ -11,9 +11,14 @@
 # <top output directory>/<merged data samples>
 # where there is one merged data file per era.
 
-# Note: this step can take an unreasonably long time to run.
+# Note: this step can take a long time to run.
 # If possible, it may be best to avoid merging datasets at this level,
 # and rather do it after subsequent analysis steps, which much less events remaining.
+# Use the --jobs argument to run the merging with multiple parallel processes:
+# in local runmode, the eras are merged in parallel (see condor/localexecutor.py),
+# and the remaining processes are used to deduplicate and write each merged file
+# with multiple processes (see haddnanodata.py);
+# in condor runmode, each merged file is written with this number of processes.
 
 # import python library classes 
 import os
@@ -24,6 +29,7 @@ import argparse
 # import other parts of code
 sys.path.append(os.path.abspath('../condor'))
 import condortools as ct
+import localexecutor as le
 from PhysicsTools.nanoSkimming.tools.sampletools import getsampleparams
 
 
@@ -35,6 +41,14 @@ if __name__ == '__main__':
   parser.add_argument('-o', '--outputdir', required=True, type=os.path.abspath)
   parser.add_argument('-n', '--name', default='Data')
   parser.add_argument('-r', '--runmode', default='condor', choices=['condor','local'])
+  parser.add_argument('-j', '--jobs', default=1, type=int,
+                      help='Number of parallel processes (in local runmode, in total;'
+                          +' in condor runmode, per merged file)')
+  parser.add_argument('--retries', default=0, type=int,
+                      help='Number of times to retry a failed merge (only for local runmode)')
+  parser.add_argument('--sidecars', default=False, action='store_true',
+                      help='Use (and create) sidecar files with the event keys'
+                          +' of the input and output files (see haddnanodata.py)')
   args = parser.parse_args()
 
   # print arguments
@@ -60,7 +74,7 @@ if __name__ == '__main__':
   # define files to merge per era
   mergedict = {}
   for era in eras:
-    inputfiles = [os.path.join(args.outputdir,f) for f in datafiles if era in f]
+    inputfiles = [os.path.join(args.inputdir,f) for f in datafiles if era in f]
     outputfile = os.path.join(args.outputdir,args.name + '_' + era + '.root')
     mergedict[outputfile] = inputfiles
   
@@ -78,6 +92,15 @@ if __name__ == '__main__':
   go = input()
   if go!='y': sys.exit()
 
+  # divide the parallel processes over the merged files
+  # (in local runmode, the merges are run in parallel after the loop)
+  jobsperfile = args.jobs
+  executor = None
+  if args.runmode=='local':
+    nparallel = max(1, min(args.jobs, len(mergedict)))
+    jobsperfile = max(1, args.jobs//nparallel)
+    executor = le.LocalExecutor(jobs=nparallel, logfolder='local_logs', retries=args.retries)
+
   # continue with the submission
   for outputfile, inputfiles in sorted(mergedict.items()):
     # make the command
@@ -86,12 +109,18 @@ if __name__ == '__main__':
     cmd += ' -i'
     for f in inputfiles: cmd += ' {}'.format(f)
     cmd += ' -v -f'
+    if jobsperfile > 1: cmd += ' -j {}'.format(jobsperfile)
+    if args.sidecars: cmd += ' --use-sidecars --write-sidecar'
     #cmd += ' --test' # only for testing
     # make output directory if needed
     outputdir = os.path.dirname(outputfile)
     if not os.path.exists(outputdir): os.makedirs(outputdir)
     # run the command
-    if args.runmode=='local': os.system(cmd)
+    if args.runmode=='local':
+      le.submitCommandAsLocalJob('cjob_mergedatasets', cmd, executor=executor)
     elif args.runmode=='condor':
       ct.submitCommandAsCondorJob('cjob_mergedatasets', cmd,
           scriptfolder='condor_scripts', logfolder='condor_logs')
+  if executor is not None:
+    nfailed = executor.run()
+    if nfailed>0: sys.exit(1)
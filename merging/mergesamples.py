@@ -25,6 +25,7 @@ import argparse
 # import other parts of code
 sys.path.append(os.path.abspath('../condor'))
 import condortools as ct
+import localexecutor as le
 
 
 def get_sample_directories( input_directory ):
@@ -81,6 +82,10 @@ if __name__ == '__main__':
   parser.add_argument('-o', '--outputdir', required=True, type=os.path.abspath)
   parser.add_argument('-r', '--runmode', default='condor', choices=['condor','local'])
   parser.add_argument('-s', '--searchkey', default=None)
+  parser.add_argument('-j', '--jobs', default=1, type=int,
+                      help='Number of samples to merge in parallel (only for local runmode)')
+  parser.add_argument('--retries', default=0, type=int,
+                      help='Number of times to retry a failed merge (only for local runmode)')
   args = parser.parse_args()
 
   # print arguments
@@ -134,6 +139,8 @@ if __name__ == '__main__':
   if go!='y': sys.exit()
 
   # continue with the submission
+  # (in local runmode, the merges are run in parallel after the loop, see condor/localexecutor.py)
+  executor = le.LocalExecutor(jobs=args.jobs, logfolder='local_logs', retries=args.retries)
   for outputfile, val in mergedict.items():
     # make the command
     cmd = 'haddnano.py'
@@ -143,7 +150,11 @@ if __name__ == '__main__':
     outputdir = os.path.dirname(outputfile)
     if not os.path.exists(outputdir): os.makedirs(outputdir)
     # run the command
-    if args.runmode=='local': os.system(cmd)
+    if args.runmode=='local':
+      le.submitCommandAsLocalJob('cjob_mergesamples', cmd, executor=executor)
     elif args.runmode=='condor':
       ct.submitCommandAsCondorJob('cjob_mergesamples', cmd,
           scriptfolder='condor_scripts', logfolder='condor_logs')
+  if args.runmode=='local':
+    nfailed = executor.run()
+    if nfailed>0: sys.exit(1)
@@ -1,6 +1,38 @@
 ###############################
 # Definition of b-tagged jet #
 ###############################
+# The working point thresholds are stored in a lookup table.
+# bjetelection selects a single nanoAODTools jet with a direct threshold comparison,
+# while getbjetselection resolves the threshold once into a vectorized predicate
+# (see selectionregistry.py for the supported input formats).
+
+# imports
+import numpy as np
+
+
+### DeepJet/DeepFlavor b-tagging ###
+# note: the threshold values can be found here:
+#       https://btv-wiki.docs.cern.ch/ScaleFactors/UL2016preVFP/
+#       (and similar for other years)
+
+deepflavorthresholds = {
+    ('2016PreVFP', 'loose'): 0.0508,
+    ('2016PreVFP', 'medium'): 0.2598,
+    ('2016PreVFP', 'tight'): 0.6502,
+    ('2016PostVFP', 'loose'): 0.0480,
+    ('2016PostVFP', 'medium'): 0.2489,
+    ('2016PostVFP', 'tight'): 0.6377,
+    ('2017', 'loose'): 0.0532,
+    ('2017', 'medium'): 0.3040,
+    ('2017', 'tight'): 0.7476,
+    ('2018', 'loose'): 0.0490,
+    ('2018', 'medium'): 0.2783,
+    ('2018', 'tight'): 0.7100,
+}
+
+# cache of resolved predicates
+bjetselections = {}
+
 
 def inbtagacceptance(jet):
     ### internal helper function
@@ -8,6 +40,41 @@ def inbtagacceptance(jet):
     #       to the maximum acceptance of b-tagging algorithms.
     return ( jet.pt > 25. and abs(jet.eta)<2.4 )
 
+
+def inbtagacceptance_array(jets):
+    ### internal helper function (vectorized version of inbtagacceptance)
+    return ( (jets['pt'] > 25.) & (np.abs(jets['eta']) < 2.4) )
+
+
+def getbjetselection(year=None, algo=None, level=None):
+    ### get the vectorized predicate for a b-jet selection
+    # input arguments: see bjetelection
+    # returns:
+    # a function that takes jets with item access to their fields
+    # (e.g. a dict of numpy arrays or an awkward record array)
+    # and returns a boolean array
+
+    # check arguments
+    if( year is None or algo is None or level is None ):
+        msg = 'ERROR in bjetelection:'
+        msg += ' year, algo and level must all be provided.'
+        raise Exception(msg)
+
+    # check if this selection was already resolved
+    key = (year, algo, level)
+    if key in bjetselections: return bjetselections[key]
+
+    # switch between algorithms
+    if( algo=='deepflavor' ): predicate = getdeepflavorselection(year, level)
+    else:
+        # raise error if b-tag algorithm is invalid
+        msg = 'ERROR in bjetelection:'
+        msg += ' algo {} not recognized.'.format(algo)
+        raise Exception(msg)
+    bjetselections[key] = predicate
+    return predicate
+
+
 def bjetelection(jet, year=None, algo=None, level=None):
     ### perform b-jet selection
     # input arguments:
@@ -26,38 +93,31 @@ def bjetelection(jet, year=None, algo=None, level=None):
 
     # switch between algorithms
     if( algo=='deepflavor' ): return deepflavorselection(jet, year, level)
-    
+
     # raise error if b-tag algorithm is invalid
     msg = 'ERROR in bjetelection:'
     msg += ' algo {} not recognized.'.format(algo)
     raise Exception(msg)
 
 
-### DeepJet/DeepFlavor b-tagging ###
+def getdeepflavorthreshold(year, level):
+    ### get the DeepJet/DeepFlavor threshold for a year and working point
+    if (year, level) not in deepflavorthresholds:
+        msg = 'ERROR in deepflavorselection:'
+        msg += ' year {}, level {} not recognized.'.format(year, level)
+        raise Exception(msg)
+    return deepflavorthresholds[(year, level)]
+
+
+def getdeepflavorselection(year, level):
+    ### get the vectorized predicate for the DeepJet/DeepFlavor algorithm
+    threshold = getdeepflavorthreshold(year, level)
+    def predicate(jets):
+        return inbtagacceptance_array(jets) & (jets['btagDeepFlavB'] > threshold)
+    return predicate
+
 
 def deepflavorselection(jet, year, level):
     ### perform b-jet selection using the DeepJet/DeepFlavor algorithm
-    # note: the threshold values can be found here:
-    #       https://btv-wiki.docs.cern.ch/ScaleFactors/UL2016preVFP/
-    #       (and similar for other years)
     if not inbtagacceptance(jet): return False
-    bscore = jet.btagDeepFlavB
-    if year=='2016PreVFP':
-        if level=='loose': return (bscore > 0.0508)
-        if level=='medium': return (bscore > 0.2598)
-        if level=='tight': return (bscore > 0.6502)
-    if year=='2016PostVFP':
-        if level=='loose': return (bscore > 0.0480)
-        if level=='medium': return (bscore > 0.2489)
-        if level=='tight': return (bscore > 0.6377)
-    if year=='2017':
-        if level=='loose': return (bscore > 0.0532)
-        if level=='medium': return (bscore > 0.3040)
-        if level=='tight': return (bscore > 0.7476)
-    if year=='2018':
-        if level=='loose': return (bscore > 0.0490)
-        if level=='medium': return (bscore > 0.2783)
-        if level=='tight': return (bscore > 0.7100)
-    msg = 'ERROR in deepflavorselection:'
-    msg += ' year {}, level {} not recognized.'.format(year, level)
-    raise Exception(msg)
+    return (jet.btagDeepFlavB > getdeepflavorthreshold(year, level))
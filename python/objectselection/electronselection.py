@@ -1,6 +1,33 @@
 #####################################
 # Definition of electron selections #
 #####################################
+# Each selection is defined twice:
+# - as a short-circuiting function for a single nanoAODTools electron (see electronselection),
+#   used in the per-event analyze methods,
+# - as a vectorized predicate registered in a SelectionRegistry (see getelectronselection),
+#   to select all electrons of a chunk in one call.
+# Both definitions must be kept in sync.
+
+# imports
+import numpy as np
+
+# import local tools
+from PhysicsTools.nanoSkimming.objectselection.selectionregistry import SelectionRegistry
+
+
+electronselections = SelectionRegistry('electron')
+
+
+def getelectronselection(selectionid=None):
+    ### get the vectorized predicate for an electron selection
+    # input arguments:
+    # - selectionid: selection identifier
+    # returns:
+    # a function that takes electrons with item access to their fields
+    # (e.g. a dict of numpy arrays or an awkward record array)
+    # and returns a boolean array
+    return electronselections.get(selectionid)
+
 
 def electronselection(electron, selectionid=None):
     ### perform electron selection
@@ -20,12 +47,30 @@ def electronselection(electron, selectionid=None):
     raise Exception(msg)
 
 
+@electronselections.register(None)
+def electronid_none(electrons):
+    return (electrons['pt'] > 0.)
+
+
 ### loose selection for Run2 UL TOP lepton MVA based IDs
 # references:
 # - https://github.com/LukaLambrecht/ewkino/blob/
 #   4f5a9908fe4a4b5899671738b1d73193e6a6a16c/objectSelection/ElectronSelector.cc#L20
 # - Kirill's AN on the TOP lepton MVAand AN-2022-016)
 
+@electronselections.register('run2ul_loose')
+def electronid_run2ul_loose_array(electrons):
+    etasc = np.abs(electrons['eta'] + electrons['deltaEtaSC'])
+    return ((electrons['pt'] > 7.)
+            & (np.abs(electrons['eta']) < 2.5)
+            & (np.abs(electrons['dxy']) < 0.05)
+            & (np.abs(electrons['dz']) < 0.1)
+            & (electrons['sip3d'] < 8.)
+            & (electrons['lostHits'] < 2)
+            & (electrons['miniPFRelIso_all'] < 0.4)
+            & ((etasc < 1.4442) | (etasc > 1.566))
+    )
+
 def electronid_run2ul_loose(electron):
     return (electron.pt > 7.
             and abs(electron.eta) < 2.5
@@ -1,6 +1,24 @@
 ################################
 # Definition of jet selections #
 ################################
+# Each selection is defined both as a short-circuiting function for a single jet
+# and as a vectorized predicate (see electronselection.py).
+
+# imports
+import numpy as np
+
+# import local tools
+from PhysicsTools.nanoSkimming.objectselection.selectionregistry import SelectionRegistry
+
+
+jetselections = SelectionRegistry('jet')
+
+
+def getjetselection(selectionid=None):
+    ### get the vectorized predicate for a jet selection
+    # (see electronselection.getelectronselection)
+    return jetselections.get(selectionid)
+
 
 def jetselection(jet, selectionid=None):
     ### perform jet selection
@@ -20,8 +38,21 @@ def jetselection(jet, selectionid=None):
     raise Exception(msg)
 
 
+@jetselections.register(None)
+def jetid_none(jets):
+    return (jets['pt'] > 0.)
+
+
 ### default jet ID for Run 2 UL analyses ###
 
+@jetselections.register('run2ul_default')
+def jetid_run2ul_default_array(jets):
+    return (
+        (jets['pt'] > 25.)
+        & (np.abs(jets['eta']) < 2.4)
+        & (jets['isTight'] != 0)
+    )
+
 def jetid_run2ul_default(jet):
     return (
         jet.pt > 25.
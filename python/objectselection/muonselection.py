@@ -1,6 +1,24 @@
 #################################
 # Definition of muon selections #
 #################################
+# Each selection is defined both as a short-circuiting function for a single muon
+# and as a vectorized predicate (see electronselection.py).
+
+# imports
+import numpy as np
+
+# import local tools
+from PhysicsTools.nanoSkimming.objectselection.selectionregistry import SelectionRegistry
+
+
+muonselections = SelectionRegistry('muon')
+
+
+def getmuonselection(selectionid=None):
+    ### get the vectorized predicate for a muon selection
+    # (see electronselection.getelectronselection)
+    return muonselections.get(selectionid)
+
 
 def muonselection(muon, selectionid=None):
     ### perform muon selection
@@ -20,12 +38,31 @@ def muonselection(muon, selectionid=None):
     raise Exception(msg)
 
 
+@muonselections.register(None)
+def muonid_none(muons):
+    return (muons['pt'] > 0.)
+
+
 ### loose selection for Run2 UL TOP lepton MVA based IDs
 # references:
 # - https://github.com/LukaLambrecht/ewkino/blob/
 #   4f5a9908fe4a4b5899671738b1d73193e6a6a16c/objectSelection/MuonSelector.cc#L16
 # - Kirill's AN on the TOP lepton MVA (AN-2022-016)
 
+@muonselections.register('run2ul_loose')
+def muonid_run2ul_loose_array(muons):
+    return (
+        (muons['isPFcand'] != 0)
+        & ((muons['isTracker'] != 0) | (muons['isGlobal'] != 0))
+        & (muons['pt'] > 7.)
+        & (np.abs(muons['eta']) < 2.4)
+        & (np.abs(muons['dxy']) < 0.05)
+        & (np.abs(muons['dz']) < 0.1)
+        & (muons['sip3d'] < 8.)
+        & (muons['miniPFRelIso_all'] < 0.4)
+        & (muons['mediumId'] != 0)
+    )
+
 def muonid_run2ul_loose(muon):
     return (
         muon.isPFcand
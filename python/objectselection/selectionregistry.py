@@ -0,0 +1,68 @@
+############################################
+# Registry of vectorized object selections #
+############################################
+# Each selection is registered once (per selection identifier) as a predicate
+# that takes a set of objects with item access to their fields, e.g.:
+# - a dict of flat numpy arrays (see tools/chunktools.flatcolumns),
+# - an awkward record array (see tools/chunktools.getcollection), flat or jagged,
+# and returns a boolean array with the same structure.
+# The per-object selection functions (used on single nanoAODTools objects
+# in the per-event analyze methods) are defined separately as plain short-circuiting
+# functions, since evaluating a vectorized predicate per object is much slower.
+
+# imports
+import numpy as np
+
+
+class SelectionRegistry(object):
+    ### registry matching selection identifiers to vectorized predicates
+
+    def __init__(self, name):
+        ### initializer
+        # input arguments:
+        # - name: name of the object type (used in error messages)
+        self.name = name
+        self.selections = {}
+
+    def register(self, selectionid):
+        ### decorator to register a predicate for a selection identifier
+        def decorator(predicate):
+            if selectionid in self.selections:
+                msg = 'ERROR in {}selection:'.format(self.name)
+                msg += ' selection {} is already registered.'.format(selectionid)
+                raise Exception(msg)
+            self.selections[selectionid] = predicate
+            return predicate
+        return decorator
+
+    def get(self, selectionid):
+        ### get the predicate for a selection identifier
+        if selectionid not in self.selections:
+            msg = 'ERROR in {}selection:'.format(self.name)
+            msg += ' selection {} not recognized.'.format(selectionid)
+            raise Exception(msg)
+        return self.selections[selectionid]
+
+    def keys(self):
+        return list(self.selections.keys())
+
+
+class FieldRecorder(object):
+    ### internal helper class to record which fields a predicate reads
+    # (every field is replaced by a dummy array)
+
+    def __init__(self):
+        self.fields = []
+
+    def __getitem__(self, field):
+        if field not in self.fields: self.fields.append(field)
+        return np.zeros(1)
+
+
+def getfields(predicate):
+    ### find the fields that a selection predicate reads
+    # returns:
+    # a list of field names (without collection prefix)
+    recorder = FieldRecorder()
+    predicate(recorder)
+    return recorder.fields
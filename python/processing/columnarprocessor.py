@@ -0,0 +1,257 @@
+##########################################################################
+# Columnar alternative to the NanoAODTools PostProcessor based on uproot #
+##########################################################################
+# Instead of looping over events in python and calling the analyze method of each module,
+# the input files are read in chunks of events with uproot,
+# and each module is evaluated on the full chunk at once.
+# Modules must provide a columnar counterpart of their analyze method:
+# - filter modules (skimmers) provide a method mask(chunk),
+#   returning a boolean numpy array with one entry per event in the chunk.
+# - producer modules provide a method process_chunk(chunk),
+#   returning a dict of new branch names to arrays (one entry per event in the chunk).
+# Optionally, modules can provide the methods begin_chunks(branchnames),
+# called for each input file with the list of available branch names,
+# and end_chunks(outputfile), called for each input file
+# with the (uproot) output file after all chunks are processed.
+# See tools/chunktools.py for the chunk format.
+# Modules without a columnar counterpart (e.g. the NanoAODTools JetMET corrector)
+# are not supported; use the PostProcessor for those.
+
+# imports
+import sys
+import os
+import fnmatch
+import numpy as np
+import awkward as ak
+import uproot
+
+# import local tools
+from PhysicsTools.nanoSkimming.skimselection.jsonskimmer import JsonSkimmer
+from PhysicsTools.nanoSkimming.tools.chunktools import maskchunk, chunklength
+from PhysicsTools.nanoSkimming.tools.lumitools import getentryranges
+from PhysicsTools.nanoSkimming.processing.pipelineplanner import PipelinePlanner
+
+
+def readbranchselection(branchsel):
+    ### read a branch selection file in NanoAODTools format
+    # (lines of the form 'keep <pattern>' or 'drop <pattern>', applied in order)
+    # returns:
+    # a list of (keep, pattern) tuples
+    rules = []
+    if branchsel is None: return rules
+    with open(branchsel) as f:
+        for line in f:
+            line = line.split('#')[0].strip()
+            if len(line)==0: continue
+            (action, pattern) = line.split()
+            if action not in ['keep', 'drop']:
+                raise Exception('ERROR: branch selection line "{}" not recognized.'.format(line))
+            rules.append((action=='keep', pattern))
+    return rules
+
+
+def applybranchselection(branchnames, rules):
+    ### select branch names according to a list of (keep, pattern) rules
+    selected = []
+    for branchname in branchnames:
+        keep = True
+        for (rulekeep, pattern) in rules:
+            if fnmatch.fnmatchcase(branchname, pattern): keep = rulekeep
+        if keep: selected.append(branchname)
+    return selected
+
+
+def tooutputdict(chunk):
+    ### convert a chunk into a dict suitable for writing with uproot,
+    # grouping collection branches (e.g. 'Electron_pt') into records (e.g. 'Electron'),
+    # so that the output follows the nanoAOD naming convention
+    # with a single counter branch (e.g. 'nElectron') per collection.
+    # note: counter branches are recreated by uproot, so they are removed here.
+    jagged = [key for key, val in chunk.items() if val.ndim > 1]
+    collections = {}
+    for key in jagged:
+        prefix = key.split('_')[0]
+        if( '_' in key and 'n'+prefix in chunk ):
+            collections.setdefault(prefix, {})[key[len(prefix)+1:]] = chunk[key]
+    counters = set(['n'+key for key in jagged] + ['n'+prefix for prefix in collections])
+    output = {}
+    for key, val in chunk.items():
+        if key in counters: continue
+        if( key in jagged and key.split('_')[0] in collections ): continue
+        output[key] = val
+    for prefix, fields in collections.items():
+        output[prefix] = ak.zip(fields, depth_limit=2)
+    return output
+
+
+def outputtypes(output):
+    ### get the branch types of an output dict (see tooutputdict)
+    return {key: (val.type.content if isinstance(val, ak.Array) else val.dtype)
+            for key, val in output.items()}
+
+
+class ColumnarProcessor(object):
+
+    def __init__( self, outputDir, inputFiles,
+                  modules=[],
+                  maxEntries=None,
+                  firstEntry=0,
+                  postfix='',
+                  branchsel=None,
+                  outputbranchsel=None,
+                  jsonInput=None,
+                  treeName='Events',
+                  stepSize=100000,
+                  planModules=False,
+                  verbose=True ):
+        ### intializer
+        # input arguments (similar to the NanoAODTools PostProcessor):
+        # - outputDir: directory where to put the output files
+        # - inputFiles: list of input files
+        # - modules: list of modules to run, in order
+        # - maxEntries: maximum number of entries to process per file
+        # - firstEntry: first entry to process in each file
+        # - postfix: postfix to append to the output file names
+        # - branchsel: branch selection file for the input branches
+        # - outputbranchsel: branch selection file for the output branches
+        # - jsonInput: json file with run/lumisection selection (for data)
+        # - treeName: name of the tree to process
+        # - stepSize: number of events to process in one chunk
+        # - planModules: reorder the modules so that filters run first
+        #   (see processing/pipelineplanner.py)
+        # - verbose: print more or less output
+        self.outputDir = outputDir
+        self.inputFiles = inputFiles
+        self.modules = modules
+        self.maxEntries = maxEntries
+        self.firstEntry = firstEntry
+        self.postfix = postfix
+        self.branchsel = readbranchselection(branchsel)
+        self.outputbranchsel = readbranchselection(outputbranchsel)
+        self.treeName = treeName
+        self.stepSize = stepSize
+        self.verbose = verbose
+        self.jsonSkimmer = None
+        if jsonInput is not None:
+            self.jsonSkimmer = JsonSkimmer(jsonfile=jsonInput)
+            self.modules = [self.jsonSkimmer] + list(self.modules)
+        if planModules:
+            planner = PipelinePlanner(self.modules)
+            self.modules = planner.planned
+            if self.verbose: planner.printplan()
+
+        # check if all modules have a columnar counterpart
+        for module in self.modules:
+            if( not hasattr(module, 'mask') and not hasattr(module, 'process_chunk') ):
+                msg = 'ERROR in ColumnarProcessor:'
+                msg += ' module {} has no columnar counterpart'.format(type(module).__name__)
+                msg += ' (it needs a mask or process_chunk method).'
+                raise Exception(msg)
+
+    def outputFileName(self, inputFile):
+        ### get the output file name corresponding to an input file
+        basename = os.path.basename(inputFile)
+        basename = basename.replace('.root', self.postfix + '.root')
+        return os.path.join(self.outputDir, basename)
+
+    def entryRanges(self, tree):
+        ### get the ranges of entries to process in a tree
+        # if a json selection is applied, a pre-pass over the run and luminosityBlock branches
+        # determines which entry ranges contain selected lumisections,
+        # so that the other branches are only read for those ranges.
+        # (the json selection itself is still applied per event by the JsonSkimmer,
+        #  since small gaps between selected ranges are merged to avoid many small reads.)
+        entry_start = self.firstEntry
+        entry_stop = tree.num_entries
+        if self.maxEntries is not None:
+            entry_stop = min(entry_stop, entry_start + self.maxEntries)
+        if self.jsonSkimmer is None: return [(entry_start, entry_stop)]
+        (ranges, _) = getentryranges(tree, self.jsonSkimmer.lumimask,
+                        maxgap=max(1, self.stepSize//10))
+        ranges = [(max(start, entry_start), min(stop, entry_stop)) for (start, stop) in ranges]
+        ranges = [(start, stop) for (start, stop) in ranges if stop > start]
+        if self.verbose:
+            nselected = sum([stop-start for (start, stop) in ranges])
+            msg = 'Json pre-pass: {} out of {} entries'.format(nselected, entry_stop-entry_start)
+            msg += ' in {} ranges remain to be read.'.format(len(ranges))
+            print(msg)
+        return ranges
+
+    def iterateChunks(self, tree, branchnames):
+        ### iterate over chunks of the entry ranges to process
+        for (entry_start, entry_stop) in self.entryRanges(tree):
+            for chunk in tree.iterate(branchnames, step_size=self.stepSize,
+                                      entry_start=entry_start, entry_stop=entry_stop,
+                                      library='ak', how=dict):
+                yield chunk
+
+    def processChunk(self, chunk):
+        ### run all modules on a single chunk
+        # returns:
+        # the processed chunk (with filtered events and new branches)
+        # note: modules are also run on empty chunks,
+        #       so that the output branches are defined consistently.
+        for module in self.modules:
+            if hasattr(module, 'mask'):
+                mask = np.asarray(module.mask(chunk), dtype=bool)
+                if not np.all(mask): chunk = maskchunk(chunk, mask)
+            else:
+                newbranches = module.process_chunk(chunk)
+                chunk.update(newbranches)
+        return chunk
+
+    def processFile(self, inputFile):
+        ### process a single input file
+        outputFile = self.outputFileName(inputFile)
+        if self.verbose: print('Processing file {} -> {}'.format(inputFile, outputFile))
+        ninput = 0
+        noutput = 0
+        with uproot.open(inputFile) as fin, uproot.recreate(outputFile) as fout:
+            tree = fin[self.treeName]
+            branchnames = applybranchselection(tree.keys(), self.branchsel)
+            for module in self.modules:
+                if hasattr(module, 'begin_chunks'): module.begin_chunks(branchnames)
+            outputbranches = None
+            for chunk in self.iterateChunks(tree, branchnames):
+                ninput += chunklength(chunk)
+                chunk = self.processChunk(chunk)
+                if outputbranches is None:
+                    outputbranches = applybranchselection(list(chunk.keys()), self.outputbranchsel)
+                output = tooutputdict({key: chunk[key] for key in outputbranches})
+                if self.treeName not in fout:
+                    fout.mktree(self.treeName, outputtypes(output))
+                nchunk = chunklength(chunk)
+                if nchunk==0: continue
+                noutput += nchunk
+                fout[self.treeName].extend(output)
+            if self.treeName not in fout:
+                # no chunks were read (e.g. no selected lumisections or an empty input tree):
+                # run the modules on an empty chunk to write an empty tree
+                # with the same branches as a non-empty output (as the PostProcessor does)
+                chunk = tree.arrays(branchnames, entry_start=0, entry_stop=0,
+                                    library='ak', how=dict)
+                chunk = self.processChunk(chunk)
+                outputbranches = applybranchselection(list(chunk.keys()), self.outputbranchsel)
+                output = tooutputdict({key: chunk[key] for key in outputbranches})
+                fout.mktree(self.treeName, outputtypes(output))
+            # copy the other nanoAOD trees
+            for treename in ['Runs', 'LuminosityBlocks']:
+                if treename not in fin: continue
+                othertree = fin[treename]
+                if othertree.num_entries==0: continue
+                output = tooutputdict(othertree.arrays(library='ak', how=dict))
+                fout.mktree(treename, outputtypes(output))
+                fout[treename].extend(output)
+            for module in self.modules:
+                if hasattr(module, 'end_chunks'): module.end_chunks(fout)
+        if self.verbose:
+            print('Processed {} entries, selected {} entries.'.format(ninput, noutput))
+        return outputFile
+
+    def run(self):
+        ### process all input files
+        if not os.path.exists(self.outputDir): os.makedirs(self.outputDir)
+        outputFiles = []
+        for inputFile in self.inputFiles:
+            outputFiles.append(self.processFile(inputFile))
+        return outputFiles
@@ -8,11 +8,16 @@ ROOT.PyConfig.IgnoreCommandLineOptions = True
 import sys
 import os
 # from pathlib import Path
+import numpy as np
+import awkward as ak
 
 # import nanoAODTools
 from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection,Object
 from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
 
+# import local tools
+from PhysicsTools.nanoSkimming.tools.chunktools import flatcolumns, unflatten
+
 
 class LeptonGenVariablesModule(Module):
 
@@ -55,12 +60,34 @@ class LeptonGenVariablesModule(Module):
               'isLastCopyBeforeFSR': 14, 
         })
 
+        # define the branch types
+        self.btypes = {variable: "F" for variable in self.variables}
+        for variable in self.variables:
+            if variable=='isPrompt' or variable=='isChargeFlip': self.btypes[variable] = "O"
+            if variable=='matchPdgId': self.btypes[variable] = "I"
+        self.dtypes = {variable: {"F": np.float32, "O": bool, "I": np.int32}[btype]
+                       for variable, btype in self.btypes.items()}
+
+        # define the status flags for which a gen particle is considered prompt
+        # (see genpart_is_prompt)
+        self.promptstatuses = (['isPrompt', 'isDirectPromptTauDecayProduct',
+                                'isHardProcess', 'fromHardProcess', 'fromHardProcessBeforeFSR'])
+
+        # define the fields needed from the lepton and gen particle collections
+        self.leptonfields = ['eta', 'phi', 'pdgId', 'genPartIdx']
+        self.genfields = ['pt', 'eta', 'phi', 'pdgId', 'status', 'statusFlags', 'genPartIdxMother']
+
+        # declare the branches read and written by this module
+        # (see processing/pipelineplanner.py)
+        self.inputbranches = (['nElectron', 'nMuon', 'nGenPart']
+                              + ['{}_{}'.format(c, f) for c in ['Electron', 'Muon'] for f in self.leptonfields]
+                              + ['GenPart_'+f for f in self.genfields])
+        self.outputbranches = ['{}_{}'.format(c, v) for v in self.variables for c in ['Electron', 'Muon']]
+
     def beginFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
         self.out = wrappedOutputTree
         for variable in self.variables:
-            btype = "F"
-            if variable=='isPrompt' or variable=='isChargeFlip': btype = "O"
-            if variable=='matchPdgId': btype = "I"
+            btype = self.btypes[variable]
             self.out.branch('Electron_{}'.format(variable), btype, lenVar='nElectron')
             self.out.branch('Muon_{}'.format(variable), btype, lenVar='nMuon')
 
@@ -76,36 +103,257 @@ class LeptonGenVariablesModule(Module):
         muons = Collection(event, "Muon")
         genparticles = Collection(event, "GenPart")
 
+        # calculate the variables and fill the branches
+        # note: the per-object implementation is used here (not computeArrays),
+        #       since for a single event the conversion of the collection proxies
+        #       to numpy arrays and the overhead of the array operations
+        #       cost more than the per-object loops they replace.
+        values = self.computeVariables(electrons, muons, genparticles)
+        for name, val in values.items(): self.out.fillBranch(name, val)
+
+        return True
+
+    def process_chunk(self, chunk):
+        ### columnar counterpart of analyze (see processing/columnarprocessor.py)
+        electrons = flatcolumns(chunk, 'Electron', self.leptonfields)
+        muons = flatcolumns(chunk, 'Muon', self.leptonfields)
+        genparticles = flatcolumns(chunk, 'GenPart', self.genfields)
+        values = self.computeArrays(electrons, muons, genparticles)
+        newbranches = {}
+        for variable in self.variables:
+            for collection, (_, counts) in [('Electron', electrons), ('Muon', muons)]:
+                name = '{}_{}'.format(collection, variable)
+                newbranches[name] = unflatten(values[name], counts, self.dtypes[variable])
+        return newbranches
+
+    def computeArrays(self, electrons, muons, genparticles):
+        ### calculate the variables for flat arrays of leptons and gen particles
+        # input arguments:
+        # - electrons, muons, genparticles: tuples of a dict matching field names to flat arrays
+        #   and the number of objects per event (see tools/chunktools.flatcolumns),
+        #   with at least the fields in self.leptonfields and self.genfields respectively.
+        # returns:
+        # a dict matching branch names to flat numpy arrays (one entry per lepton)
+        # note: gives the same result as computeVariables (the per-object implementation),
+        #       but with all lepton x gen particle combinations evaluated as array operations.
+        (gen, gencounts) = genparticles
+        gencounts = np.asarray(gencounts, dtype=np.int64)
+        genoffsets = np.cumsum(gencounts) - gencounts
+        genpdgid = np.asarray(gen['pdgId'], dtype=np.int64)
+        genstatus = np.asarray(gen['status'], dtype=np.int64)
+        genflags = np.asarray(gen['statusFlags'], dtype=np.int64)
+        promptmask = sum([1 << self.statusmap[status] for status in self.promptstatuses])
+        if 'motherPdgId' in self.variables:
+            ancestors = self.getancestors(gen, genoffsets, gencounts)
+        values = {}
+        for (collection, pdgid, (leptons, counts)) in [('Electron', 11, electrons), ('Muon', 13, muons)]:
+            events = np.repeat(np.arange(len(counts)), counts)
+            matches = self.findmatches(leptons, pdgid, events, gen, genoffsets, gencounts)
+            hasmatch = (matches >= 0)
+            matchpdgid = self.take(genpdgid, matches, 0)
+            if 'isPrompt' in self.variables:
+                values[collection+'_isPrompt'] = hasmatch & ((self.take(genflags, matches, 0) & promptmask) != 0)
+            if 'matchPdgId' in self.variables:
+                values[collection+'_matchPdgId'] = matchpdgid
+            if 'provenanceConversion' in self.variables:
+                values[collection+'_provenanceConversion'] = self.provenanceconversions(
+                  matches, events, gen, genoffsets, gencounts)
+            if 'motherPdgId' in self.variables:
+                values[collection+'_motherPdgId'] = self.motherpdgids(matches, ancestors, gen)
+            if 'isChargeFlip' in self.variables:
+                values[collection+'_isChargeFlip'] = hasmatch & (matchpdgid==-np.asarray(leptons['pdgId'], dtype=np.int64))
+        return values
+
+    def take(self, array, indices, default):
+        ### internal helper function to index an array with a default value for negative indices
+        result = np.full(len(indices), default, dtype=np.asarray(array).dtype)
+        valid = (indices >= 0)
+        result[valid] = np.asarray(array)[indices[valid]]
+        return result
+
+    def makepairs(self, events, genoffsets, gencounts):
+        ### internal helper function to make all combinations of objects with the gen particles
+        # in the same event (e.g. for a lepton x gen particle delta R matrix per event)
+        # input arguments:
+        # - events: event index for each object
+        # - genoffsets, gencounts: index of the first gen particle and number of gen particles per event
+        # returns:
+        # a tuple of the object index and (flat) gen particle index for each pair,
+        # and the index of the first pair and number of pairs for each object
+        # (pairs are ordered by object first and gen particle index second)
+        seglengths = gencounts[events]
+        segstarts = np.cumsum(seglengths) - seglengths
+        npairs = int(np.sum(seglengths))
+        pairobj = np.repeat(np.arange(len(events)), seglengths)
+        pairgen = (np.arange(npairs) - np.repeat(segstarts, seglengths)
+                   + np.repeat(genoffsets[events], seglengths))
+        return (pairobj, pairgen, segstarts, seglengths)
+
+    def deltar(self, eta1, phi1, eta2, phi2):
+        ### internal helper function to calculate delta R for arrays of objects
+        # (same definition as nanoAODTools Object.DeltaR, in double precision)
+        deta = np.abs(np.asarray(eta2, dtype=np.float64) - np.asarray(eta1, dtype=np.float64))
+        dphi = np.abs(np.asarray(phi2, dtype=np.float64) - np.asarray(phi1, dtype=np.float64))
+        toolarge = (dphi > np.pi)
+        while np.any(toolarge):
+            dphi[toolarge] = np.abs(dphi[toolarge] - 2*np.pi)
+            toolarge = (dphi > np.pi)
+        return np.sqrt(dphi*dphi + deta*deta)
+
+    def segmentargmin(self, values, segstarts, seglengths):
+        ### internal helper function to find the minimum in each segment of an array
+        # returns:
+        # a tuple of the minimum value (inf for empty segments) for each segment,
+        # and the (first) index of the minimum (-1 for empty segments)
+        # note: the first occurrence of the minimum is taken,
+        #       consistent with a loop that updates the best match only if strictly better.
+        minima = np.full(len(segstarts), np.inf)
+        argmins = np.full(len(segstarts), -1, dtype=np.int64)
+        nonempty = (seglengths > 0)
+        if not np.any(nonempty): return (minima, argmins)
+        minima[nonempty] = np.minimum.reduceat(values, segstarts[nonempty])
+        positions = np.flatnonzero(values == np.repeat(minima, seglengths))
+        argmins[nonempty] = positions[np.searchsorted(positions, segstarts[nonempty])]
+        return (minima, argmins)
+
+    def findmatches(self, leptons, pdgid, events, gen, genoffsets, gencounts):
+        ### internal helper function to determine the gen match for an array of leptons.
+        # priority is given on builtin matching, with fallback to geometric matching
+        # (see findmatch and geometricmatch for the per-object equivalent).
+        # returns:
+        # an array with the flat index of the matched gen particle per lepton (-1 if no match)
+        leppdgid = np.asarray(leptons['pdgId'], dtype=np.int64)
+        genidx = np.asarray(leptons['genPartIdx'], dtype=np.int64)
+        genpdgid = np.asarray(gen['pdgId'], dtype=np.int64)
+        matches = np.full(len(events), -1, dtype=np.int64)
+
+        # builtin matching
+        builtin = (genidx >= 0) & (genidx < gencounts[events])
+        flatidx = genoffsets[events] + genidx
+        builtin[builtin] = (genpdgid[flatidx[builtin]] == leppdgid[builtin])
+        matches[builtin] = flatidx[builtin]
+
+        # geometric matching for the other leptons:
+        # first among stable gen particles of the same flavour,
+        # then (if no match within 0.2) also allowing photons.
+        # (note: the special case for taus in geometricmatch is not needed here,
+        #  as only electrons and muons are matched.)
+        todo = np.flatnonzero(~builtin)
+        if len(todo)==0: return matches
+        (pairobj, pairgen, segstarts, seglengths) = self.makepairs(events[todo], genoffsets, gencounts)
+        dr = self.deltar(np.asarray(leptons['eta'])[todo][pairobj], np.asarray(leptons['phi'])[todo][pairobj],
+                         np.asarray(gen['eta'])[pairgen], np.asarray(gen['phi'])[pairgen])
+        dr[np.isnan(dr)] = np.inf
+        abspdgid = np.abs(genpdgid[pairgen])
+        stable = (np.asarray(gen['status'])[pairgen] == 1)
+        sameflavour = (abspdgid == pdgid)
+        (mindr, argmin) = self.segmentargmin(np.where(sameflavour & stable, dr, np.inf),
+                                             segstarts, seglengths)
+        (mindrphoton, argminphoton) = self.segmentargmin(
+                                        np.where((sameflavour | (abspdgid==22)) & stable, dr, np.inf),
+                                        segstarts, seglengths)
+        geomatches = np.full(len(todo), -1, dtype=np.int64)
+        usematch = (mindr <= 0.2)
+        usephoton = ~usematch & (mindrphoton <= 0.2)
+        geomatches[usematch] = pairgen[argmin[usematch]]
+        geomatches[usephoton] = pairgen[argminphoton[usephoton]]
+        matches[todo] = geomatches
+        return matches
+
+    def provenanceconversions(self, matches, events, gen, genoffsets, gencounts):
+        ### internal helper function to determine the conversion provenance for an array of matches
+        # (see provenanceconversion for the per-object equivalent)
+        result = np.full(len(matches), 99, dtype=np.int64)
+        genpdgid = np.asarray(gen['pdgId'], dtype=np.int64)
+        isphoton = (self.take(genpdgid, matches, 0) == 22)
+        if not np.any(isphoton): return result
+        promptstable = ( ((self.take(gen['statusFlags'], matches, 0) & (1 << self.statusmap['isPrompt'])) != 0)
+                         & (self.take(gen['status'], matches, 0) == 1) )
+        result[isphoton & ~promptstable] = 2
+        softphoton = (self.take(gen['pt'], matches, 0) < 10)
+        result[isphoton & promptstable & softphoton] = 1
+        tocheck = np.flatnonzero(isphoton & promptstable & ~softphoton)
+        if len(tocheck)==0: return result
+        result[tocheck] = 0
+        # check for nearby outgoing partons from the hard process
+        (pairobj, pairgen, _, _) = self.makepairs(events[tocheck], genoffsets, gencounts)
+        abspdgid = np.abs(genpdgid[pairgen])
+        isparton = ( (np.asarray(gen['status'])[pairgen] == 23)
+                     & ((abspdgid == 21) | ((abspdgid > 0) & (abspdgid < 7))) )
+        pairobj = pairobj[isparton]
+        pairgen = pairgen[isparton]
+        photons = matches[tocheck][pairobj]
+        dr = self.deltar(np.asarray(gen['eta'])[photons], np.asarray(gen['phi'])[photons],
+                         np.asarray(gen['eta'])[pairgen], np.asarray(gen['phi'])[pairgen])
+        result[tocheck[np.unique(pairobj[dr < 0.05])]] = 1
+        return result
+
+    def getancestors(self, gen, genoffsets, gencounts):
+        ### internal helper function to find the first ancestor with a different pdgId
+        # for all gen particles at once (i.e. the particle returned by getMother).
+        # the chains of same-flavour mothers (e.g. radiation copies) are collapsed
+        # by pointer jumping, which needs a number of array operations
+        # logarithmic (rather than linear) in the length of the longest chain.
+        # returns:
+        # an array with the flat index of the ancestor per gen particle (-1 if none)
+        genpdgid = np.asarray(gen['pdgId'], dtype=np.int64)
+        mothers = np.asarray(gen['genPartIdxMother'], dtype=np.int64)
+        mothers = np.where(mothers >= 0, mothers + np.repeat(genoffsets, gencounts), -1)
+        hasmother = (mothers >= 0)
+        # find the top of the chain of same-flavour mothers for each particle
+        tops = np.arange(len(mothers))
+        samemother = np.zeros(len(mothers), dtype=bool)
+        samemother[hasmother] = (genpdgid[mothers[hasmother]] == genpdgid[hasmother])
+        tops[samemother] = mothers[samemother]
+        for _ in range(64):
+            newtops = tops[tops]
+            if np.array_equal(newtops, tops): break
+            tops = newtops
+        # the ancestor is the mother of the top of the chain
+        return mothers[tops]
+
+    def motherpdgids(self, matches, ancestors, gen):
+        ### internal helper function to determine the mother pdgId for an array of matches
+        # (see motherpdgid for the per-object equivalent)
+        # input arguments:
+        # - matches: flat index of the matched gen particle per lepton (-1 if no match)
+        # - ancestors: output of getancestors
+        return self.take(np.asarray(gen['pdgId'], dtype=np.int64),
+                         self.take(ancestors, matches, -1), 0)
+
+    def computeVariables(self, electrons, muons, genparticles):
+        ### calculate the variables for a single event using the per-object functions below
+        # (used in analyze; computeArrays is the columnar equivalent used in process_chunk)
+        # input arguments:
+        # - electrons, muons, genparticles: nanoAODTools collections (or lists of objects)
+        # returns:
+        # a dict matching branch names to lists of values (one per lepton)
+        values = {}
+
         # do custom matching
         electron_matches = [self.findmatch(e, 11, genparticles) for e in electrons]
         muon_matches = [self.findmatch(m, 13, genparticles) for m in muons]
 
         # isPrompt
         if 'isPrompt' in self.variables:
-            electron_isprompt = [self.genpart_is_prompt(g) for g in electron_matches]
-            muon_isprompt = [self.genpart_is_prompt(g) for g in muon_matches]
-            self.out.fillBranch('Electron_isPrompt', electron_isprompt)
-            self.out.fillBranch('Muon_isPrompt', muon_isprompt)
+            values['Electron_isPrompt'] = [self.genpart_is_prompt(g) for g in electron_matches]
+            values['Muon_isPrompt'] = [self.genpart_is_prompt(g) for g in muon_matches]
 
         # matchPdgId
         if 'matchPdgId' in self.variables:
-            electron_matchpdgid = [(g.pdgId if g is not None else 0) for g in electron_matches]
-            muon_matchpdgid = [(g.pdgId if g is not None else 0) for g in muon_matches]
-            self.out.fillBranch('Electron_matchPdgId', electron_matchpdgid)
-            self.out.fillBranch('Muon_matchPdgId', muon_matchpdgid)
+            values['Electron_matchPdgId'] = [(g.pdgId if g is not None else 0) for g in electron_matches]
+            values['Muon_matchPdgId'] = [(g.pdgId if g is not None else 0) for g in muon_matches]
 
         if 'provenanceConversion' in self.variables:
-            electron_provenance = [self.provenanceconversion(g, genparticles) for g in electron_matches]
-            muon_provenance = [self.provenanceconversion(g, genparticles) for g in muon_matches]
-            self.out.fillBranch('Electron_provenanceConversion', electron_provenance)
-            self.out.fillBranch('Muon_provenanceConversion', muon_provenance)
+            values['Electron_provenanceConversion'] = ([self.provenanceconversion(g, genparticles)
+                                                        for g in electron_matches])
+            values['Muon_provenanceConversion'] = ([self.provenanceconversion(g, genparticles)
+                                                    for g in muon_matches])
 
         # motherPdgId
         if 'motherPdgId' in self.variables:
-            electron_motherpdgid = [self.motherpdgid(g, genparticles) for g in electron_matches]
-            muon_motherpdgid = [self.motherpdgid(g, genparticles) for g in muon_matches]
-            self.out.fillBranch('Electron_motherPdgId', electron_motherpdgid)
-            self.out.fillBranch('Muon_motherPdgId', muon_motherpdgid)
+            values['Electron_motherPdgId'] = [self.motherpdgid(g, genparticles) for g in electron_matches]
+            values['Muon_motherPdgId'] = [self.motherpdgid(g, genparticles) for g in muon_matches]
 
         # isChargeFlip
         if 'isChargeFlip' in self.variables:
@@ -117,10 +365,10 @@ class LeptonGenVariablesModule(Module):
             for i,(m,g) in enumerate(zip(muons, muon_matches)):
                 if g is None: continue
                 if g.pdgId==-m.pdgId: muon_ischargeflip[i] = True
-            self.out.fillBranch('Electron_isChargeFlip', electron_ischargeflip)
-            self.out.fillBranch('Muon_isChargeFlip', muon_ischargeflip)
+            values['Electron_isChargeFlip'] = electron_ischargeflip
+            values['Muon_isChargeFlip'] = muon_ischargeflip
 
-        return True
+        return values
 
     def genpart_has_status(self, genpart, status):
         ### internal helper function to determine if a gen particle has a given status
@@ -8,6 +8,8 @@ ROOT.PyConfig.IgnoreCommandLineOptions = True
 import sys
 import os
 # from pathlib import Path
+import numpy as np
+import awkward as ak
 
 # import nanoAODTools
 from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection,Object
@@ -35,6 +37,14 @@ class LeptonVariablesModule(Module):
         print('Initialized a LeptonVariablesModule with following parameters:')
         print('  - variables:')
         for var in self.variables: print('    - {}'.format(var))
+        # declare the branches read and written by this module
+        # (see processing/pipelineplanner.py)
+        self.inputbranches = ['nElectron', 'nMuon']
+        if 'jetPtRatio' in self.variables:
+            self.inputbranches += ['Electron_jetRelIso', 'Muon_jetRelIso']
+        if 'jetBTagDeepFlavor' in self.variables:
+            self.inputbranches += ['Electron_jetIdx', 'Muon_jetIdx', 'nJet', 'Jet_btagDeepFlavB']
+        self.outputbranches = ['{}_{}'.format(c, v) for v in self.variables for c in ['Electron', 'Muon']]
 
     def beginFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
         self.out = wrappedOutputTree
@@ -71,3 +81,27 @@ class LeptonVariablesModule(Module):
             self.out.fillBranch('Muon_jetBTagDeepFlavor', muon_jdf)
 
         return True
+
+    def process_chunk(self, chunk):
+        ### columnar counterpart of analyze (see processing/columnarprocessor.py)
+        # note: computations are done in double precision and converted afterwards,
+        #       to give exactly the same values as filling the branches in analyze.
+        newbranches = {}
+
+        # jetPtRatio
+        if 'jetPtRatio' in self.variables:
+            for collection in ['Electron', 'Muon']:
+                jetreliso = ak.values_astype(chunk[collection+'_jetRelIso'], np.float64)
+                jetptratio = 1./(jetreliso+1)
+                newbranches[collection+'_jetPtRatio'] = ak.values_astype(jetptratio, np.float32)
+
+        # jetBTagDeepFlavor
+        if 'jetBTagDeepFlavor' in self.variables:
+            jetbtag = chunk['Jet_btagDeepFlavB']
+            for collection in ['Electron', 'Muon']:
+                jetidx = chunk[collection+'_jetIdx']
+                jetidx = ak.mask(jetidx, jetidx>=0)
+                jdf = ak.fill_none(jetbtag[jetidx], 0)
+                newbranches[collection+'_jetBTagDeepFlavor'] = ak.values_astype(jdf, np.float32)
+
+        return newbranches
@@ -0,0 +1,213 @@
+###################################################
+# Planner for the order of modules in a processor #
+###################################################
+# Modules are classified as filters (modules with a mask method and without
+# a process_chunk method, e.g. the skimmers) or producers (all other modules).
+# Filters are moved as early as possible in the chain,
+# so that producers only run (and only read their input branches) for events
+# that pass the filters; the NanoAODTools PostProcessor stops evaluating modules
+# for an event as soon as a module returns False, and branches are only read
+# from the input tree when they are accessed.
+# To do this safely, modules declare the branches they read and write
+# in the attributes inputbranches and outputbranches (lists of branch names,
+# possibly with wildcards). A filter is never moved before:
+# - another filter (the order of the filters is kept),
+# - a module that needs to see all events (attribute needsallevents, e.g. PSWeightSumModule),
+# - a module that writes one of the branches the filter reads,
+# - a module that does not declare its output branches (e.g. the NanoAODTools JetMET corrector).
+# Filters that do not declare their input branches are not moved at all.
+
+# imports
+import sys
+import os
+import fnmatch
+import numpy as np
+
+
+def isfilter(module):
+    ### check if a module is a filter (as opposed to a producer)
+    if hasattr(module, 'isfilter'): return module.isfilter
+    return ( hasattr(module, 'mask') and not hasattr(module, 'process_chunk') )
+
+
+def matchbranches(patterns, branchnames):
+    ### find the branch names that match any of a list of patterns
+    selected = []
+    for branchname in branchnames:
+        if any([fnmatch.fnmatchcase(branchname, pattern) for pattern in patterns]):
+            selected.append(branchname)
+    return selected
+
+
+def overlaps(patterns1, patterns2):
+    ### check if two lists of branch names (possibly with wildcards) can match the same branch
+    for p1 in patterns1:
+        for p2 in patterns2:
+            if( fnmatch.fnmatchcase(p1, p2) or fnmatch.fnmatchcase(p2, p1) ): return True
+    return False
+
+
+def mustfollow(module, other):
+    ### check if a filter must stay after another module that precedes it
+    inputs = getattr(module, 'inputbranches', None)
+    outputs = getattr(other, 'outputbranches', None)
+    if inputs is None: return True
+    if isfilter(other): return True
+    if getattr(other, 'needsallevents', False): return True
+    if outputs is None: return True
+    return overlaps(inputs, outputs)
+
+
+class PipelinePlanner(object):
+    ### planner for the order of modules (see the description above)
+
+    def __init__(self, modules):
+        ### initializer
+        # input arguments:
+        # - modules: list of modules, in the order they were defined
+        self.modules = list(modules)
+        self.planned = self.plan()
+
+    def plan(self):
+        ### determine the order of the modules
+        # returns:
+        # a list of modules, with each filter moved directly after
+        # the last module it must follow (see mustfollow)
+        planned = []
+        for module in self.modules:
+            if not isfilter(module):
+                planned.append(module)
+                continue
+            position = 0
+            for i, other in enumerate(planned):
+                if mustfollow(module, other): position = i+1
+            planned.insert(position, module)
+        return planned
+
+    def passfractions(self, tree, nevents=10000):
+        ### estimate the fraction of events that pass each filter
+        # by evaluating the mask methods of the filters on the first events of a tree
+        # (filters that read branches which are not in the tree, e.g. branches added
+        #  by a producer, cannot be evaluated and are assumed to let all events pass)
+        # input arguments:
+        # - tree: uproot tree
+        # - nevents: number of events to use
+        # returns:
+        # a dict matching modules to the fraction of events that pass
+        # all filters before (and including) that module in the planned order,
+        # or None if no filter can be evaluated this way
+        branchnames = tree.keys()
+        filters = []
+        for module in self.planned:
+            if not( isfilter(module) and hasattr(module, 'mask') ): continue
+            inputs = getattr(module, 'inputbranches', None)
+            if inputs is None: continue
+            if all([len(matchbranches([pattern], branchnames))>0 for pattern in inputs]):
+                filters.append(module)
+        if len(filters)==0: return None
+        inputs = matchbranches(sum([module.inputbranches for module in filters], []), branchnames)
+        chunk = tree.arrays(inputs, entry_stop=nevents, library='ak', how=dict)
+        ntotal = len(chunk[inputs[0]]) if len(inputs)>0 else 0
+        if ntotal==0: return None
+        mask = np.ones(ntotal, dtype=bool)
+        fraction = 1.
+        fractions = {}
+        for module in self.planned:
+            if module in filters:
+                mask &= np.asarray(module.mask(chunk), dtype=bool)
+                fraction = np.sum(mask)/float(ntotal)
+            fractions[module] = fraction
+        return fractions
+
+    def readvolume(self, modules, branchsizes, fractions=None):
+        ### estimate the volume of branch reads for a given order of modules
+        # each branch is counted once, for the fraction of events
+        # that reach the first module reading it;
+        # the remaining branches are read for the events written to the output.
+        # input arguments:
+        # - modules: list of modules in the order they are run
+        # - branchsizes: dict of branch names to their (compressed) size in bytes
+        # - fractions: dict of modules to pass fractions (see passfractions)
+        # returns:
+        # a tuple of a list with the bytes read by each module (None if unknown),
+        # and the bytes read when copying the remaining branches to the output
+        read = set()
+        volumes = []
+        fraction = 1.
+        # (with the planned order, the fractions are valid for any order of the same filters,
+        #  since only the position of the filters relative to the producers changes)
+        filterfractions = [fractions[m] for m in self.planned if isfilter(m)] if fractions else []
+        nfilters = 0
+        for module in modules:
+            inputs = getattr(module, 'inputbranches', None)
+            if inputs is None:
+                volumes.append(None)
+            else:
+                new = [b for b in matchbranches(inputs, branchsizes.keys()) if b not in read]
+                read.update(new)
+                volumes.append(fraction * sum([branchsizes[b] for b in new]))
+            if( isfilter(module) and nfilters < len(filterfractions) ):
+                fraction = filterfractions[nfilters]
+                nfilters += 1
+        copy = fraction * sum([size for b, size in branchsizes.items() if b not in read])
+        return (volumes, copy)
+
+    def printplan(self):
+        ### print the planned order of the modules
+        print('Planned order of modules:')
+        for i, module in enumerate(self.planned):
+            kind = 'filter' if isfilter(module) else 'producer'
+            if getattr(module, 'needsallevents', False): kind += ', needs all events'
+            inputs = getattr(module, 'inputbranches', None)
+            ninputs = 'undeclared' if inputs is None else str(len(inputs))
+            print('  {}. {} ({}; input branches: {})'.format(i+1, type(module).__name__, kind, ninputs))
+
+    def printreadvolume(self, tree, nevents=10000):
+        ### print the estimated volume of branch reads for the planned and original order
+        # input arguments:
+        # - tree: uproot tree or path to a file with a tree named 'Events'
+        # - nevents: number of events to estimate the filter pass fractions
+        import uproot
+        if isinstance(tree, str):
+            with uproot.open(tree) as f:
+                return self.printreadvolume(f['Events'], nevents=nevents)
+        branchsizes = {b: tree[b].compressed_bytes for b in tree.keys()}
+        fractions = self.passfractions(tree, nevents=nevents)
+        if fractions is None:
+            print('WARNING: could not evaluate the filters, assuming all events pass.')
+        print('Estimated branch read volume (compressed, for {} events):'.format(tree.num_entries))
+        for order, modules in [('planned', self.planned), ('original', self.modules)]:
+            (volumes, copy) = self.readvolume(modules, branchsizes, fractions=fractions)
+            known = sum([v for v in volumes if v is not None])
+            msg = '  - {} order: {:.1f} MB by modules, {:.1f} MB for output copy'.format(
+                    order, known/1e6, copy/1e6)
+            nunknown = len([v for v in volumes if v is None])
+            if nunknown > 0: msg += ' (+ {} modules with undeclared inputs)'.format(nunknown)
+            print(msg)
+            if order!='planned': continue
+            for module, volume in zip(modules, volumes):
+                if volume is None: continue
+                msg = '      {}: {:.3f} MB'.format(type(module).__name__, volume/1e6)
+                if fractions is not None:
+                    msg += ' (pass fraction after this module: {:.3f})'.format(fractions[module])
+                print(msg)
+
+
+def planmodules(modules, inputfile=None, verbose=True):
+    ### convenience function to plan the order of a list of modules
+    # input arguments:
+    # - modules: list of modules
+    # - inputfile: input file used to estimate the branch read volume (optional;
+    #   note that this opens the file and reads the filter input branches of its first events,
+    #   so only pass it when a report is requested, not by default in production jobs)
+    # - verbose: print the plan
+    # returns:
+    # the list of modules in the planned order
+    planner = PipelinePlanner(modules)
+    if verbose:
+        planner.printplan()
+        if inputfile is not None:
+            try: planner.printreadvolume(inputfile)
+            except Exception as e:
+                print('WARNING: could not estimate the branch read volume: {}'.format(e))
+    return planner.planned
@@ -0,0 +1,290 @@
+######################################################
+# Profiling of the modules in a PostProcessor chain #
+######################################################
+# Opt-in instrumentation: each module in the chain is wrapped in a ProfiledModule,
+# which measures the time spent in beginJob, beginFile, analyze, endFile and endJob,
+# counts the accepted and rejected events, and measures the bytes read
+# from the input files while the module is running (branches are read lazily,
+# so this attributes the branch reads to the module that triggers them).
+# Optionally, the per-event latency of each module is histogrammed.
+# At the end of the job, the ChainProfiler combines this into a summary
+# (a json-serializable dict), which can be written to a json file
+# and into the output ROOT file (as a TObjString named perfsummary),
+# so that it travels back together with the output (e.g. from CRAB jobs).
+# Usage:
+#   profiler = ChainProfiler(modules)
+#   p = PostProcessor(..., modules=profiler.modules, ...)
+#   p.run()
+#   profiler.write(outputfile)
+
+# imports
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+import sys
+import os
+import json
+import math
+import time
+import socket
+import resource
+
+# import nanoAODTools
+from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
+
+
+# name of the summary object in the output ROOT file
+SUMMARY_NAME = 'perfsummary'
+SUMMARY_VERSION = 1
+
+# binning of the per-event latency histograms
+# (logarithmic, from 10^HISTOGRAM_MIN to 10^HISTOGRAM_MAX seconds,
+#  with underflow and overflow in the first and last bin)
+HISTOGRAM_MIN = -7
+HISTOGRAM_MAX = 2
+HISTOGRAM_BINSPERDECADE = 10
+
+
+def histogramedges():
+    ### get the bin edges (in seconds) of the per-event latency histograms
+    nbins = (HISTOGRAM_MAX - HISTOGRAM_MIN) * HISTOGRAM_BINSPERDECADE
+    return [10**(HISTOGRAM_MIN + i/float(HISTOGRAM_BINSPERDECADE)) for i in range(nbins+1)]
+
+
+def bytesread():
+    ### total number of bytes read from all ROOT files so far
+    return int(ROOT.TFile.GetFileBytesRead())
+
+
+def byteswritten():
+    ### total number of bytes written to all ROOT files so far
+    return int(ROOT.TFile.GetFileBytesWritten())
+
+
+def peakrss():
+    ### peak resident memory of this process (in bytes)
+    # (note: ru_maxrss is in kilobytes on linux)
+    return int(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)*1024
+
+
+class ProfiledModule(Module):
+    ### wrapper around a module that profiles its methods
+    # (all other attributes are forwarded to the wrapped module)
+
+    def __init__(self, module, histogram=False):
+        ### initializer
+        # input arguments:
+        # - module: the module to profile
+        # - histogram: whether to histogram the per-event latency of analyze
+        self.module = module
+        self.name = type(module).__name__
+        self.times = {}
+        self.calls = {}
+        self.naccepted = 0
+        self.nrejected = 0
+        self.bytesread = 0
+        self.histogram = None
+        if histogram:
+            self.histogram = [0]*((HISTOGRAM_MAX - HISTOGRAM_MIN)*HISTOGRAM_BINSPERDECADE + 2)
+
+    def __getattr__(self, name):
+        # (only called for attributes that are not found on the wrapper itself)
+        if name=='module': raise AttributeError(name)
+        return getattr(self.module, name)
+
+    def timed(self, method, *args, **kwargs):
+        ### internal helper function to call and time a method of the wrapped module
+        start = time.perf_counter()
+        startbytes = bytesread()
+        res = getattr(self.module, method)(*args, **kwargs)
+        self.bytesread += bytesread() - startbytes
+        self.times[method] = self.times.get(method, 0.) + time.perf_counter() - start
+        self.calls[method] = self.calls.get(method, 0) + 1
+        return res
+
+    def beginJob(self, *args, **kwargs):
+        return self.timed('beginJob', *args, **kwargs)
+
+    def endJob(self):
+        return self.timed('endJob')
+
+    def beginFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
+        return self.timed('beginFile', inputFile, outputFile, inputTree, wrappedOutputTree)
+
+    def endFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
+        return self.timed('endFile', inputFile, outputFile, inputTree, wrappedOutputTree)
+
+    def analyze(self, event):
+        # (not using self.timed, to keep the overhead per event small)
+        start = time.perf_counter()
+        startbytes = bytesread()
+        res = self.module.analyze(event)
+        dt = time.perf_counter() - start
+        self.bytesread += bytesread() - startbytes
+        self.times['analyze'] = self.times.get('analyze', 0.) + dt
+        self.calls['analyze'] = self.calls.get('analyze', 0) + 1
+        if res: self.naccepted += 1
+        else: self.nrejected += 1
+        if self.histogram is not None:
+            idx = 0
+            if dt > 0:
+                idx = int(math.floor((math.log10(dt) - HISTOGRAM_MIN) * HISTOGRAM_BINSPERDECADE)) + 1
+            self.histogram[min(max(idx, 0), len(self.histogram)-1)] += 1
+        return res
+
+    def summary(self):
+        ### get a summary of the measurements for this module
+        summary = {
+          'name': self.name,
+          'calls': dict(self.calls),
+          'times': dict(self.times),
+          'totaltime': sum(self.times.values()),
+          'naccepted': self.naccepted,
+          'nrejected': self.nrejected,
+          'bytesread': self.bytesread,
+        }
+        if self.histogram is not None: summary['histogram'] = list(self.histogram)
+        return summary
+
+
+class ChainProfiler(object):
+    ### profiler for a chain of modules
+
+    def __init__(self, modules, histogram=False):
+        ### initializer
+        # input arguments:
+        # - modules: list of modules, in the order they are run
+        # - histogram: whether to histogram the per-event latency of each module
+        # note: use self.modules (the wrapped modules) instead of the original ones.
+        self.modules = [ProfiledModule(module, histogram=histogram) for module in modules]
+        self.histogram = histogram
+        self.starttime = time.time()
+        self.startcputime = time.process_time()
+        self.startbytesread = bytesread()
+        self.startbyteswritten = byteswritten()
+
+    def summary(self, inputfiles=None, outputfile=None):
+        ### get a summary of the measurements for the full chain
+        # input arguments:
+        # - inputfiles: list of input files (stored in the summary)
+        # - outputfile: output file (its name and size are stored in the summary)
+        # returns:
+        # a json-serializable dict
+        walltime = time.time() - self.starttime
+        modules = [module.summary() for module in self.modules]
+        summary = {
+          'version': SUMMARY_VERSION,
+          'host': socket.gethostname(),
+          'starttime': self.starttime,
+          'walltime': walltime,
+          'cputime': time.process_time() - self.startcputime,
+          'nevents': modules[0]['calls'].get('analyze', 0) if len(modules)>0 else 0,
+          'bytesread': bytesread() - self.startbytesread,
+          'byteswritten': byteswritten() - self.startbyteswritten,
+          'peakrss': peakrss(),
+          'modules': modules,
+          # (time not spent in any module: reading, writing and framework overhead)
+          'othertime': walltime - sum([module['totaltime'] for module in modules]),
+        }
+        if inputfiles is not None: summary['inputfiles'] = list(inputfiles)
+        if( outputfile is not None and os.path.exists(outputfile) ):
+            summary['outputfile'] = os.path.basename(outputfile)
+            summary['outputsize'] = os.path.getsize(outputfile)
+        if self.histogram: summary['histogramedges'] = histogramedges()
+        return summary
+
+    def write(self, outputfile, inputfiles=None, jsonfile=None):
+        ### write the summary to a json file and into an output ROOT file
+        # input arguments:
+        # - outputfile: ROOT file to add the summary to (as a TObjString named perfsummary),
+        #   or None to only write the json file
+        # - inputfiles: list of input files (stored in the summary)
+        # - jsonfile: path to the json file (default: the output file with extension .perf.json)
+        # note: the summary is added to an existing ROOT file,
+        #       which changes its modification time; so write any sidecar files afterwards.
+        summary = self.summary(inputfiles=inputfiles, outputfile=outputfile)
+        writesummary(summary, outputfile, jsonfile=jsonfile)
+        self.printsummary(summary)
+        return summary
+
+    def printsummary(self, summary=None):
+        ### print a short timing report
+        if summary is None: summary = self.summary()
+        nevents = max(summary['nevents'], 1)
+        print('Timing report ({} events, {:.1f} s wall time, {:.1f} s cpu time,'.format(
+              summary['nevents'], summary['walltime'], summary['cputime'])
+              + ' {:.1f} MB read, {:.1f} MB written):'.format(
+              summary['bytesread']/1e6, summary['byteswritten']/1e6))
+        for module in summary['modules']:
+            msg = '  - {}: {:.2f} s ({:.1f} us/event)'.format(
+                  module['name'], module['totaltime'], 1e6*module['times'].get('analyze', 0.)/nevents)
+            msg += ', {:.1f} MB read'.format(module['bytesread']/1e6)
+            if module['nrejected']>0:
+                msg += ', accepted {} / {} events'.format(
+                       module['naccepted'], module['naccepted']+module['nrejected'])
+            print(msg)
+        print('  - other (I/O and framework): {:.2f} s'.format(summary['othertime']))
+
+
+def writesummary(summary, outputfile, jsonfile=None):
+    ### write a summary to a json file and into an output ROOT file
+    # (see ChainProfiler.write)
+    if( jsonfile is None and outputfile is not None ):
+        jsonfile = os.path.splitext(outputfile)[0] + '.perf.json'
+    if jsonfile is not None:
+        with open(jsonfile, 'w') as f: json.dump(summary, f, indent=2)
+    if outputfile is not None:
+        f = ROOT.TFile.Open(outputfile, 'UPDATE')
+        ROOT.TObjString(json.dumps(summary)).Write(SUMMARY_NAME, ROOT.TObject.kOverwrite)
+        f.Close()
+
+
+def readsummary(rootfile):
+    ### read the summary from an output ROOT file
+    # returns:
+    # the summary as a dict, or None if the file does not contain a summary
+    import uproot
+    with uproot.open(rootfile) as f:
+        if SUMMARY_NAME not in f: return None
+        return json.loads(str(f[SUMMARY_NAME]))
+
+
+def mergesummaries(summaries):
+    ### aggregate the summaries of multiple jobs
+    # (modules are matched by position and name)
+    # returns:
+    # a summary in the same format, with summed times, counts and bytes
+    summaries = [s for s in summaries if s is not None]
+    if len(summaries)==0: return None
+    merged = {
+      'version': SUMMARY_VERSION,
+      'njobs': len(summaries),
+      'walltime': sum([s['walltime'] for s in summaries]),
+      'cputime': sum([s['cputime'] for s in summaries]),
+      'nevents': sum([s['nevents'] for s in summaries]),
+      'bytesread': sum([s['bytesread'] for s in summaries]),
+      'byteswritten': sum([s['byteswritten'] for s in summaries]),
+      'outputsize': sum([s.get('outputsize', 0) for s in summaries]),
+      'peakrss': max([s.get('peakrss', 0) for s in summaries]),
+      'othertime': sum([s['othertime'] for s in summaries]),
+      'modules': [],
+    }
+    modules = {}
+    for s in summaries:
+        for i, module in enumerate(s['modules']):
+            key = (i, module['name'])
+            if key not in modules:
+                modules[key] = {'name': module['name'], 'calls': {}, 'times': {}, 'totaltime': 0.,
+                                'naccepted': 0, 'nrejected': 0, 'bytesread': 0}
+                merged['modules'].append(modules[key])
+            m = modules[key]
+            for method, ncalls in module['calls'].items():
+                m['calls'][method] = m['calls'].get(method, 0) + ncalls
+            for method, t in module['times'].items():
+                m['times'][method] = m['times'].get(method, 0.) + t
+            for field in ['totaltime', 'naccepted', 'nrejected', 'bytesread']:
+                m[field] += module[field]
+            if 'histogram' in module:
+                if 'histogram' not in m: m['histogram'] = [0]*len(module['histogram'])
+                m['histogram'] = [a+b for a, b in zip(m['histogram'], module['histogram'])]
+        if( 'histogramedges' in s ): merged['histogramedges'] = s['histogramedges']
+    return merged
@@ -8,6 +8,8 @@ ROOT.PyConfig.IgnoreCommandLineOptions = True
 import sys
 import os
 # from pathlib import Path
+import numpy as np
+import awkward as ak
 
 # import nanoAODTools
 from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection,Object
@@ -19,6 +21,12 @@ class PSWeightSumModule(Module):
         print('Initialized a PSWeightSumModule with following parameters:')
 
         self.values = [0., 0., 0., 0.]
+        # declare the branches read and written by this module
+        # (see processing/pipelineplanner.py);
+        # the sums must include all events, so this module must run before any filter.
+        self.inputbranches = ['genWeight', 'nPSWeight', 'PSWeight']
+        self.outputbranches = []
+        self.needsallevents = True
         return
     
     def beginFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
@@ -58,10 +66,55 @@ class PSWeightSumModule(Module):
         # for weight in weight: sum
         # end result: Sum of genEventWeight * PSWeight[i] -> so also get the genWeight
         # need to add a fill here!
+        # note: events with fewer than 4 PSWeights (e.g. nPSWeight==1 in samples
+        #       without parton shower weights) are filled with weight 0 for the missing ones,
+        #       instead of reading past the end of the array
+        #       (the same convention is used in process_chunk).
+        npsweight = len(self.PSWeight)
         for i in range(4):
             # print(self.PSWeight[i])
-            totalweight = self.PSWeight[i] * genweight
+            totalweight = self.PSWeight[i] * genweight if i < npsweight else 0.
             # print(totalweight)
             self.h_psweightsum.Fill(i, totalweight)
         # print("Event done")
         return True
+
+    def begin_chunks(self, branchnames):
+        ### columnar counterpart of beginFile (see processing/columnarprocessor.py)
+        # (the statistics of the TH1D filled in analyze are tracked as well,
+        #  so that the written histogram is identical)
+        self.psweightsums = np.zeros(4)
+        self.psweightsumw2 = np.zeros(4)
+        self.nfills = 0
+
+    def process_chunk(self, chunk):
+        ### columnar counterpart of analyze (see processing/columnarprocessor.py)
+        # (no new branches are added, only the sums are updated)
+        # note: missing PSWeights in events with fewer than 4 of them are padded with 0,
+        #       as in analyze; each event still counts as 4 fills of the histogram.
+        psweight = ak.fill_none(ak.pad_none(chunk['PSWeight'], 4, clip=True), 0.)
+        psweight = ak.to_numpy(psweight).astype(np.float64)
+        genweight = np.asarray(chunk['genWeight'], dtype=np.float64)
+        totalweight = psweight * genweight[:,np.newaxis]
+        self.psweightsums += np.sum(totalweight, axis=0)
+        self.psweightsumw2 += np.sum(totalweight**2, axis=0)
+        self.nfills += 4*len(genweight)
+        return {}
+
+    def end_chunks(self, outputfile):
+        ### columnar counterpart of endFile (see processing/columnarprocessor.py)
+        # write a full TH1D (with sumw2 and fill statistics, as TH1D::Fill(i, w) would give)
+        from uproot.writing.identify import to_TH1x, to_TAxis
+        x = np.arange(4, dtype=np.float64)
+        # (the data arrays include the underflow and overflow bins)
+        data = np.concatenate(([0.], self.psweightsums, [0.]))
+        sumw2 = np.concatenate(([0.], self.psweightsumw2, [0.]))
+        histogram = to_TH1x('PSWeightSum', 'PSWeightSum', data,
+                      fEntries=float(self.nfills),
+                      fTsumw=np.sum(self.psweightsums),
+                      fTsumw2=np.sum(self.psweightsumw2),
+                      fTsumwx=np.sum(self.psweightsums*x),
+                      fTsumwx2=np.sum(self.psweightsums*x**2),
+                      fSumw2=sumw2,
+                      fXaxis=to_TAxis('xaxis', '', 4, -0.5, 3.5))
+        outputfile['PSWeightSum'] = histogram
@@ -0,0 +1,204 @@
+#################################################################
+# Split the processing of a job over multiple worker processes #
+#################################################################
+# The input files of a job (or, if there are fewer files than worker processes,
+# consecutive entry ranges within the files) are split into shards,
+# and each shard is processed by a separate worker process with its own module chain,
+# writing its partial output files into its own shard directory.
+# At the end, the partial output files are merged again
+# (with haddnano.py from NanoAODTools, as done by the PostProcessor for haddFileName).
+# The worker processes are started by re-running the job script with the extra options
+# --shardfile <json file with the shards> --shard <index>,
+# so that the job script itself decides how to process a single shard.
+# Usage (in a job script, see crabsubmission/crabrun.py and condor/condorrun.py):
+#   shards = makeshards(inputfiles, ncores, entryranges)
+#   writeshards(shards, shardfile)
+#   exitcodes = runshards([sys.executable] + sys.argv + ['--shardfile', shardfile], len(shards), outputdir)
+#   for (inputfile, partialfiles) in partialoutputs(shards, outputdir):
+#       mergeoutputs(outputfile, partialfiles)
+
+# imports
+import os
+import sys
+import json
+import shutil
+import subprocess
+
+# import local tools
+from PhysicsTools.nanoSkimming.processing.profiling import mergesummaries
+
+
+def getnentries(inputfile, treename='Events'):
+    ### get the number of entries in the tree of a file
+    import uproot
+    with uproot.open(inputfile) as f:
+        if treename not in f: return 0
+        return f[treename].num_entries
+
+
+def makeshards(inputfiles, nshards, entryranges=None, nentries=None):
+    ### split input files or entry ranges over a number of shards
+    # input arguments:
+    # - inputfiles: list of input files
+    # - nshards: number of shards (i.e. of worker processes)
+    # - entryranges: dict matching input files to (firstentry, maxentries)
+    #   (e.g. from a json pre-pass; maxentries can be None; default: all entries)
+    # - nentries: dict matching input files to their number of entries
+    #   (default: read from the files)
+    # returns:
+    # a list of shards, where each shard is a list of [inputfile, firstentry, nentries].
+    # note: with at least as many files as shards, whole files are distributed over the shards
+    #       (consecutive files, balanced in number of entries);
+    #       else the entry range of each file is split in consecutive parts
+    #       (with a number of parts per file proportional to its number of entries).
+    #       the order of the input files and entries is kept,
+    #       and empty shards are removed, so there can be fewer shards than requested.
+    if entryranges is None: entryranges = {}
+    if nentries is None: nentries = {}
+    ranges = []
+    for inputfile in inputfiles:
+        (firstentry, maxentries) = entryranges.get(inputfile, (0, None))
+        n = nentries[inputfile] if inputfile in nentries else getnentries(inputfile)
+        n = max(0, n - firstentry)
+        if maxentries is not None: n = min(n, maxentries)
+        ranges.append([inputfile, firstentry, n])
+    if( nshards<=1 or len(ranges)==0 ): return [ranges] if len(ranges)>0 else []
+
+    # case of at least as many files as shards
+    if len(ranges)>=nshards:
+        shards = [[] for _ in range(nshards)]
+        total = max(1, sum([r[2] for r in ranges]))
+        cumulative = 0
+        ishard = 0
+        for i, r in enumerate(ranges):
+            # move to the next shard if the middle of this file is past the shard boundary,
+            # or if each of the remaining shards needs a file
+            nremaining = len(ranges) - i
+            if( len(shards[ishard])>0 and ishard<nshards-1
+                and ( cumulative + r[2]/2. > total*(ishard+1)/float(nshards)
+                      or nremaining <= nshards-1-ishard ) ):
+                ishard += 1
+            shards[ishard].append(r)
+            cumulative += r[2]
+        return [shard for shard in shards if len(shard)>0]
+
+    # case of fewer files than shards
+    nparts = [1]*len(ranges)
+    for _ in range(nshards - len(ranges)):
+        i = max(range(len(ranges)), key=lambda i: ranges[i][2]/float(nparts[i]))
+        nparts[i] += 1
+    shards = []
+    for r, n in zip(ranges, nparts):
+        (inputfile, firstentry, nentries) = r
+        bounds = [firstentry + (k*nentries)//n for k in range(n+1)]
+        parts = [[inputfile, bounds[k], bounds[k+1]-bounds[k]] for k in range(n)]
+        parts = [part for part in parts if part[2]>0]
+        if len(parts)==0: parts = [r]
+        shards += [[part] for part in parts]
+    return shards
+
+
+def writeshards(shards, shardfile):
+    ### write shards to a json file
+    with open(shardfile, 'w') as f: json.dump(shards, f, indent=2)
+
+
+def readshards(shardfile):
+    ### read shards from a json file
+    with open(shardfile, 'r') as f: return json.load(f)
+
+
+def shardoutputdir(outputdir, ishard):
+    ### get the output directory of a shard
+    return os.path.join(outputdir, 'shard_{}'.format(ishard))
+
+
+def runshards(command, nshards, outputdir):
+    ### run a worker process for each shard and wait for them to finish
+    # input arguments:
+    # - command: command to run for each shard (list of strings);
+    #   the option --shard <index> is added at the end
+    # - nshards: number of shards
+    # - outputdir: base output directory
+    #   (the log of each worker is written to its shard directory and printed at the end)
+    # returns:
+    # the list of exit codes of the workers
+    procs = []
+    for ishard in range(nshards):
+        shardir = shardoutputdir(outputdir, ishard)
+        if not os.path.exists(shardir): os.makedirs(shardir)
+        logfile = os.path.join(shardir, 'shard.log')
+        with open(logfile, 'w') as log:
+            proc = subprocess.Popen(command + ['--shard', str(ishard)],
+                                    stdout=log, stderr=subprocess.STDOUT)
+        procs.append((proc, logfile))
+    exitcodes = []
+    for ishard, (proc, logfile) in enumerate(procs):
+        exitcodes.append(proc.wait())
+        print('--- Output of shard {} (exit code {}) ---'.format(ishard, exitcodes[-1]))
+        with open(logfile, 'r') as log: print(log.read())
+        sys.stdout.flush()
+    return exitcodes
+
+
+def partialoutputs(shards, outputdir, postfix=''):
+    ### get the partial output files for each input file
+    # returns:
+    # a list of (inputfile, list of partial output files), in the order of the input files
+    # note: partial output files that do not exist (e.g. because a worker failed)
+    #       are included as well, check their existence before merging.
+    outputs = []
+    for ishard, shard in enumerate(shards):
+        for (inputfile, _, _) in shard:
+            outputfile = os.path.join(shardoutputdir(outputdir, ishard),
+                           os.path.basename(inputfile).replace('.root', postfix+'.root'))
+            if( len(outputs)==0 or outputs[-1][0]!=inputfile ): outputs.append((inputfile, []))
+            outputs[-1][1].append(outputfile)
+    return outputs
+
+
+def mergeoutputs(outputfile, partialfiles):
+    ### merge partial output files into a single output file
+    # (a single partial file is just moved)
+    if len(partialfiles)==1:
+        shutil.move(partialfiles[0], outputfile)
+        return outputfile
+    haddnano = 'haddnano.py'
+    # (for CRAB jobs, haddnano.py is copied to the working directory, see crabconfig.py)
+    if not os.path.exists(haddnano): haddnano = shutil.which(haddnano)
+    if haddnano is None:
+        raise Exception('ERROR: haddnano.py not found.')
+    cmd = [sys.executable, haddnano, outputfile] + list(partialfiles)
+    if subprocess.run(cmd).returncode!=0:
+        raise Exception('ERROR: merging of {} into {} failed.'.format(partialfiles, outputfile))
+    return outputfile
+
+
+def mergeshardsummaries(partialfiles, walltime):
+    ### merge the profiling summaries of partial output files (see processing/profiling.py)
+    # input arguments:
+    # - partialfiles: partial output files (with a summary in a json file next to them)
+    # - walltime: wall time of the full job
+    #   (the wall times of the workers are summed in workertime instead)
+    # returns:
+    # the merged summary (or the summary itself if there is only one),
+    # or None if no summaries are found
+    summaries = []
+    for partialfile in partialfiles:
+        jsonfile = os.path.splitext(partialfile)[0] + '.perf.json'
+        if not os.path.exists(jsonfile): continue
+        with open(jsonfile, 'r') as f: summaries.append(json.load(f))
+    if len(summaries)==1: return summaries[0]
+    summary = mergesummaries(summaries)
+    if summary is None: return None
+    summary['nworkers'] = summary.pop('njobs')
+    summary['workertime'] = summary['walltime']
+    summary['walltime'] = walltime
+    return summary
+
+
+def removeshards(outputdir, nshards):
+    ### remove the shard directories
+    for ishard in range(nshards):
+        shardir = shardoutputdir(outputdir, ishard)
+        if os.path.exists(shardir): shutil.rmtree(shardir)
@@ -14,12 +14,16 @@ import sys
 import os
 # from pathlib import Path
 import numpy as np
+import awkward as ak
 import xgboost as xgb
 
 # import nanoAODTools
 from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection,Object
 from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
 
+# import local tools
+from PhysicsTools.nanoSkimming.tools.chunktools import flatcolumns, unflatten
+
 
 class TopLeptonMvaModule(Module):
 
@@ -86,6 +90,26 @@ class TopLeptonMvaModule(Module):
         self.electronmva.load_model(elweightfile)
         self.muonmva = xgb.Booster()
         self.muonmva.load_model(muweightfile)
+        # (use a single thread for the predictions, as for the DMatrix with nthread=1,
+        #  so that multi-core jobs with one worker per core do not oversubscribe the CPUs)
+        self.electronmva.set_param({'nthread': 1})
+        self.muonmva.set_param({'nthread': 1})
+
+        # define the input variables (as named in nanoAOD, without collection prefix)
+        commonvariables = ([ 'pt', 'eta', 'jetNDauCharged',
+                             'miniPFRelIso_chg', 'miniPFRelIso_all',
+                             'jetPtRelv2', 'jetPtRatio', 'pfRelIso03_all',
+                             'jetBTagDeepFlavor', 'sip3d', 'dxy', 'dz' ])
+        self.electronvariables = commonvariables + ['mvaFall17V2noIso']
+        if self.version=='ULv2': self.electronvariables.append('lostHits')
+        self.muonvariables = commonvariables + ['segmentComp']
+
+        # declare the branches read and written by this module
+        # (see processing/pipelineplanner.py)
+        self.inputbranches = (['nElectron', 'nMuon']
+                              + ['Electron_'+v for v in self.electronvariables]
+                              + ['Muon_'+v for v in self.muonvariables])
+        self.outputbranches = [self.electronvarname, self.muonvarname]
 
     def beginFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
         self.out = wrappedOutputTree
@@ -95,50 +119,101 @@ class TopLeptonMvaModule(Module):
     def endFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
         pass
 
+    def getElectronFeatures(self, electrons):
+        ### get the MVA input features for a set of electrons
+        # input arguments:
+        # - electrons: mapping of variable names (without 'Electron_' prefix)
+        #   to flat arrays with one entry per electron;
+        #   can e.g. be a dict of numpy arrays, a flattened awkward record array,
+        #   or the output of self.getColumns for a list of nanoAODTools electrons.
+        # returns:
+        # a contiguous 2D numpy array of shape (number of electrons, number of features)
+        # note: the features are computed in double precision (as in the per-lepton version),
+        #       the conversion to single precision is done by xgboost.
+        features = [
+            electrons['pt'],
+            electrons['eta'],
+            electrons['jetNDauCharged'],
+            electrons['miniPFRelIso_chg'],
+            (np.asarray(electrons['miniPFRelIso_all'], dtype=np.float64)
+             - np.asarray(electrons['miniPFRelIso_chg'], dtype=np.float64)),
+            electrons['jetPtRelv2'],
+            electrons['jetPtRatio'],
+            electrons['pfRelIso03_all'],
+            electrons['jetBTagDeepFlavor'],
+            electrons['sip3d'],
+            np.log(np.abs(np.asarray(electrons['dxy'], dtype=np.float64))),
+            np.log(np.abs(np.asarray(electrons['dz'], dtype=np.float64))),
+            electrons['mvaFall17V2noIso'],
+        ]
+        if self.version=='ULv2': features.append( electrons['lostHits'] )
+        return self.stackFeatures(features)
+
+    def getMuonFeatures(self, muons):
+        ### get the MVA input features for a set of muons
+        # (see getElectronFeatures for the format of the input and output)
+        features = [
+            muons['pt'],
+            muons['eta'],
+            muons['jetNDauCharged'],
+            muons['miniPFRelIso_chg'],
+            (np.asarray(muons['miniPFRelIso_all'], dtype=np.float64)
+             - np.asarray(muons['miniPFRelIso_chg'], dtype=np.float64)),
+            muons['jetPtRelv2'],
+            muons['jetPtRatio'],
+            muons['pfRelIso03_all'],
+            muons['jetBTagDeepFlavor'],
+            muons['sip3d'],
+            np.log(np.abs(np.asarray(muons['dxy'], dtype=np.float64))),
+            np.log(np.abs(np.asarray(muons['dz'], dtype=np.float64))),
+            muons['segmentComp'],
+        ]
+        return self.stackFeatures(features)
+
+    def stackFeatures(self, columns):
+        ### internal helper function to stack feature columns into a 2D array
+        features = np.empty((len(columns[0]), len(columns)), dtype=np.float64)
+        for i, column in enumerate(columns):
+            features[:,i] = column
+        return features
+
+    def predict(self, booster, features):
+        ### get the MVA scores for a 2D array of features in a single call
+        # note: inplace_predict avoids the construction of a DMatrix,
+        #       but it is only available in recent xgboost versions.
+        if len(features)==0: return np.zeros(0, dtype=np.float32)
+        if hasattr(booster, 'inplace_predict'):
+            return booster.inplace_predict(features)
+        fmatrix = xgb.DMatrix(features, nthread=1)
+        return booster.predict(fmatrix)
+
+    def getElectronMvaScores(self, electrons):
+        ### get the MVA scores for a set of electrons
+        # (see getElectronFeatures for the format of the input)
+        return self.predict(self.electronmva, self.getElectronFeatures(electrons))
+
+    def getMuonMvaScores(self, muons):
+        ### get the MVA scores for a set of muons
+        # (see getMuonFeatures for the format of the input)
+        return self.predict(self.muonmva, self.getMuonFeatures(muons))
+
+    def getColumns(self, leptons, variables):
+        ### internal helper function to convert a list of nanoAODTools objects
+        # into a dict of flat numpy arrays, one per variable.
+        return {var: np.array([getattr(lepton, var) for lepton in leptons], dtype=np.float64)
+                for var in variables}
+
     def getElectronMvaScore(self, electron):
         ### get the MVA score for an electron
-        features = ([[
-            electron.pt, 
-            electron.eta, 
-            electron.jetNDauCharged,
-            electron.miniPFRelIso_chg,
-            electron.miniPFRelIso_all - electron.miniPFRelIso_chg,
-            electron.jetPtRelv2,
-            electron.jetPtRatio,
-            electron.pfRelIso03_all,
-            electron.jetBTagDeepFlavor,
-	    electron.sip3d,
-	    np.log(abs(electron.dxy)),
-	    np.log(abs(electron.dz)),
-            electron.mvaFall17V2noIso,
-        ]])
-        if self.version=='ULv2': features[0].append( electron.lostHits )
-        features = np.array(features)
-        fmatrix = xgb.DMatrix(features, nthread=1)
-        score = self.electronmva.predict(fmatrix)[0]
-        return score
+        # (kept for backward compatibility; prefer getElectronMvaScores)
+        return self.getElectronMvaScores(
+                 self.getColumns([electron], self.electronvariables))[0]
 
     def getMuonMvaScore(self, muon):
         ### get the MVA score for an muon
-        features = ([[
-            muon.pt,
-            muon.eta,
-            muon.jetNDauCharged,
-            muon.miniPFRelIso_chg,
-            muon.miniPFRelIso_all - muon.miniPFRelIso_chg,
-            muon.jetPtRelv2,
-            muon.jetPtRatio,
-            muon.pfRelIso03_all,
-            muon.jetBTagDeepFlavor,
-            muon.sip3d,
-            np.log(abs(muon.dxy)),
-            np.log(abs(muon.dz)),
-            muon.segmentComp
-        ]])
-        features = np.array(features)
-        fmatrix = xgb.DMatrix(features, nthread=1)
-        score = self.muonmva.predict(fmatrix)[0]
-        return score
+        # (kept for backward compatibility; prefer getMuonMvaScores)
+        return self.getMuonMvaScores(
+                 self.getColumns([muon], self.muonvariables))[0]
 
     def analyze(self, event):
         ### process a single event
@@ -148,12 +223,25 @@ class TopLeptonMvaModule(Module):
         electrons = Collection(event, "Electron")
         muons = Collection(event, "Muon")
 
-        # calculate the mva score
-        electron_scores = [self.getElectronMvaScore(el) for el in electrons]
-        muon_scores = [self.getMuonMvaScore(mu) for mu in muons]
+        # calculate the mva scores for all leptons in the event in one go
+        electron_scores = self.getElectronMvaScores(
+                            self.getColumns(electrons, self.electronvariables))
+        muon_scores = self.getMuonMvaScores(
+                        self.getColumns(muons, self.muonvariables))
  
         # fill branches
-        self.out.fillBranch(self.electronvarname, electron_scores)
-        self.out.fillBranch(self.muonvarname, muon_scores)
+        self.out.fillBranch(self.electronvarname, electron_scores.tolist())
+        self.out.fillBranch(self.muonvarname, muon_scores.tolist())
 
         return True
+
+    def process_chunk(self, chunk):
+        ### columnar counterpart of analyze (see processing/columnarprocessor.py)
+        # note: all leptons in the chunk are scored with a single predict call
+        #       per lepton flavour, so the chunk size acts as the batch size.
+        (electrons, electroncounts) = flatcolumns(chunk, 'Electron', self.electronvariables)
+        (muons, muoncounts) = flatcolumns(chunk, 'Muon', self.muonvariables)
+        electron_scores = self.getElectronMvaScores(electrons)
+        muon_scores = self.getMuonMvaScores(muons)
+        return {self.electronvarname: unflatten(electron_scores, electroncounts, np.float32),
+                self.muonvarname: unflatten(muon_scores, muoncounts, np.float32)}
@@ -8,11 +8,15 @@ ROOT.PyConfig.IgnoreCommandLineOptions = True
 import sys
 import os
 import json
+import numpy as np
 
 # import nanoAODTools
 from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection,Object
 from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
 
+# import local tools
+from PhysicsTools.nanoSkimming.tools.chunktools import chunklength
+
 
 class TriggerVariablesModule(Module):
 
@@ -33,16 +37,25 @@ class TriggerVariablesModule(Module):
         print('Initialized a TriggerVariablesModule with following parameters:')
         print('  - year: {}'.format(year))
         print('  - triggers: {}'.format(self.triggers))
+        # declare the branches read and written by this module
+        # (see processing/pipelineplanner.py);
+        # the input branches include all optional trigger paths,
+        # since the available ones are only known per input file.
+        self.inputbranches = []
+        for hlts in self.triggerdefs.values():
+            for hlt in hlts:
+                for path in ([hlt] if isinstance(hlt, str) else hlt):
+                    if 'HLT_'+path not in self.inputbranches: self.inputbranches.append('HLT_'+path)
+        self.outputbranches = ['HLT_{}'.format(trigger) for trigger in self.triggers]
 
-    def beginFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
-        self.out = wrappedOutputTree
-        # find available branches in input file
-        branchnames = [str(b.GetName()) for b in inputTree.GetListOfBranches()]
-        # loop over composite triggers
+    def resolveTriggers(self, branchnames):
+        ### internal helper function to find the available trigger paths
+        # for each composite trigger, given the branch names of the input file
+        self.availabletriggers = {}
         for trigger, hlts in self.triggerdefs.items():
             # the elements in hlts are either a string (a single, required trigger path)
             # or a list (of optional trigger paths)
-            required_hlts = [hlt for hlt in hlts if (isinstance(hlt,str) or isinstance(hlt, unicode))]
+            required_hlts = [hlt for hlt in hlts if isinstance(hlt, str)]
             optional_hlts = [hlt for hlt in hlts if isinstance(hlt, list)]
             available_hlts = required_hlts[:] # will be appended with available optional triggers
 
@@ -62,9 +75,33 @@ class TriggerVariablesModule(Module):
                         msg += ' but this trigger was marked as optional, so will continue without.'
                         print(msg)
             # set available triggers
-            self.triggerdefs[trigger] = available_hlts
-            # make output branch
-            self.out.branch('HLT_{}'.format(trigger), "O")
+            self.availabletriggers[trigger] = available_hlts
+
+        # compile the trigger definitions into a deduplicated list of input branches
+        # and an index table per composite trigger,
+        # so that paths shared between composite triggers are read only once per event.
+        self.hltbranches = []
+        self.triggerindices = {}
+        for trigger, hlts in self.availabletriggers.items():
+            indices = []
+            for hlt in hlts:
+                branchname = 'HLT_{}'.format(hlt)
+                if branchname not in self.hltbranches: self.hltbranches.append(branchname)
+                indices.append(self.hltbranches.index(branchname))
+            self.triggerindices[trigger] = indices
+        self.outputnames = {trigger: 'HLT_{}'.format(trigger) for trigger in self.availabletriggers}
+
+    def beginFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
+        self.out = wrappedOutputTree
+        # find available branches in input file
+        branchnames = [str(b.GetName()) for b in inputTree.GetListOfBranches()]
+        self.resolveTriggers(branchnames)
+        # make readers for the input branches
+        self.hltreaders = [inputTree.valueReader(b) for b in self.hltbranches]
+        self._ttreereaderversion = inputTree._ttreereaderversion
+        # make output branches
+        for trigger in self.availabletriggers.keys():
+            self.out.branch(self.outputnames[trigger], "O")
 
     def endFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
         pass
@@ -73,10 +110,35 @@ class TriggerVariablesModule(Module):
         ### process a single event
         # (always return True as this module performs no selection)
 
+        # refresh the readers if needed
+        if event._tree._ttreereaderversion > self._ttreereaderversion:
+            self.hltreaders = [event._tree.valueReader(b) for b in self.hltbranches]
+            self._ttreereaderversion = event._tree._ttreereaderversion
+
+        # read each input trigger bit once
+        hltbits = [reader.Get()[0] for reader in self.hltreaders]
+
         # loop over triggers
-        for trigger, hlts in self.triggerdefs.items():
-            hltbits = [getattr(event,'HLT_{}'.format(hlt)) for hlt in hlts]
-            triggerbit = any(hltbits)
-            self.out.fillBranch('HLT_{}'.format(trigger), triggerbit)
+        for trigger, indices in self.triggerindices.items():
+            triggerbit = any([hltbits[idx] for idx in indices])
+            self.out.fillBranch(self.outputnames[trigger], triggerbit)
 
         return True
+
+    def begin_chunks(self, branchnames):
+        ### columnar counterpart of beginFile (see processing/columnarprocessor.py)
+        self.resolveTriggers(branchnames)
+
+    def process_chunk(self, chunk):
+        ### columnar counterpart of analyze (see processing/columnarprocessor.py)
+        # (all composite triggers are computed as bitwise ORs over the columns
+        #  of a single boolean matrix holding each input trigger path once)
+        nevents = chunklength(chunk)
+        hltbits = np.zeros((nevents, len(self.hltbranches)), dtype=bool)
+        for idx, branchname in enumerate(self.hltbranches):
+            hltbits[:,idx] = np.asarray(chunk[branchname], dtype=bool)
+        newbranches = {}
+        for trigger, indices in self.triggerindices.items():
+            triggerbit = np.logical_or.reduce(hltbits[:,indices], axis=1)
+            newbranches[self.outputnames[trigger]] = triggerbit
+        return newbranches
@@ -13,6 +13,9 @@ import json
 from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection,Object
 from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
 
+# import local tools
+from PhysicsTools.nanoSkimming.tools.lumitools import LumiMask
+
 
 class JsonSkimmer(Module):
 
@@ -36,6 +39,12 @@ class JsonSkimmer(Module):
                 raise Exception('ERROR: json file {} not found.'.format(jsonfile))
         with open(jsonfile) as f:
             self.json = json.load(f)
+        # compile the json into an interval index for fast lookup
+        self.lumimask = LumiMask(self.json)
+        # declare the branches read and written by this module
+        # (see processing/pipelineplanner.py)
+        self.inputbranches = ['run', 'luminosityBlock']
+        self.outputbranches = []
         print('Initialized an JsonSkimmer module with following parameters:')
         print('  - json file: {}'.format(jsonfile))
 
@@ -48,15 +57,9 @@ class JsonSkimmer(Module):
     def analyze(self, event):
         ### process a single event
         # return True (go to next module) or False (skip this event)
+        return self.lumimask.contains(event.run, event.luminosityBlock)
 
-        # get run and lumisection
-        run = event.run
-        runstr = str(run)
-        lumi = event.luminosityBlock
-
-        # check if they are in the json file
-        if not runstr in self.json.keys(): return False
-        lumiranges = self.json[runstr]
-        for lumirange in lumiranges:
-            if( lumirange[0]<=lumi and lumirange[1]>=lumi ): return True
-        return False
+    def mask(self, chunk):
+        ### columnar counterpart of analyze (see processing/columnarprocessor.py)
+        # returns a boolean array with one entry per event in the chunk
+        return self.lumimask.mask(chunk['run'], chunk['luminosityBlock'])
@@ -7,6 +7,8 @@ import ROOT
 ROOT.PyConfig.IgnoreCommandLineOptions = True
 import sys
 import os
+import numpy as np
+import awkward as ak
 # from pathlib import Path
 
 # import nanoAODTools
@@ -16,7 +18,11 @@ from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
 # import local tools
 # sys.path.append(str(Path(__file__).parents[1]))
 from PhysicsTools.nanoSkimming.objectselection.electronselection import electronselection
+from PhysicsTools.nanoSkimming.objectselection.electronselection import getelectronselection
 from PhysicsTools.nanoSkimming.objectselection.muonselection import muonselection
+from PhysicsTools.nanoSkimming.objectselection.muonselection import getmuonselection
+from PhysicsTools.nanoSkimming.objectselection.selectionregistry import getfields
+from PhysicsTools.nanoSkimming.tools.chunktools import getcollection, getcounts
 
 
 class MultiLightLeptonSkimmer(Module):
@@ -32,6 +38,17 @@ class MultiLightLeptonSkimmer(Module):
         #   (see objectselection/muonselection.py)
         self.electron_selection_id = electron_selection_id
         self.muon_selection_id = muon_selection_id
+        # resolve the vectorized selections once
+        # (this also checks that the selection identifiers are valid)
+        self.electron_selection = getelectronselection(self.electron_selection_id)
+        self.muon_selection = getmuonselection(self.muon_selection_id)
+        # declare the branches read and written by this module
+        # (see processing/pipelineplanner.py)
+        self.inputbranches = (['nElectron', 'nMuon']
+                              + ['Electron_'+f for f in getfields(self.electron_selection)]
+                              + ['Muon_'+f for f in getfields(self.muon_selection)]
+                              + ['Electron_charge', 'Muon_charge'])
+        self.outputbranches = []
         print('Initialized a MultiLightLeptonSkimmer module with following parameters:')
         print('  - electron selection ID: {}'.format(self.electron_selection_id))
         print('  - muon selection ID: {}'.format(self.muon_selection_id))
@@ -46,19 +63,41 @@ class MultiLightLeptonSkimmer(Module):
         ### process a single event
         # return True (go to next module) or False (skip this event)
 
-        # get electrons and muons
-        electrons = Collection(event, "Electron")
-        muons = Collection(event, "Muon")
+        # cheap pre-filter on the number of leptons
+        # (only the counter branches are read for events that fail)
+        if( event.nElectron + event.nMuon < 2 ): return False
+
+        # find the charges of the first (at most) three selected leptons
+        charges = []
+        for el in Collection(event, "Electron"):
+            if not electronselection(el, self.electron_selection_id): continue
+            charges.append(el.charge)
+            if( len(charges) > 2 ): return True
+        for mu in Collection(event, "Muon"):
+            if not muonselection(mu, self.muon_selection_id): continue
+            charges.append(mu.charge)
+            if( len(charges) > 2 ): return True
 
-        # perform object selection
-        selected_electrons = ([el for el in electrons 
-          if electronselection(el, self.electron_selection_id)])
-        selected_muons = ([mu for mu in muons 
-          if muonselection(mu, self.muon_selection_id)])
-        selected_leptons = selected_electrons + selected_muons
-        
         # perform event selection
-        if( len(selected_leptons) < 2 ): return False
-        if( len(selected_leptons) > 2 ): return True
-        if( selected_leptons[0].charge == selected_leptons[1].charge ): return True
+        if( len(charges) < 2 ): return False
+        if( charges[0] == charges[1] ): return True
         return False
+
+    def mask(self, chunk):
+        ### columnar counterpart of analyze (see processing/columnarprocessor.py)
+        # returns a boolean array with one entry per event in the chunk
+        # note: the object selections are only evaluated for candidate events
+        #       with at least two leptons.
+        mask = (getcounts(chunk, 'Electron') + getcounts(chunk, 'Muon') >= 2)
+        candidates = np.flatnonzero(mask)
+        if len(candidates)==0: return mask
+        electrons = getcollection(chunk, 'Electron')[candidates]
+        muons = getcollection(chunk, 'Muon')[candidates]
+        # charges of the selected leptons (electrons first, as in analyze)
+        charges = ak.concatenate((electrons['charge'][self.electron_selection(electrons)],
+                                  muons['charge'][self.muon_selection(muons)]), axis=1)
+        nselected = ak.to_numpy(ak.num(charges))
+        firsttwo = ak.pad_none(charges, 2, axis=1, clip=True)
+        samesign = ak.to_numpy(ak.fill_none(firsttwo[:, 0] == firsttwo[:, 1], False))
+        mask[candidates] = (nselected > 2) | ((nselected == 2) & samesign)
+        return mask
@@ -7,6 +7,8 @@ import ROOT
 ROOT.PyConfig.IgnoreCommandLineOptions = True
 import sys
 import os
+import numpy as np
+import awkward as ak
 
 # import nanoAODTools
 from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection,Object
@@ -14,7 +16,11 @@ from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
 
 # import local tools
 from PhysicsTools.nanoSkimming.objectselection.electronselection import electronselection
+from PhysicsTools.nanoSkimming.objectselection.electronselection import getelectronselection
 from PhysicsTools.nanoSkimming.objectselection.muonselection import muonselection
+from PhysicsTools.nanoSkimming.objectselection.muonselection import getmuonselection
+from PhysicsTools.nanoSkimming.objectselection.selectionregistry import getfields
+from PhysicsTools.nanoSkimming.tools.chunktools import getcollection, getcounts
 import PhysicsTools.nanoSkimming.tools.printtools as printtools
 
 
@@ -33,6 +39,16 @@ class nLightLeptonSkimmer(Module):
         self.n = n
         self.electron_selection_id = electron_selection_id
         self.muon_selection_id = muon_selection_id
+        # resolve the vectorized selections once
+        # (this also checks that the selection identifiers are valid)
+        self.electron_selection = getelectronselection(self.electron_selection_id)
+        self.muon_selection = getmuonselection(self.muon_selection_id)
+        # declare the branches read and written by this module
+        # (see processing/pipelineplanner.py)
+        self.inputbranches = (['nElectron', 'nMuon']
+                              + ['Electron_'+f for f in getfields(self.electron_selection)]
+                              + ['Muon_'+f for f in getfields(self.muon_selection)])
+        self.outputbranches = []
         print('Initialized an nLightLeptonSkimmer module with following parameters:')
         print('  - number of leptons threshold: {}'.format(self.n))
         print('  - electron selection ID: {}'.format(self.electron_selection_id))
@@ -48,16 +64,35 @@ class nLightLeptonSkimmer(Module):
         ### process a single event
         # return True (go to next module) or False (skip this event)
 
-        # get electrons and muons
-        electrons = Collection(event, "Electron")
-        muons = Collection(event, "Muon")
-
-        # perform object selection
-        selected_electrons = ([el for el in electrons 
-          if electronselection(el, self.electron_selection_id)])
-        selected_muons = ([mu for mu in muons 
-          if muonselection(mu, self.muon_selection_id)])
-        
-        # perform event selection
-        if( len(selected_electrons) + len(selected_muons) < self.n ): return False
-        return True
+        # cheap pre-filter on the number of leptons
+        # (only the counter branches are read for events that fail)
+        if( event.nElectron + event.nMuon < self.n ): return False
+        if( self.n <= 0 ): return True
+
+        # count selected leptons, stopping as soon as the threshold is reached
+        nselected = 0
+        for el in Collection(event, "Electron"):
+            if not electronselection(el, self.electron_selection_id): continue
+            nselected += 1
+            if( nselected >= self.n ): return True
+        for mu in Collection(event, "Muon"):
+            if not muonselection(mu, self.muon_selection_id): continue
+            nselected += 1
+            if( nselected >= self.n ): return True
+        return False
+
+    def mask(self, chunk):
+        ### columnar counterpart of analyze (see processing/columnarprocessor.py)
+        # returns a boolean array with one entry per event in the chunk
+        # note: the object selections are only evaluated for candidate events
+        #       that pass a pre-filter on the number of leptons.
+        mask = (getcounts(chunk, 'Electron') + getcounts(chunk, 'Muon') >= self.n)
+        if( self.n <= 0 ): return mask
+        candidates = np.flatnonzero(mask)
+        if len(candidates)==0: return mask
+        electrons = getcollection(chunk, 'Electron')[candidates]
+        muons = getcollection(chunk, 'Muon')[candidates]
+        nselected = (ak.sum(self.electron_selection(electrons), axis=1)
+                     + ak.sum(self.muon_selection(muons), axis=1))
+        mask[candidates] = (ak.to_numpy(nselected) >= self.n)
+        return mask
@@ -0,0 +1,87 @@
+###################################################################
+# Tools for handling chunks of events in columnar (array) format #
+###################################################################
+# A chunk is a dict matching nanoAOD branch names (e.g. 'Electron_pt', 'nElectron', 'run')
+# to arrays with one entry per event (flat numpy/awkward arrays for scalar branches,
+# jagged awkward arrays for collection branches).
+# This is the format used by the ColumnarProcessor (see processing/columnarprocessor.py)
+# and by the process_chunk and mask methods of the modules.
+
+# imports
+import math
+import numpy as np
+import awkward as ak
+
+
+def getcollection(chunk, name, fields=None):
+    ### get a collection (e.g. 'Electron') from a chunk as an awkward record array
+    # input arguments:
+    # - chunk: dict of branch names to arrays
+    # - name: name of the collection
+    # - fields: list of field names to include (default: all available fields)
+    # returns:
+    # a jagged awkward record array, e.g. with fields pt, eta, ...
+    prefix = name + '_'
+    if fields is None:
+        fields = [key[len(prefix):] for key in chunk.keys() if key.startswith(prefix)]
+    return ak.zip({field: chunk[prefix+field] for field in fields}, depth_limit=2)
+
+
+def flatcolumns(chunk, name, fields):
+    ### get flat numpy arrays for the given fields of a collection
+    # returns:
+    # a tuple of a dict matching field names to flat arrays,
+    # and the number of objects per event (for unflattening)
+    prefix = name + '_'
+    columns = {field: ak.to_numpy(ak.flatten(chunk[prefix+field])) for field in fields}
+    counts = ak.to_numpy(ak.num(chunk[prefix+fields[0]]))
+    return (columns, counts)
+
+
+def getcounts(chunk, name):
+    ### get the number of objects per event in a collection as a numpy array
+    # (from the counter branch, e.g. 'nElectron', if available,
+    #  so that none of the collection branches need to be touched)
+    if 'n'+name in chunk: return ak.to_numpy(chunk['n'+name]).astype(np.int64)
+    prefix = name + '_'
+    for key, val in chunk.items():
+        if key.startswith(prefix): return ak.to_numpy(ak.num(val)).astype(np.int64)
+    raise Exception('ERROR: collection {} not found in chunk.'.format(name))
+
+
+def unflatten(values, counts, dtype):
+    ### convert flat values back into a jagged array with a given dtype
+    return ak.unflatten(np.asarray(values).astype(dtype), counts)
+
+
+def maskchunk(chunk, mask):
+    ### select events in a chunk using a boolean mask
+    return {key: val[mask] for key, val in chunk.items()}
+
+
+def chunklength(chunk):
+    ### get the number of events in a chunk
+    for val in chunk.values(): return len(val)
+    return 0
+
+
+class ChunkObject(object):
+    ### lightweight stand-in for a nanoAODTools Object, built from a chunk
+    # (only meant for running per-object functions on columnar input)
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+    def DeltaR(self, other):
+        ### same definition as nanoAODTools Object.DeltaR
+        deta = abs(other.eta - self.eta)
+        dphi = abs(other.phi - self.phi)
+        while dphi > math.pi:
+            dphi = abs(dphi - 2 * math.pi)
+        return math.sqrt(dphi**2 + deta**2)
+
+
+def getobjects(chunk, name, fields=None):
+    ### get a collection as a list (per event) of lists of ChunkObjects
+    collection = getcollection(chunk, name, fields=fields)
+    return [[ChunkObject(**obj) for obj in event] for event in ak.to_list(collection)]
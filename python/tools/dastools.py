@@ -0,0 +1,151 @@
+####################################################
+# Tools for (parallel and cached) DAS client queries #
+####################################################
+# Queries are run with dasgoclient in a pool of threads
+# (the work is done by the DAS server and the client subprocesses,
+#  so threads are sufficient to run many of them concurrently).
+# The lumisections of each file are cached on disk, keyed by LFN,
+# since the content of a file with a given LFN never changes.
+# The query command can be replaced (e.g. by a local stub script for testing)
+# via the command argument of the DASClient.
+
+# imports
+import sys
+import os
+import json
+import shlex
+import hashlib
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+def parsenumbers(lines):
+    ### parse the numbers in the output lines of a DAS query
+    # (lines can contain a single number or a list such as [1, 2, 3])
+    numbers = []
+    for line in lines:
+        for el in line.strip(' \t[]').split(','):
+            el = el.strip(' \t[]')
+            if len(el)>0: numbers.append(int(el))
+    return numbers
+
+
+def formatfilelumis(runs, lumis, lfn=''):
+    ### bring the runs and lumisections of a single file into json format
+    # note: exactly one run per file is expected.
+    # returns:
+    # a dict of the form {run: [[lumi, lumi], ...]} with sorted, unique lumisections
+    if len(runs)!=1:
+        msg = 'ERROR: found {} runs ({}) in file {}, which is unexpected.'.format(len(runs), runs, lfn)
+        raise Exception(msg)
+    run = int(runs[0])
+    return {run: [[lumi, lumi] for lumi in sorted(set(lumis))]}
+
+
+class DASClient(object):
+    ### client for DAS queries with a thread pool and an on-disk cache
+
+    def __init__(self, command='dasgoclient', cachedir=None, jobs=8, timeout=None):
+        ### initializer
+        # input arguments:
+        # - command: DAS client command, as a string or list
+        #   (e.g. 'python3 dasstub.py' to use a local stub script)
+        # - cachedir: directory for the cache of file lumisections
+        #   (default: no cache)
+        # - jobs: maximum number of concurrent queries
+        # - timeout: timeout per query in seconds (default: no timeout)
+        if isinstance(command, str): command = shlex.split(command)
+        self.command = list(command)
+        self.cachedir = cachedir
+        self.jobs = max(1, jobs)
+        self.timeout = timeout
+        if self.cachedir is not None and not os.path.exists(self.cachedir):
+            os.makedirs(self.cachedir)
+
+    def query(self, query):
+        ### run a single DAS query
+        # returns:
+        # a list of (non-empty) output lines
+        cmd = self.command + ['-query', query, '--limit', '0']
+        res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             universal_newlines=True, timeout=self.timeout)
+        if res.returncode!=0:
+            msg = 'ERROR: DAS query "{}" failed with exit code {}:\n{}'.format(
+                    query, res.returncode, res.stderr.strip())
+            raise Exception(msg)
+        return [line.strip(' \t') for line in res.stdout.split('\n') if len(line.strip(' \t'))>0]
+
+    def cachepath(self, lfn):
+        ### get the path of the cache file for an LFN
+        return os.path.join(self.cachedir, hashlib.sha1(lfn.encode()).hexdigest() + '.json')
+
+    def readcache(self, lfn):
+        ### read the lumisections of a file from the cache
+        # returns None if the file is not in the cache
+        if self.cachedir is None: return None
+        path = self.cachepath(lfn)
+        if not os.path.exists(path): return None
+        try:
+            with open(path) as f: entry = json.load(f)
+        except ValueError: return None
+        # (check the LFN to protect against hash collisions)
+        if entry.get('lfn')!=lfn: return None
+        return {int(run): lumis for run, lumis in entry['lumis'].items()}
+
+    def writecache(self, lfn, runsls):
+        ### write the lumisections of a file to the cache
+        if self.cachedir is None: return
+        path = self.cachepath(lfn)
+        # (write to a temporary file first, so that concurrent readers never see partial files)
+        tmppath = '{}.tmp{}.{}'.format(path, os.getpid(), threading.get_ident())
+        with open(tmppath, 'w') as f: json.dump({'lfn': lfn, 'lumis': runsls}, f)
+        os.replace(tmppath, path)
+
+    def getfilelumis(self, lfn):
+        ### get the lumisections of a single file
+        # returns:
+        # a dict of the form {run: [[lumi, lumi], ...]} (see formatfilelumis)
+        runsls = self.readcache(lfn)
+        if runsls is not None: return runsls
+        lumis = parsenumbers(self.query('lumi file={}'.format(lfn)))
+        runs = sorted(self.query('run file={}'.format(lfn)))
+        runsls = formatfilelumis(runs, lumis, lfn=lfn)
+        self.writecache(lfn, runsls)
+        return runsls
+
+    def getfileslumis(self, lfns):
+        ### get the lumisections of multiple files, running the queries concurrently
+        # returns:
+        # a dict of LFN to lumisections in the format of getfilelumis
+        lfns = list(lfns)
+        if( self.jobs==1 or len(lfns)<2 ):
+            return {lfn: self.getfilelumis(lfn) for lfn in lfns}
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            return dict(zip(lfns, executor.map(self.getfilelumis, lfns)))
+
+    def getdatasetlumis(self, dataset):
+        ### get the lumisections of all files in a dataset
+        # the lumisections of all files are retrieved with a single batched query;
+        # if that fails, the files are queried one by one (concurrently).
+        # returns:
+        # a dict of LFN to lumisections in the format of getfilelumis
+        try: lines = self.query('file,run,lumi dataset={}'.format(dataset))
+        except Exception as e:
+            print('WARNING: batched query for dataset {} failed ({}),'.format(dataset, e)
+                  + ' falling back to per-file queries.')
+            lfns = self.query('file dataset={}'.format(dataset))
+            return self.getfileslumis(lfns)
+        # each output line contains the LFN, the run and a list of lumisections
+        runs = {}
+        lumis = {}
+        for line in lines:
+            (lfn, run, lumilist) = line.split(None, 2)
+            runs.setdefault(lfn, [])
+            if run not in runs[lfn]: runs[lfn].append(run)
+            lumis.setdefault(lfn, []).extend(parsenumbers([lumilist]))
+        res = {}
+        for lfn in runs.keys():
+            res[lfn] = formatfilelumis(sorted(runs[lfn]), lumis[lfn], lfn=lfn)
+            self.writecache(lfn, res[lfn])
+        return res
@@ -0,0 +1,252 @@
+###########################################################
+# Index of (run, luminosityBlock, event) keys for merging #
+###########################################################
+# Each event is identified by a 128-bit key, split in two 64-bit parts:
+# - hi: (run << 32) | luminosityBlock (see lumitools.packrunlumi)
+# - lo: event
+# The EventIndex stores these keys in a small number of sorted arrays ("levels"),
+# ordered by a 64-bit hash of the full key.
+# New keys are added as a new level, and levels of similar size are merged,
+# so that adding n keys in chunks costs O(n log n) in total
+# (instead of re-sorting or re-scanning the full index for every chunk),
+# and a lookup only needs one binary search per level.
+# Hash collisions are resolved by comparing the full keys,
+# so membership tests are exact.
+# The keys of a ROOT file can also be stored in a small sidecar file
+# next to it (see writesidecar and geteventkeys), so that later merges,
+# lumisection accounting and overlap checks do not need to read the trees again.
+
+# imports
+import sys
+import os
+import numpy as np
+
+# import local tools
+from PhysicsTools.nanoSkimming.tools.lumitools import packrunlumi
+
+
+# suffix of the sidecar files
+# (e.g. the sidecar of skimmed.root is skimmed.evtidx.npz)
+SIDECAR_SUFFIX = '.evtidx.npz'
+SIDECAR_VERSION = 1
+
+
+def packeventkeys(runs, lumis, events):
+    ### pack run, lumisection and event numbers into a 128-bit key
+    # returns:
+    # a tuple of two uint64 arrays (hi, lo)
+    hi = packrunlumi(runs, lumis)
+    lo = np.asarray(events).astype(np.uint64)
+    return (hi, lo)
+
+
+def hashkeys(hi, lo):
+    ### compute a 64-bit hash of 128-bit keys
+    # (a multiplicative combination followed by the splitmix64 finalizer;
+    #  uint64 arithmetic wraps around, which is intended here)
+    with np.errstate(over='ignore'):
+        h = (np.asarray(hi, dtype=np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+             ^ np.asarray(lo, dtype=np.uint64))
+        h ^= (h >> np.uint64(30))
+        h *= np.uint64(0xBF58476D1CE4E5B9)
+        h ^= (h >> np.uint64(27))
+        h *= np.uint64(0x94D049BB133111EB)
+        h ^= (h >> np.uint64(31))
+    return h
+
+
+def firstoccurrence(hi, lo):
+    ### find the first occurrence of each key in an array of packed keys
+    # returns:
+    # a boolean numpy array that is True for the first occurrence of each key
+    # and False for all later repetitions of the same key
+    hi = np.asarray(hi, dtype=np.uint64)
+    lo = np.asarray(lo, dtype=np.uint64)
+    first = np.ones(len(hi), dtype=bool)
+    if len(hi)<2: return first
+    # (lexsort is stable, so equal keys stay in their original order)
+    order = np.lexsort((lo, hi))
+    repeated = (hi[order][1:]==hi[order][:-1]) & (lo[order][1:]==lo[order][:-1])
+    first[order[1:][repeated]] = False
+    return first
+
+
+class EventIndex(object):
+    ### set-like index of 128-bit event keys
+
+    def __init__(self, mergefactor=2):
+        ### initializer
+        # input arguments:
+        # - mergefactor: the last two levels are merged as long as the size of the last level
+        #   is at least 1/mergefactor of the size of the level before,
+        #   so the number of levels stays logarithmic in the number of keys.
+        self.mergefactor = mergefactor
+        self.levels = []
+
+    def __len__(self):
+        return sum([len(level[0]) for level in self.levels])
+
+    @property
+    def nbytes(self):
+        ### memory used by the index (in bytes)
+        return sum([sum([arr.nbytes for arr in level]) for level in self.levels])
+
+    def add(self, runs, lumis, events):
+        ### add events to the index
+        (hi, lo) = packeventkeys(runs, lumis, events)
+        self.addkeys(hi, lo)
+
+    def addkeys(self, hi, lo):
+        ### add packed keys to the index (see packeventkeys)
+        if len(hi)==0: return
+        hashes = hashkeys(hi, lo)
+        order = np.argsort(hashes, kind='stable')
+        self.levels.append((hashes[order], np.asarray(hi, dtype=np.uint64)[order],
+                            np.asarray(lo, dtype=np.uint64)[order]))
+        while( len(self.levels)>1
+               and self.mergefactor*len(self.levels[-1][0]) >= len(self.levels[-2][0]) ):
+            last = self.levels.pop()
+            previous = self.levels.pop()
+            self.levels.append(self.mergelevels(previous, last))
+
+    def mergelevels(self, level1, level2):
+        ### internal helper function to merge two sorted levels
+        # (the stable sort detects the two sorted runs, so this is linear in practice)
+        hashes = np.concatenate((level1[0], level2[0]))
+        order = np.argsort(hashes, kind='stable')
+        return tuple([hashes[order]] + [np.concatenate((a1, a2))[order]
+                                        for (a1, a2) in zip(level1[1:], level2[1:])])
+
+    def contains(self, runs, lumis, events):
+        ### check which events are in the index
+        # returns:
+        # a boolean numpy array with one entry per event
+        (hi, lo) = packeventkeys(runs, lumis, events)
+        return self.containskeys(hi, lo)
+
+    def containskeys(self, hi, lo):
+        ### check which packed keys are in the index (see packeventkeys)
+        hi = np.asarray(hi, dtype=np.uint64)
+        lo = np.asarray(lo, dtype=np.uint64)
+        found = np.zeros(len(hi), dtype=bool)
+        if len(hi)==0: return found
+        hashes = hashkeys(hi, lo)
+        for (levelhashes, levelhi, levello) in self.levels:
+            pos = np.searchsorted(levelhashes, hashes, side='left')
+            inrange = (pos < len(levelhashes))
+            pos[~inrange] = 0
+            samehash = inrange & (levelhashes[pos]==hashes)
+            samekey = samehash & (levelhi[pos]==hi) & (levello[pos]==lo)
+            found |= samekey
+            # resolve hash collisions by scanning all entries with the same hash
+            for i in np.flatnonzero(samehash & ~samekey & ~found):
+                p = pos[i] + 1
+                while( p < len(levelhashes) and levelhashes[p]==hashes[i] ):
+                    if( levelhi[p]==hi[i] and levello[p]==lo[i] ):
+                        found[i] = True
+                        break
+                    p += 1
+        return found
+
+
+
+def sidecarpath(rootfile):
+    ### get the path of the sidecar file for a ROOT file
+    return os.path.splitext(rootfile)[0] + SIDECAR_SUFFIX
+
+
+def fileidentity(rootfile):
+    ### get the size and modification time (in ns) of a file,
+    # used to detect whether a sidecar is still valid
+    stat = os.stat(rootfile)
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def readeventkeys(rootfile, treename='Events', step_size=1000000):
+    ### read the event keys of a ROOT file from its tree
+    # returns:
+    # a dict with the following entries:
+    # - hi, lo: packed keys of all entries, in entry order (see packeventkeys)
+    # - runlumis: sorted array of the distinct packed (run, luminosityBlock) keys
+    # - nentries: number of entries in the tree
+    import uproot
+    hi = [np.zeros(0, dtype=np.uint64)]
+    lo = [np.zeros(0, dtype=np.uint64)]
+    with uproot.open(rootfile) as f:
+        tree = f[treename]
+        nentries = tree.num_entries
+        for arrays in tree.iterate(['run', 'luminosityBlock', 'event'],
+                                   step_size=step_size, library='np'):
+            (chunkhi, chunklo) = packeventkeys(arrays['run'], arrays['luminosityBlock'], arrays['event'])
+            hi.append(chunkhi)
+            lo.append(chunklo)
+    hi = np.concatenate(hi)
+    lo = np.concatenate(lo)
+    return {'hi': hi, 'lo': lo, 'runlumis': np.unique(hi), 'nentries': nentries}
+
+
+def writesidecar(rootfile, treename='Events', keys=None, step_size=1000000):
+    ### write a sidecar file with the event keys of a ROOT file
+    # input arguments:
+    # - rootfile: path to the ROOT file
+    # - treename: name of the tree
+    # - keys: event keys in the format of readeventkeys
+    #   (default: read them from the tree)
+    # returns:
+    # the path to the sidecar file
+    # note: the sidecar stores the size and modification time of the ROOT file,
+    #       and is considered invalid as soon as either of them changes
+    #       (so when copying the ROOT file together with its sidecar,
+    #       the modification time must be preserved, e.g. with cp -p).
+    if keys is None: keys = readeventkeys(rootfile, treename=treename, step_size=step_size)
+    (size, mtime) = fileidentity(rootfile)
+    path = sidecarpath(rootfile)
+    # (write to a temporary file first, so that a sidecar is never partially written)
+    tmppath = path + '.tmp.npz'
+    np.savez_compressed(tmppath,
+      hi=keys['hi'], lo=keys['lo'], runlumis=keys['runlumis'],
+      nentries=np.int64(keys['nentries']),
+      filesize=np.int64(size), mtime=np.int64(mtime),
+      treename=np.array(treename), version=np.int64(SIDECAR_VERSION))
+    os.replace(tmppath, path)
+    return path
+
+
+def readsidecar(rootfile, treename='Events'):
+    ### read the sidecar file of a ROOT file
+    # returns:
+    # the event keys in the format of readeventkeys,
+    # or None if there is no valid sidecar for this ROOT file and tree
+    path = sidecarpath(rootfile)
+    if not os.path.exists(path): return None
+    try:
+        with np.load(path) as sidecar:
+            if( int(sidecar['version'])!=SIDECAR_VERSION
+                or str(sidecar['treename'])!=treename
+                or (int(sidecar['filesize']), int(sidecar['mtime']))!=fileidentity(rootfile) ):
+                return None
+            return {'hi': sidecar['hi'], 'lo': sidecar['lo'], 'runlumis': sidecar['runlumis'],
+                    'nentries': int(sidecar['nentries'])}
+    except Exception:
+        # (treat corrupt or incompatible sidecars as missing)
+        return None
+
+
+def geteventkeys(rootfile, treename='Events', usesidecar=True, updatesidecar=False, step_size=1000000):
+    ### get the event keys of a ROOT file, from its sidecar if possible
+    # input arguments:
+    # - rootfile: path to the ROOT file
+    # - treename: name of the tree
+    # - usesidecar: use a valid sidecar if it exists
+    # - updatesidecar: (re)write the sidecar if it is missing or invalid
+    # returns:
+    # the event keys in the format of readeventkeys
+    if usesidecar:
+        keys = readsidecar(rootfile, treename=treename)
+        if keys is not None: return keys
+    keys = readeventkeys(rootfile, treename=treename, step_size=step_size)
+    if updatesidecar:
+        try: writesidecar(rootfile, treename=treename, keys=keys)
+        except OSError as e:
+            print('WARNING: could not write sidecar for {}: {}'.format(rootfile, e))
+    return keys
@@ -6,110 +6,163 @@
 import sys
 import os
 import json
+import glob
 import numpy as np
 import awkward as ak
 import uproot
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 
+# import local tools
+from PhysicsTools.nanoSkimming.tools.lumitools import packrunlumi
+from PhysicsTools.nanoSkimming.tools.lumitools import LumiRanges
+from PhysicsTools.nanoSkimming.tools.eventindex import readsidecar
+from PhysicsTools.nanoSkimming.tools.dastools import DASClient
 
-def get_lumis_uproot(rootfile):
+
+def get_lumis_sidecar(rootfile):
+  ### get lumisections in a local file from its sidecar file (see tools/eventindex.py)
+  # returns None if the file has no valid sidecar
+  keys = readsidecar(rootfile)
+  if keys is None: return None
+  return LumiRanges.fromkeys(keys['runlumis'])
+
+def get_lumis_uproot(rootfile, step_size=1000000):
   ### get lumisections in a local file using uproot
-  rkey = 'run'
-  lkey = 'luminosityBlock'
-  # open file and read branches
-  with uproot.open(inputfile) as f:
-    events = f['Events']
-    nevents = events.num_entries
-    eventids = events.arrays([rkey, lkey], library='np')
-    runs = eventids[rkey]
-    lumis = eventids[lkey]
-  # remove duplicates and bring in correct format
-  runsls = {}
-  for i in range(nevents):
-    run = int(runs[i])
-    lumi = int(lumis[i])
-    if run not in runsls.keys():
-      runsls[run] = [[lumi, lumi]]
-    elif lumi != runsls[run][-1][-1]:
-      runsls[run].append([lumi, lumi])
-  return runsls
-
-def get_lumis_das(dasfile):
+  # the run and luminosityBlock branches are read in chunks,
+  # and only the distinct packed (run, lumisection) keys of each chunk are kept.
+  keys = [np.zeros(0, dtype=np.uint64)]
+  with uproot.open(rootfile) as f:
+    for arrays in f['Events'].iterate(['run', 'luminosityBlock'],
+                                      step_size=step_size, library='np'):
+      keys.append(np.unique(packrunlumi(arrays['run'], arrays['luminosityBlock'])))
+  return LumiRanges.fromkeys(np.concatenate(keys))
+
+def get_lumis_local(rootfile, usesidecar=True):
+  ### get lumisections in a local file, from its sidecar if possible
+  lumis = None
+  if usesidecar: lumis = get_lumis_sidecar(rootfile)
+  if lumis is None: lumis = get_lumis_uproot(rootfile)
+  return lumis
+
+def get_lumis_das(dasfile, client=None):
   ### get lumisections in a remote file using DAS client
-  dascmd = "dasgoclient -query 'lumi file={}' --limit 0".format(dasfile)
-  dasstdout = os.popen(dascmd).read()
-  lumis = sorted([el.strip(' \t') for el in dasstdout.strip('\n').split('\n')])
-  dascmd = "dasgoclient -query 'run file={}' --limit 0".format(dasfile)
-  dasstdout = os.popen(dascmd).read()
-  runs = sorted([el.strip(' \t') for el in dasstdout.strip('\n').split('\n')])
-  if len(runs)!=1:
-    msg = 'ERROR: found {} runs ({}), which is unexpected.'.format(len(runs), runs)
-    raise Exception(msg)
-  run = int(runs[0])
-  lumis = sorted([int(el) for el in set(lumis)])
-  runsls = {run: []}
-  for lumi in lumis: runsls[run].append([lumi,lumi])
-  return runsls
-
-def combine_lumis(runsls, mode='union'):
-  ### combine sets of json formatted lumisections
-  if mode=='union': raise Exception('Not yet implemented')
+  # (see tools/dastools.py for the options of the client)
+  if client is None: client = DASClient()
+  return client.getfilelumis(dasfile)
+
+def combine_lumis(lumis, mode='union'):
+  ### combine a list of sets of lumisections (see tools/lumitools.LumiRanges)
+  # modes:
+  # - union: lumisections in any of the sets
+  # - intersection: lumisections in all of the sets
+  # - difference: lumisections in the first set but in none of the others
+  if len(lumis)==0: return LumiRanges()
+  if mode=='union':
+    # (a single normalization of all intervals is faster than pairwise unions)
+    return LumiRanges(np.concatenate([l.starts for l in lumis]),
+                      np.concatenate([l.stops for l in lumis]))
   elif mode=='intersection':
-    totrunsls = {}
-    firstrunsls = runsls[0]
-    for run in sorted(firstrunsls.keys()):
-      keeprun = True
-      for otherrunsls in runsls[1:]:
-        if run not in otherrunsls.keys(): keeprun = False
-      if not keeprun: continue
-      for lumi in sorted(firstrunsls[run]):
-        keeplumi = True
-        for otherrunsls in runsls[1:]:
-          if lumi not in otherrunsls[run]: keeplumi = False
-        if not keeplumi: continue
-        if run in totrunsls.keys(): totrunsls[run].append(lumi)
-        else: totrunsls[run] = [lumi]
-    return totrunsls
+    res = lumis[0]
+    for other in lumis[1:]: res = res.intersection(other)
+    return res
+  elif mode=='difference':
+    return lumis[0].difference(combine_lumis(lumis[1:], mode='union'))
   else: raise Exception('ERROR: mode {} not recognized.'.format(mode))
 
+def expand_inputs(inputs):
+  ### expand directories and glob patterns into lists of files
+  # (directories are searched recursively for .root files;
+  #  other inputs that do not exist locally are assumed to be DAS file names)
+  inputfiles = []
+  for inputname in inputs:
+    if os.path.isdir(inputname):
+      dirfiles = []
+      for root, dirs, files in os.walk(inputname):
+        dirfiles += [os.path.join(root, f) for f in files if f.endswith('.root')]
+      inputfiles += sorted(dirfiles)
+    elif glob.has_magic(inputname):
+      matches = sorted(glob.glob(inputname))
+      if len(matches)==0: print('WARNING: pattern {} does not match any file.'.format(inputname))
+      inputfiles += matches
+    else: inputfiles.append(inputname)
+  return inputfiles
+
 
 if __name__=='__main__':
 
   # input arguments
   parser = argparse.ArgumentParser(description='Get lumis in json format')
-  parser.add_argument('-i', '--inputfiles', required=True, nargs='+')
+  parser.add_argument('-i', '--inputfiles', default=[], nargs='+',
+                      help='Input files, directories or glob patterns'
+                          +' (files that do not exist locally are looked up in DAS)')
   parser.add_argument('-o', '--outputfile', default=None)
-  parser.add_argument('-m', '--mode', default='union', choices=['union','intersection'])
+  parser.add_argument('-m', '--mode', default='union', choices=['union','intersection','difference'],
+                      help='How to combine the lumisections of multiple input files'
+                          +' (difference: lumisections in the first file but not in any of the others)')
+  parser.add_argument('-j', '--jobs', default=None, type=int,
+                      help='Number of parallel processes for local files (default: number of cores)')
+  parser.add_argument('-d', '--datasets', default=[], nargs='+',
+                      help='DAS dataset names (each dataset is treated as a single input,'
+                          +' retrieved with a single batched query where possible)')
+  parser.add_argument('--dascommand', default='dasgoclient',
+                      help='DAS client command (e.g. a local stub script for testing)')
+  parser.add_argument('--dascache', default=os.path.expanduser('~/.cache/nanoskimming/das'),
+                      help='Directory for the on-disk cache of DAS results (use "none" to disable)')
+  parser.add_argument('--dasjobs', default=8, type=int,
+                      help='Maximum number of concurrent DAS queries')
+  parser.add_argument('--nosidecar', default=False, action='store_true',
+                      help='Always read the trees, even if a valid sidecar file exists')
   args = parser.parse_args()
+  if len(args.inputfiles)+len(args.datasets)==0:
+    raise Exception('ERROR: no input files or datasets were specified.')
+  if args.dascache.lower()=='none': args.dascache = None
 
   # print arguments
   print('Running with following configuration:')
   for arg in vars(args):
     print('  - {}: {}'.format(arg,getattr(args,arg)))
 
-  # loop over input files
-  runsls = []
-  for inputfile in args.inputfiles:
-    # find lumisections
-    if os.path.exists(inputfile):
-      thisrunsls = get_lumis_uproot(inputfile)
-    else: thisrunsls = get_lumis_das(inputfile)
-    runsls.append(thisrunsls)
+  # find input files
+  inputfiles = expand_inputs(args.inputfiles)
+  print('Found {} input files.'.format(len(inputfiles)))
+  localfiles = [f for f in inputfiles if os.path.exists(f)]
+
+  # find lumisections in local files (in parallel)
+  locallumis = {}
+  jobs = args.jobs if args.jobs is not None else (os.cpu_count() or 1)
+  usesidecar = [not args.nosidecar]*len(localfiles)
+  if( jobs>1 and len(localfiles)>1 ):
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+      chunksize = max(1, len(localfiles)//(4*jobs))
+      results = executor.map(get_lumis_local, localfiles, usesidecar, chunksize=chunksize)
+      locallumis = dict(zip(localfiles, results))
+  else:
+    locallumis = dict(zip(localfiles, map(get_lumis_local, localfiles, usesidecar)))
+
+  # find lumisections in remote files (with concurrent queries)
+  client = DASClient(command=args.dascommand, cachedir=args.dascache, jobs=args.dasjobs)
+  remotefiles = [f for f in inputfiles if f not in locallumis]
+  remotelumis = client.getfileslumis(remotefiles)
+  lumis = []
+  for inputfile in inputfiles:
+    if inputfile in locallumis: lumis.append(locallumis[inputfile])
+    else: lumis.append(LumiRanges.fromjson(remotelumis[inputfile]))
 
-  # process into a single list of lumisections
-  if len(runsls)>1: runsls = combine_lumis(runsls, mode=args.mode)
-  else: runsls = runsls[0]
+  # find lumisections in datasets
+  for dataset in args.datasets:
+    datasetlumis = client.getdatasetlumis(dataset)
+    print('Found {} files in dataset {}.'.format(len(datasetlumis), dataset))
+    lumis.append(combine_lumis([LumiRanges.fromjson(l) for l in datasetlumis.values()], mode='union'))
 
-  # determine number of lumisections
-  nls = 0
-  for key, val in runsls.items():
-    nls += len(val)
+  # process into a single set of lumisections
+  lumis = combine_lumis(lumis, mode=args.mode)
 
   # printouts for testing
-  print('Number of runs: {}'.format(len(runsls.keys())))
-  print('Number of lumisections: {}'.format(nls))
+  print('Number of runs: {}'.format(len(lumis.runs)))
+  print('Number of lumisections: {}'.format(len(lumis)))
 
   # convert to json
   if args.outputfile is not None:
     with open(args.outputfile, 'w') as f:
-      json.dump(runsls, f)
+      json.dump(lumis.tojson(), f)
@@ -0,0 +1,186 @@
+###########################################################
+# Compare processed lumisections with a golden json file #
+###########################################################
+# The run and luminosityBlock branches of all output files of a skim are read
+# in parallel (or taken from their sidecar files, see tools/eventindex.py),
+# and the resulting set of processed lumisections is compared with the certified ones.
+# The output consists of json files in the same format as the CRAB processedLumis.json:
+# - missing: certified lumisections that are not in any output file
+# - extra: processed lumisections that are not certified
+# - duplicate: lumisections that appear in more than one output file
+# - processed: all processed lumisections
+# Optionally, a csv file from brilcalc (brilcalc lumi --byls -o <file>)
+# can be given to convert the numbers of lumisections into recorded luminosity.
+
+# imports
+import sys
+import os
+import json
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+# import local tools
+from PhysicsTools.nanoSkimming.tools.lumitools import LumiRanges
+from PhysicsTools.nanoSkimming.tools.lumitools import packrunlumi
+from PhysicsTools.nanoSkimming.tools.lumitools import unpackrunlumi
+from PhysicsTools.nanoSkimming.tools.getjson import get_lumis_local
+from PhysicsTools.nanoSkimming.tools.getjson import expand_inputs
+from PhysicsTools.nanoSkimming.tools.getjson import combine_lumis
+
+
+def findgoldenjson(year):
+    ### find the golden json file for a given year
+    # (all 2016 eras share the same file)
+    if year.startswith('2016'): year = '2016'
+    basename = 'lumijson_{}.json'.format(year)
+    jsonfile = os.path.join(os.path.dirname(__file__), '../../data/lumijsons', basename)
+    if not os.path.exists(jsonfile):
+        # for CRAB submission, the data directory is copied to the working directory
+        jsonfile = os.path.join('data/lumijsons', basename)
+    if not os.path.exists(jsonfile):
+        raise Exception('ERROR: json file {} not found.'.format(jsonfile))
+    return jsonfile
+
+
+def readbrilcalc(csvfile):
+    ### read recorded luminosity per lumisection from a brilcalc csv file
+    # (as produced by brilcalc lumi --byls -o <file>; lines starting with # are ignored)
+    # returns:
+    # a tuple of a sorted array of packed (run, lumisection) keys
+    # and an array of the corresponding recorded luminosities (in /ub)
+    runs = []
+    lumis = []
+    recorded = []
+    with open(csvfile) as f:
+        for line in f:
+            if( line.startswith('#') or len(line.strip())==0 ): continue
+            fields = line.strip().split(',')
+            runs.append(int(fields[0].split(':')[0]))
+            lumis.append(int(fields[1].split(':')[0]))
+            recorded.append(float(fields[6]))
+    keys = packrunlumi(runs, lumis)
+    order = np.argsort(keys, kind='stable')
+    return (keys[order], np.array(recorded)[order])
+
+
+def recordedlumi(lumiset, brilcalc):
+    ### sum the recorded luminosity (in /ub) of a set of lumisections
+    # (lumisections that are not in the brilcalc output are counted as zero)
+    (keys, recorded) = brilcalc
+    return float(np.sum(recorded[lumiset.contains(keys)]))
+
+
+def findduplicates(filelumis):
+    ### find lumisections that appear in more than one file
+    # input arguments:
+    # - filelumis: dict of file names to LumiRanges
+    # returns:
+    # a tuple of a LumiRanges with the duplicate lumisections,
+    # and a dict of file names to the LumiRanges of their duplicate lumisections
+    if len(filelumis)==0: return (LumiRanges(), {})
+    allkeys = np.concatenate([lumis.tokeys() for lumis in filelumis.values()])
+    (keys, counts) = np.unique(allkeys, return_counts=True)
+    duplicates = LumiRanges.fromkeys(keys[counts>1])
+    perfile = {}
+    if len(duplicates)==0: return (duplicates, perfile)
+    for filename, lumis in filelumis.items():
+        fileduplicates = lumis.intersection(duplicates)
+        if len(fileduplicates)>0: perfile[filename] = fileduplicates
+    return (duplicates, perfile)
+
+
+def writelumijson(lumiset, outputfile):
+    ### write a set of lumisections to a json file in CRAB processedLumis.json format
+    with open(outputfile, 'w') as f:
+        json.dump(lumiset.tojson(), f)
+
+
+if __name__=='__main__':
+
+    # input arguments
+    parser = argparse.ArgumentParser(description='Compare processed lumisections with a golden json')
+    parser.add_argument('-i', '--inputfiles', required=True, nargs='+',
+                        help='Output files of the skim (files, directories or glob patterns)')
+    parser.add_argument('-y', '--year', default=None,
+                        help='Data taking year, used to find the golden json in data/lumijsons')
+    parser.add_argument('-g', '--golden', default=None,
+                        help='Path to a golden json (alternative to --year)')
+    parser.add_argument('-o', '--outputdir', default='.',
+                        help='Directory where to write the missing/extra/duplicate/processed json files')
+    parser.add_argument('-r', '--runrange', default=None, type=int, nargs=2, metavar=('FIRST', 'LAST'),
+                        help='Only consider runs in this range (e.g. a single era)')
+    parser.add_argument('-b', '--brilcalc', default=None,
+                        help='Csv file from brilcalc lumi --byls, to report recorded luminosity')
+    parser.add_argument('-j', '--jobs', default=None, type=int,
+                        help='Number of parallel processes (default: number of cores)')
+    parser.add_argument('--nosidecar', default=False, action='store_true',
+                        help='Always read the trees, even if a valid sidecar file exists')
+    args = parser.parse_args()
+    if( (args.year is None)==(args.golden is None) ):
+        raise Exception('ERROR: you must specify either --year or --golden (but not both).')
+
+    # print arguments
+    print('Running with following configuration:')
+    for arg in vars(args):
+        print('  - {}: {}'.format(arg,getattr(args,arg)))
+
+    # read golden json
+    golden = args.golden if args.golden is not None else findgoldenjson(args.year)
+    certified = LumiRanges.fromjson(golden)
+
+    # find input files
+    inputfiles = expand_inputs(args.inputfiles)
+    missingfiles = [f for f in inputfiles if not os.path.exists(f)]
+    if len(missingfiles)>0:
+        raise Exception('ERROR: input files {} do not exist.'.format(missingfiles))
+    print('Found {} input files.'.format(len(inputfiles)))
+
+    # find processed lumisections in each file (in parallel)
+    jobs = args.jobs if args.jobs is not None else (os.cpu_count() or 1)
+    usesidecar = [not args.nosidecar]*len(inputfiles)
+    if( jobs>1 and len(inputfiles)>1 ):
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            chunksize = max(1, len(inputfiles)//(4*jobs))
+            results = list(executor.map(get_lumis_local, inputfiles, usesidecar, chunksize=chunksize))
+    else: results = list(map(get_lumis_local, inputfiles, usesidecar))
+    filelumis = dict(zip(inputfiles, results))
+
+    # restrict to run range
+    if args.runrange is not None:
+        runrange = LumiRanges(packrunlumi([args.runrange[0]], [0]),
+                              packrunlumi([args.runrange[1]+1], [0]))
+        certified = certified.intersection(runrange)
+        filelumis = {f: lumis.intersection(runrange) for f, lumis in filelumis.items()}
+
+    # make the comparison
+    processed = combine_lumis(list(filelumis.values()), mode='union')
+    missing = certified.difference(processed)
+    extra = processed.difference(certified)
+    (duplicates, fileduplicates) = findduplicates(filelumis)
+
+    # write output
+    if not os.path.exists(args.outputdir): os.makedirs(args.outputdir)
+    for name, lumiset in [('missing', missing), ('extra', extra),
+                          ('duplicate', duplicates), ('processed', processed)]:
+        writelumijson(lumiset, os.path.join(args.outputdir, '{}Lumis.json'.format(name)))
+
+    # print report
+    brilcalc = readbrilcalc(args.brilcalc) if args.brilcalc is not None else None
+    print('Lumisection accounting:')
+    for name, lumiset in [('certified', certified), ('processed', processed),
+                          ('processed and certified', processed.intersection(certified)),
+                          ('missing', missing), ('extra', extra), ('duplicate', duplicates)]:
+        msg = '  - {}: {} lumisections in {} runs'.format(name, len(lumiset), len(lumiset.runs))
+        if brilcalc is not None: msg += ' ({:.3f} /pb recorded)'.format(recordedlumi(lumiset, brilcalc)/1e6)
+        print(msg)
+    if len(certified)>0:
+        fraction = len(processed.intersection(certified))/float(len(certified))
+        print('Fraction of certified lumisections that were processed: {:.4f}'.format(fraction))
+    if len(fileduplicates)>0:
+        print('WARNING: found lumisections in more than one output file:')
+        for filename, lumiset in sorted(fileduplicates.items()):
+            (runs, lumis) = unpackrunlumi(lumiset.starts[:1])
+            print('  - {}: {} duplicate lumisections (first: run {}, lumisection {})'.format(
+                  filename, len(lumiset), runs[0], lumis[0]))
+    print('Output json files written to {}.'.format(args.outputdir))
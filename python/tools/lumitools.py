@@ -0,0 +1,264 @@
+##########################################################
+# Tools for run and lumisection selection and accounting #
+##########################################################
+
+# imports
+import sys
+import os
+import json
+import bisect
+import numpy as np
+
+
+def packrunlumi(runs, lumis):
+    ### pack run and lumisection numbers into a single 64-bit key
+    # (run in the upper 32 bits, lumisection in the lower 32 bits,
+    #  so that sorting the keys sorts by run first and lumisection second)
+    runs = np.asarray(runs).astype(np.uint64)
+    lumis = np.asarray(lumis).astype(np.uint64)
+    return (runs << np.uint64(32)) | lumis
+
+
+def unpackrunlumi(keys):
+    ### inverse operation of packrunlumi
+    keys = np.asarray(keys, dtype=np.uint64)
+    runs = (keys >> np.uint64(32)).astype(np.int64)
+    lumis = (keys & np.uint64(0xFFFFFFFF)).astype(np.int64)
+    return (runs, lumis)
+
+
+def loadlumijson(lumijson):
+    ### load a json file with run/lumisection selection
+    # input arguments:
+    # - lumijson: path to a json file, or an already loaded dict
+    #   (in the usual golden json format, i.e. {"run": [[first, last], ...], ...})
+    if isinstance(lumijson, dict): return lumijson
+    with open(lumijson) as f:
+        return json.load(f)
+
+
+class LumiMask(object):
+    ### compiled version of a golden json for fast lookup
+    # the json is converted into a flat array of lumisection ranges,
+    # sorted by run and first lumisection, so that membership can be checked
+    # with a binary search instead of a linear scan over all ranges of a run.
+
+    def __init__(self, lumijson):
+        ### intializer
+        # input arguments:
+        # - lumijson: path to a json file or an already loaded dict
+        lumijson = loadlumijson(lumijson)
+        ranges = []
+        for run, lumiranges in lumijson.items():
+            for lumirange in lumiranges:
+                ranges.append((int(run), int(lumirange[0]), int(lumirange[1])))
+        ranges = sorted(ranges)
+        # merge overlapping or adjacent ranges within the same run
+        merged = []
+        for (run, first, last) in ranges:
+            if( len(merged)>0 and merged[-1][0]==run and first <= merged[-1][2]+1 ):
+                merged[-1][2] = max(merged[-1][2], last)
+            else: merged.append([run, first, last])
+        self.runs = np.array([r[0] for r in merged], dtype=np.int64)
+        self.firsts = np.array([r[1] for r in merged], dtype=np.int64)
+        self.lasts = np.array([r[2] for r in merged], dtype=np.int64)
+        self.firstkeys = packrunlumi(self.runs, self.firsts)
+        self.lastkeys = packrunlumi(self.runs, self.lasts)
+        # python lists for scalar lookup (faster than numpy for single values)
+        self.firstkeylist = [int(key) for key in self.firstkeys]
+        self.lastkeylist = [int(key) for key in self.lastkeys]
+        # cache of the last decision
+        # (events usually arrive clustered by lumisection)
+        self.lastrunlumi = None
+        self.lastdecision = False
+
+    def __len__(self):
+        return len(self.runs)
+
+    def contains(self, run, lumi):
+        ### check if a single run and lumisection are selected
+        if (run, lumi) == self.lastrunlumi: return self.lastdecision
+        key = (int(run) << 32) | int(lumi)
+        idx = bisect.bisect_right(self.firstkeylist, key) - 1
+        decision = ( idx >= 0 and key <= self.lastkeylist[idx] )
+        self.lastrunlumi = (run, lumi)
+        self.lastdecision = decision
+        return decision
+
+    def mask(self, runs, lumis):
+        ### check an array of runs and lumisections at once
+        # returns:
+        # a boolean numpy array of the same length as runs and lumis
+        keys = packrunlumi(runs, lumis)
+        if len(self.lastkeys)==0: return np.zeros(len(keys), dtype=bool)
+        idx = np.searchsorted(self.firstkeys, keys, side='right') - 1
+        valid = (idx >= 0)
+        idx[~valid] = 0
+        return valid & (keys <= self.lastkeys[idx])
+
+
+def getentryranges(tree, lumijson, step_size=1000000, maxgap=0):
+    ### get the ranges of entries in a tree that pass a run/lumisection selection
+    # only the run and luminosityBlock branches are read,
+    # so this is cheap compared to reading the full events.
+    # input arguments:
+    # - tree: uproot tree, or path to a file with a tree named 'Events'
+    # - lumijson: path to a json file, a loaded dict, or a LumiMask
+    # - step_size: number of entries to read at once
+    # - maxgap: merge ranges separated by at most this number of entries
+    #   (useful to avoid many small reads; note that the merged ranges
+    #   then also contain some entries that do not pass the selection)
+    # returns:
+    # a tuple of a list of (start, stop) ranges, and the total number of entries in the tree
+    import uproot
+    if isinstance(tree, str):
+        with uproot.open(tree) as f:
+            return getentryranges(f['Events'], lumijson, step_size=step_size, maxgap=maxgap)
+    lumimask = lumijson if isinstance(lumijson, LumiMask) else LumiMask(lumijson)
+    ranges = []
+    offset = 0
+    for arrays in tree.iterate(['run', 'luminosityBlock'], step_size=step_size, library='np'):
+        mask = lumimask.mask(arrays['run'], arrays['luminosityBlock'])
+        # find the start and stop indices of consecutive selected entries
+        edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+        starts = np.nonzero(edges==1)[0] + offset
+        stops = np.nonzero(edges==-1)[0] + offset
+        for start, stop in zip(starts, stops):
+            start = int(start)
+            stop = int(stop)
+            if( len(ranges)>0 and start - ranges[-1][1] <= maxgap ):
+                ranges[-1] = (ranges[-1][0], stop)
+            else: ranges.append((start, stop))
+        offset += len(mask)
+    return (ranges, tree.num_entries)
+
+
+def getentryspan(tree, lumijson):
+    ### get the first entry and the last entry (+1) that pass a run/lumisection selection
+    # returns:
+    # a (start, stop) tuple, or None if no entry passes the selection
+    (ranges, _) = getentryranges(tree, lumijson)
+    if len(ranges)==0: return None
+    return (ranges[0][0], ranges[-1][1])
+
+
+class LumiRanges(object):
+    ### set of lumisections in compressed-range representation
+    # the set is stored as sorted, disjoint, half-open intervals [start, stop)
+    # of packed (run, lumisection) keys (see packrunlumi),
+    # so that set operations reduce to a few vectorized numpy operations
+    # on the interval boundaries, independent of the number of lumisections.
+
+    def __init__(self, starts=None, stops=None):
+        ### initializer
+        # input arguments:
+        # - starts, stops: arrays of packed keys of the interval boundaries
+        #   (stops are exclusive); the intervals may overlap or be unsorted.
+        if starts is None: starts = np.zeros(0, dtype=np.uint64)
+        if stops is None: stops = np.zeros(0, dtype=np.uint64)
+        starts = np.asarray(starts, dtype=np.uint64)
+        stops = np.asarray(stops, dtype=np.uint64)
+        keep = (stops > starts)
+        (self.starts, self.stops) = self.normalize(starts[keep], stops[keep])
+
+    @staticmethod
+    def normalize(starts, stops):
+        ### internal helper function to sort and merge overlapping or adjacent intervals
+        if len(starts)==0: return (starts, stops)
+        order = np.argsort(starts, kind='stable')
+        starts = starts[order]
+        stops = np.maximum.accumulate(stops[order])
+        # a new interval begins wherever the start lies beyond all previous stops
+        newinterval = np.concatenate(([True], starts[1:] > stops[:-1]))
+        lastinterval = np.concatenate((newinterval[1:], [True]))
+        return (starts[newinterval], stops[lastinterval])
+
+    @classmethod
+    def fromkeys(cls, keys):
+        ### make a set from an array of packed (run, lumisection) keys
+        keys = np.unique(np.asarray(keys, dtype=np.uint64))
+        return cls(keys, keys + np.uint64(1))
+
+    @classmethod
+    def fromjson(cls, lumijson):
+        ### make a set from a json file or dict in golden json format
+        lumijson = loadlumijson(lumijson)
+        runs = []
+        firsts = []
+        lasts = []
+        for run, lumiranges in lumijson.items():
+            for lumirange in lumiranges:
+                runs.append(int(run))
+                firsts.append(int(lumirange[0]))
+                lasts.append(int(lumirange[1]))
+        return cls(packrunlumi(runs, firsts), packrunlumi(runs, lasts) + np.uint64(1))
+
+    def tojson(self):
+        ### convert to a dict in golden json format
+        # (runs as strings, as in the golden json files)
+        (runs, firsts) = unpackrunlumi(self.starts)
+        (_, lasts) = unpackrunlumi(self.stops - np.uint64(1))
+        lumijson = {}
+        for run, first, last in zip(runs.tolist(), firsts.tolist(), lasts.tolist()):
+            lumijson.setdefault(str(run), []).append([first, last])
+        return lumijson
+
+    def tokeys(self):
+        ### expand to a sorted array of packed (run, lumisection) keys
+        lengths = (self.stops - self.starts).astype(np.int64)
+        positions = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return np.repeat(self.starts, lengths) + positions.astype(np.uint64)
+
+    def __len__(self):
+        ### number of lumisections in the set
+        return int(np.sum(self.stops - self.starts))
+
+    @property
+    def runs(self):
+        ### sorted array of the runs in the set
+        return np.unique(unpackrunlumi(self.starts)[0])
+
+    @property
+    def nranges(self):
+        ### number of intervals in the set
+        return len(self.starts)
+
+    def contains(self, keys):
+        ### check which packed (run, lumisection) keys are in the set
+        keys = np.asarray(keys, dtype=np.uint64)
+        if len(self.starts)==0: return np.zeros(len(keys), dtype=bool)
+        idx = np.searchsorted(self.starts, keys, side='right') - 1
+        valid = (idx >= 0)
+        idx[~valid] = 0
+        return valid & (keys < self.stops[idx])
+
+    def combine(self, other, operation):
+        ### internal helper function for set operations
+        # the union of all boundaries splits both sets into elementary segments,
+        # each of which is either fully inside or fully outside each of the two sets.
+        bounds = np.unique(np.concatenate((self.starts, self.stops, other.starts, other.stops)))
+        if len(bounds)<2: return LumiRanges()
+        segstarts = bounds[:-1]
+        segstops = bounds[1:]
+        keep = operation(self.contains(segstarts), other.contains(segstarts))
+        return LumiRanges(segstarts[keep], segstops[keep])
+
+    def union(self, other):
+        return self.combine(other, np.logical_or)
+
+    def intersection(self, other):
+        return self.combine(other, np.logical_and)
+
+    def difference(self, other):
+        return self.combine(other, lambda a, b: a & ~b)
+
+    def __eq__(self, other):
+        return( np.array_equal(self.starts, other.starts)
+                and np.array_equal(self.stops, other.stops) )
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __or__(self, other): return self.union(other)
+    def __and__(self, other): return self.intersection(other)
+    def __sub__(self, other): return self.difference(other)
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+
+###########################################################
+# Benchmark the skimming modules on synthetic NanoAOD files #
+###########################################################
+# Writes synthetic NanoAOD-like files (see makesyntheticnano.py),
+# runs each module in python/processing and python/skimselection on them
+# (modules that need branches produced by other modules are run after those),
+# as well as the full chain of modules and the haddnanodata merge of data-like files,
+# and prints the throughput (input events per second), the peak memory
+# and the output size for each benchmark.
+# Each benchmark is run in a separate process, so that the peak memory is measured per benchmark.
+# The modules are run with the ColumnarProcessor by default (no ROOT needed),
+# or with the NanoAODTools PostProcessor (--postprocessor).
+# With --outputjson, the results are written to a json file,
+# so that they can be compared between runs.
+# Usage: python benchmodules.py [-e <nevents>] [-b <benchmark names>] [--outputjson <file>]
+
+# imports
+import os, sys
+import json
+import time
+import socket
+import argparse
+import platform
+import concurrent.futures
+import multiprocessing
+from pathlib import Path
+import uproot
+
+# import local tools
+sys.path.append(str(Path(__file__).parents[2]))
+from merging.haddnanodata import haddnanodata, peak_memory
+from makesyntheticnano import makesyntheticfiles
+
+
+def getmodules(name, year):
+    ### get the list of modules for a benchmark
+    # (imports are done here, so that they are only done in the benchmark process)
+    from PhysicsTools.nanoSkimming.skimselection.multilightleptonskimmer import MultiLightLeptonSkimmer
+    from PhysicsTools.nanoSkimming.skimselection.nlightleptonskimmer import nLightLeptonSkimmer
+    from PhysicsTools.nanoSkimming.skimselection.jsonskimmer import JsonSkimmer
+    from PhysicsTools.nanoSkimming.processing.psweightsum import PSWeightSumModule
+    from PhysicsTools.nanoSkimming.processing.leptonvariables import LeptonVariablesModule
+    from PhysicsTools.nanoSkimming.processing.topleptonmva import TopLeptonMvaModule
+    from PhysicsTools.nanoSkimming.processing.leptongenvariables import LeptonGenVariablesModule
+    from PhysicsTools.nanoSkimming.processing.triggervariables import TriggerVariablesModule
+    from PhysicsTools.nanoSkimming.processing.pipelineplanner import PipelinePlanner
+    year_simple = '2016' if year.startswith('2016') else year
+    if name=='MultiLightLeptonSkimmer':
+        return [MultiLightLeptonSkimmer('run2ul_loose', 'run2ul_loose')]
+    if name=='nLightLeptonSkimmer':
+        return [nLightLeptonSkimmer(2, 'run2ul_loose', 'run2ul_loose')]
+    if name=='JsonSkimmer': return [JsonSkimmer(year=year)]
+    if name=='PSWeightSumModule': return [PSWeightSumModule()]
+    if name=='LeptonVariablesModule': return [LeptonVariablesModule()]
+    if name=='TopLeptonMvaModule':
+        # (needs the branches added by the LeptonVariablesModule)
+        return [LeptonVariablesModule(), TopLeptonMvaModule(year, 'ULv1')]
+    if name=='LeptonGenVariablesModule': return [LeptonGenVariablesModule()]
+    if name=='TriggerVariablesModule': return [TriggerVariablesModule(year_simple)]
+    if name=='chain':
+        # (same modules as in condor/condorrun.py for simulation, without the JetMET
+        #  and muon corrections, which have no columnar counterpart)
+        modules = [PSWeightSumModule(),
+                   MultiLightLeptonSkimmer('run2ul_loose', 'run2ul_loose'),
+                   LeptonVariablesModule(),
+                   TopLeptonMvaModule(year, 'ULv1'),
+                   TriggerVariablesModule(year_simple),
+                   LeptonGenVariablesModule()]
+        return PipelinePlanner(modules).planned
+    raise Exception('ERROR: benchmark {} not recognized.'.format(name))
+
+
+# benchmark names and the type of input files they run on
+benchmarks = {
+    'MultiLightLeptonSkimmer': 'sim',
+    'nLightLeptonSkimmer': 'sim',
+    'JsonSkimmer': 'data',
+    'PSWeightSumModule': 'sim',
+    'LeptonVariablesModule': 'sim',
+    'TopLeptonMvaModule': 'sim',
+    'LeptonGenVariablesModule': 'sim',
+    'TriggerVariablesModule': 'sim',
+    'chain': 'sim',
+    'haddnanodata': 'data',
+}
+
+
+def run_modules(name, inputfile, outputdir, year, postprocessor=False):
+    ### run the modules of a benchmark on a single file (meant to be called in a fresh process)
+    # returns:
+    # a dict with the results
+    modules = getmodules(name, year)
+    postfix = '_{}'.format(name)
+    start = time.time()
+    if postprocessor:
+        from PhysicsTools.NanoAODTools.postprocessing.framework.postprocessor import PostProcessor
+        p = PostProcessor(outputdir, [inputfile], modules=modules, postfix=postfix)
+        p.run()
+    else:
+        from PhysicsTools.nanoSkimming.processing.columnarprocessor import ColumnarProcessor
+        p = ColumnarProcessor(outputdir, [inputfile], modules=modules, postfix=postfix, verbose=False)
+        p.run()
+    duration = time.time() - start
+    outputfile = os.path.join(outputdir, os.path.basename(inputfile).replace('.root', postfix+'.root'))
+    with uproot.open(inputfile) as f: ninput = f['Events'].num_entries
+    with uproot.open(outputfile) as f: noutput = f['Events'].num_entries
+    return {'time': duration, 'ninput': ninput, 'noutput': noutput,
+            'peakmemory': peak_memory(), 'outputsize': os.path.getsize(outputfile)}
+
+
+def run_merge(inputfiles, outputdir, step_size=100000):
+    ### run the haddnanodata merge of data-like files (meant to be called in a fresh process)
+    # returns:
+    # a dict with the results
+    outputfile = os.path.join(outputdir, 'merged.root')
+    start = time.time()
+    (noutput, _) = haddnanodata(outputfile, inputfiles, force=True, step_size=step_size)
+    duration = time.time() - start
+    ninput = 0
+    for inputfile in inputfiles:
+        with uproot.open(inputfile) as f: ninput += f['Events'].num_entries
+    return {'time': duration, 'ninput': ninput, 'noutput': noutput,
+            'peakmemory': peak_memory(), 'outputsize': os.path.getsize(outputfile)}
+
+
+if __name__=='__main__':
+
+    # input arguments
+    parser = argparse.ArgumentParser(description='Benchmark the skimming modules')
+    parser.add_argument('-e', '--nevents', type=int, default=100000,
+                        help='Number of events per synthetic file')
+    parser.add_argument('-n', '--nfiles', type=int, default=3,
+                        help='Number of data-like files for the haddnanodata merge')
+    parser.add_argument('-b', '--benchmarks', default=list(benchmarks.keys()), nargs='+',
+                        choices=list(benchmarks.keys()))
+    parser.add_argument('-y', '--year', default='2018')
+    parser.add_argument('-r', '--repeat', type=int, default=1,
+                        help='Number of times to run each benchmark (the fastest run is reported)')
+    parser.add_argument('-o', '--outputdir', default='synthetic_benchmark')
+    parser.add_argument('--postprocessor', default=False, action='store_true',
+                        help='Run the modules with the NanoAODTools PostProcessor'
+                             +' instead of the ColumnarProcessor')
+    parser.add_argument('--outputjson', default=None,
+                        help='Json file to write the results to')
+    args = parser.parse_args()
+
+    # print arguments
+    print('Running with following configuration:')
+    for arg in vars(args):
+        print('  - {}: {}'.format(arg,getattr(args,arg)))
+
+    # make the synthetic input files
+    inputdir = os.path.join(args.outputdir, 'input')
+    simfiles = makesyntheticfiles(inputdir, 1, args.nevents, year=args.year)
+    datafiles = makesyntheticfiles(inputdir, args.nfiles, args.nevents, data=True, year=args.year)
+
+    # run the benchmarks, each in a separate process to measure the peak memory
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    for name in args.benchmarks:
+        runs = []
+        for i in range(args.repeat):
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                if name=='haddnanodata':
+                    future = executor.submit(run_merge, datafiles, args.outputdir)
+                else:
+                    inputfile = simfiles[0] if benchmarks[name]=='sim' else datafiles[0]
+                    future = executor.submit(run_modules, name, inputfile, args.outputdir,
+                                             args.year, postprocessor=args.postprocessor)
+                runs.append(future.result())
+        result = min(runs, key=lambda run: run['time'])
+        result['eventspersecond'] = result['ninput']/result['time'] if result['time']>0 else 0.
+        results[name] = result
+
+    # print the results
+    print('Results:')
+    for name, result in results.items():
+        msg = '  - {}: {:.0f} events/s ({} -> {} events in {:.2f} s)'.format(
+                name, result['eventspersecond'], result['ninput'], result['noutput'], result['time'])
+        if result['peakmemory'] is not None: msg += ', peak memory {:.0f} MB'.format(result['peakmemory']/1e6)
+        msg += ', output size {:.1f} MB'.format(result['outputsize']/1e6)
+        print(msg)
+
+    # write the results
+    if args.outputjson is not None:
+        output = {'config': vars(args),
+                  'host': socket.gethostname(),
+                  'python': platform.python_version(),
+                  'time': time.time(),
+                  'results': results}
+        with open(args.outputjson, 'w') as f: json.dump(output, f, indent=2)
+        print('Results written to {}.'.format(args.outputjson))
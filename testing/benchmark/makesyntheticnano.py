@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+
+################################################
+# Generator for synthetic NanoAOD-like files #
+################################################
+# Writes Events trees with uproot that contain (a subset of) the NanoAOD branches
+# read by the modules in python/processing and python/skimselection:
+# Electron, Muon, Jet, MET, GenPart, PSWeight, genWeight, the HLT paths
+# in data/triggerdefs/triggerdefs.json, and run/luminosityBlock/event,
+# with the NanoAOD branch types and configurable mean multiplicities (Poisson distributed).
+# For data-like files (--data), the simulation branches are left out,
+# the run and luminosityBlock values are taken (mostly) from the certified lumisections
+# in the golden json of the given year, the events are sorted as in real data,
+# and each file shares a fraction of its events with the files before it
+# (as for events recorded in several primary datasets).
+# Usage: python makesyntheticnano.py -o <outputdir> [-n <nfiles>] [-e <nevents>] [--data]
+
+# imports
+import os, sys
+import json
+import argparse
+from pathlib import Path
+import numpy as np
+import awkward as ak
+import uproot
+
+
+# default mean multiplicities per event
+default_multiplicities = {
+    'Electron': 1.2,
+    'Muon': 1.2,
+    'Jet': 5.,
+    'GenPart': 40.,
+}
+
+
+def hltpaths():
+    ### get the names of all HLT paths used in data/triggerdefs/triggerdefs.json
+    triggerdefs = os.path.join(Path(__file__).parents[2], 'data/triggerdefs/triggerdefs.json')
+    with open(triggerdefs) as f: defs = json.load(f)
+    paths = set()
+    for year in defs.values():
+        for triggers in year.values():
+            for trigger in triggers:
+                # (entries are either path names or lists of optional path names)
+                if isinstance(trigger, str): paths.add(trigger)
+                else: paths.update(trigger)
+    return sorted(['HLT_'+path for path in paths])
+
+
+def datakeys(nevents, year, rng, uncertified=0.1):
+    ### draw run, luminosityBlock and event numbers for data-like files
+    # (a fraction uncertified of the lumisections is drawn outside the certified ranges)
+    # returns:
+    # an array of shape (nevents, 3) with run, luminosityBlock and event numbers
+    if year.startswith('2016'): year = '2016'
+    jsonfile = os.path.join(Path(__file__).parents[2], 'data/lumijsons/lumijson_{}.json'.format(year))
+    with open(jsonfile) as f: golden = json.load(f)
+    runs = []
+    lumis = []
+    for run, ranges in golden.items():
+        for (first, last) in ranges:
+            runs.append(np.full(last-first+1, int(run)))
+            lumis.append(np.arange(first, last+1))
+    runs = np.concatenate(runs)
+    lumis = np.concatenate(lumis)
+    idx = rng.integers(0, len(runs), size=nevents)
+    keys = np.zeros((nevents, 3), dtype=np.int64)
+    keys[:,0] = runs[idx]
+    keys[:,1] = lumis[idx]
+    shift = rng.random(nevents) < uncertified
+    keys[shift,1] += 10000
+    keys[:,2] = rng.integers(1, 2**34, size=nevents)
+    return keys
+
+
+def jagged(counts, values):
+    ### make a jagged array from flat values and counts
+    return ak.unflatten(values, counts)
+
+
+def localindex(counts):
+    ### index of each object within its event, as a flat array
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    return np.arange(np.sum(counts)) - starts
+
+
+def pointers(counts, targetcounts, rng, fraction):
+    ### random indices into another collection (-1 for a fraction 1-fraction of the objects)
+    ntarget = np.repeat(targetcounts, counts)
+    idx = np.floor(rng.random(len(ntarget)) * ntarget).astype(np.int32)
+    valid = ( rng.random(len(ntarget)) < fraction ) & ( ntarget > 0 )
+    return np.where(valid, idx, -1).astype(np.int32)
+
+
+def leptonfields(n, rng, pdgid, njets, ngen, counts):
+    ### fields common to electrons and muons
+    return {
+        'pt': (rng.exponential(20., n) + 5.).astype(np.float32),
+        'eta': rng.uniform(-2.5, 2.5, n).astype(np.float32),
+        'phi': rng.uniform(-np.pi, np.pi, n).astype(np.float32),
+        'mass': np.zeros(n, dtype=np.float32),
+        'charge': rng.choice([-1, 1], n).astype(np.int32),
+        'pdgId': (rng.choice([-1, 1], n) * pdgid).astype(np.int32),
+        'dxy': rng.normal(0., 0.02, n).astype(np.float32),
+        'dz': rng.normal(0., 0.05, n).astype(np.float32),
+        'sip3d': rng.exponential(3., n).astype(np.float32),
+        'miniPFRelIso_all': rng.exponential(0.2, n).astype(np.float32),
+        'miniPFRelIso_chg': rng.exponential(0.1, n).astype(np.float32),
+        'pfRelIso03_all': rng.exponential(0.2, n).astype(np.float32),
+        'jetRelIso': rng.exponential(0.3, n).astype(np.float32),
+        'jetPtRelv2': rng.exponential(5., n).astype(np.float32),
+        'jetNDauCharged': rng.integers(0, 10, n).astype(np.uint8),
+        'jetIdx': pointers(counts, njets, rng, 0.8),
+        'genPartIdx': pointers(counts, ngen, rng, 0.7),
+    }
+
+
+def makeevents(nevents, multiplicities=None, data=False, keys=None, seed=1):
+    ### generate the branches of a synthetic Events tree
+    # input arguments:
+    # - nevents: number of events
+    # - multiplicities: dict of collection names to mean multiplicities (see default_multiplicities)
+    # - data: leave out the simulation branches
+    # - keys: array of shape (nevents, 3) with run, luminosityBlock and event numbers
+    #   (default: a single simulation run with sequential event numbers)
+    # - seed: random seed
+    # returns:
+    # a dict of branch names (or collection names) to arrays
+    mult = dict(default_multiplicities)
+    if multiplicities is not None: mult.update(multiplicities)
+    rng = np.random.default_rng(seed)
+    counts = {name: rng.poisson(mean, size=nevents).astype(np.int32) for name, mean in mult.items()}
+    if data: counts['GenPart'] = np.zeros(nevents, dtype=np.int32)
+    branches = {}
+    if keys is None:
+        keys = np.zeros((nevents, 3), dtype=np.int64)
+        keys[:,0] = 1
+        keys[:,1] = 1 + np.arange(nevents)//1000
+        keys[:,2] = 1 + np.arange(nevents)
+    branches['run'] = keys[:,0].astype(np.uint32)
+    branches['luminosityBlock'] = keys[:,1].astype(np.uint32)
+    branches['event'] = keys[:,2].astype(np.uint64)
+
+    # electrons
+    n = int(np.sum(counts['Electron']))
+    fields = leptonfields(n, rng, 11, counts['Jet'], counts['GenPart'], counts['Electron'])
+    fields['deltaEtaSC'] = rng.normal(0., 0.01, n).astype(np.float32)
+    fields['lostHits'] = rng.choice([0, 0, 0, 1, 2], n).astype(np.uint8)
+    fields['mvaFall17V2noIso'] = rng.uniform(-1., 1., n).astype(np.float32)
+    branches['Electron'] = ak.zip({key: jagged(counts['Electron'], val) for key, val in fields.items()})
+
+    # muons
+    n = int(np.sum(counts['Muon']))
+    fields = leptonfields(n, rng, 13, counts['Jet'], counts['GenPart'], counts['Muon'])
+    fields['isPFcand'] = rng.random(n) < 0.95
+    fields['isTracker'] = rng.random(n) < 0.9
+    fields['isGlobal'] = rng.random(n) < 0.8
+    fields['mediumId'] = rng.random(n) < 0.8
+    fields['segmentComp'] = rng.random(n).astype(np.float32)
+    branches['Muon'] = ak.zip({key: jagged(counts['Muon'], val) for key, val in fields.items()})
+
+    # jets
+    n = int(np.sum(counts['Jet']))
+    fields = {
+        'pt': (rng.exponential(40., n) + 15.).astype(np.float32),
+        'eta': rng.uniform(-4.7, 4.7, n).astype(np.float32),
+        'phi': rng.uniform(-np.pi, np.pi, n).astype(np.float32),
+        'mass': rng.exponential(8., n).astype(np.float32),
+        'btagDeepFlavB': rng.beta(0.3, 2., n).astype(np.float32),
+        'jetId': rng.choice([0, 2, 6, 6, 6], n).astype(np.int32),
+    }
+    branches['Jet'] = ak.zip({key: jagged(counts['Jet'], val) for key, val in fields.items()})
+
+    # missing transverse momentum
+    branches['MET_pt'] = rng.exponential(40., nevents).astype(np.float32)
+    branches['MET_phi'] = rng.uniform(-np.pi, np.pi, nevents).astype(np.float32)
+
+    # simulation branches
+    if not data:
+        n = int(np.sum(counts['GenPart']))
+        index = localindex(counts['GenPart'])
+        fields = {
+            'pt': rng.exponential(20., n).astype(np.float32),
+            'eta': rng.uniform(-5., 5., n).astype(np.float32),
+            'phi': rng.uniform(-np.pi, np.pi, n).astype(np.float32),
+            'mass': np.zeros(n, dtype=np.float32),
+            'pdgId': rng.choice([-11, 11, -13, 13, -15, 15, 22, 22, 22, 21, 21, 1, -1, 2, -2, 5, -5, 6, -6, 23, 24, -24],
+                                n).astype(np.int32),
+            'status': rng.choice([1, 1, 1, 2, 21, 22, 23, 44, 51, 62], n).astype(np.int32),
+            'statusFlags': rng.integers(0, 2**15, n).astype(np.int32),
+            # (mothers always come before their daughters)
+            'genPartIdxMother': (np.floor(rng.random(n) * (index + 1)) - 1).astype(np.int32),
+        }
+        branches['GenPart'] = ak.zip({key: jagged(counts['GenPart'], val) for key, val in fields.items()})
+        branches['genWeight'] = rng.normal(1., 0.1, nevents).astype(np.float32)
+        branches['PSWeight'] = jagged(np.full(nevents, 4, dtype=np.int32),
+                                      rng.uniform(0.5, 1.5, 4*nevents).astype(np.float32))
+
+    # trigger paths
+    for path in hltpaths():
+        branches[path] = rng.random(nevents) < 0.1
+    return branches
+
+
+def makesyntheticfile(path, nevents, multiplicities=None, data=False, keys=None, seed=1):
+    ### write a synthetic NanoAOD-like file (see makeevents for the arguments)
+    branches = makeevents(nevents, multiplicities=multiplicities, data=data, keys=keys, seed=seed)
+    with uproot.recreate(path) as f:
+        # (note: use mktree + extend rather than direct assignment,
+        #  as the former gives the nanoAOD branch naming convention)
+        types = {key: (val.type.content if isinstance(val, ak.Array) else val.dtype)
+                 for key, val in branches.items()}
+        f.mktree('Events', types)
+        f['Events'].extend(branches)
+        if not data:
+            f['Runs'] = {'run': np.array([1], dtype=np.uint32),
+                         'genEventCount': np.array([nevents], dtype=np.int64),
+                         'genEventSumw': np.array([np.sum(branches['genWeight'])], dtype=np.float64)}
+    return path
+
+
+def makesyntheticfiles(outputdir, nfiles, nevents, multiplicities=None,
+                       data=False, overlap=0.3, year='2018', seed=1):
+    ### write a set of synthetic files
+    # input arguments:
+    # - outputdir: directory where to write the files
+    # - nfiles: number of files
+    # - nevents: number of events per file
+    # - multiplicities: see makeevents
+    # - data: write data-like files
+    # - overlap: for data-like files, fraction of events in each file also present in previous files
+    # - year: for data-like files, year of the golden json to draw the lumisections from
+    # - seed: random seed
+    # returns:
+    # a list of file names
+    if not os.path.exists(outputdir): os.makedirs(outputdir)
+    rng = np.random.default_rng(seed)
+    filenames = []
+    previous = np.zeros((0, 3), dtype=np.int64)
+    for i in range(nfiles):
+        keys = None
+        if data:
+            noverlap = min(int(overlap*nevents), len(previous))
+            overlapping = previous[rng.choice(len(previous), size=noverlap, replace=False)]
+            new = datakeys(nevents-noverlap, year, rng)
+            previous = np.concatenate((previous, new))
+            keys = np.concatenate((overlapping, new))
+            keys = keys[np.lexsort((keys[:,2], keys[:,1], keys[:,0]))]
+        name = 'synthetic_{}_{}.root'.format('data' if data else 'sim', i)
+        filenames.append(makesyntheticfile(os.path.join(outputdir, name), nevents,
+                           multiplicities=multiplicities, data=data, keys=keys, seed=seed+i))
+    return filenames
+
+
+if __name__=='__main__':
+
+    # input arguments
+    parser = argparse.ArgumentParser(description='Write synthetic NanoAOD-like files')
+    parser.add_argument('-o', '--outputdir', default='synthetic')
+    parser.add_argument('-n', '--nfiles', type=int, default=1)
+    parser.add_argument('-e', '--nevents', type=int, default=100000,
+                        help='Number of events per file')
+    parser.add_argument('--data', default=False, action='store_true',
+                        help='Write data-like files (no simulation branches, certified lumisections)')
+    parser.add_argument('-r', '--overlap', type=float, default=0.3,
+                        help='For data-like files: fraction of events also present in previous files')
+    parser.add_argument('-y', '--year', default='2018',
+                        help='For data-like files: year of the golden json to use')
+    parser.add_argument('-m', '--multiplicities', default=[], nargs='+',
+                        help='Mean multiplicities in the form <collection>=<mean>, e.g. Muon=2')
+    parser.add_argument('-s', '--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    # print arguments
+    print('Running with following configuration:')
+    for arg in vars(args):
+        print('  - {}: {}'.format(arg,getattr(args,arg)))
+
+    # write the files
+    multiplicities = {m.split('=')[0]: float(m.split('=')[1]) for m in args.multiplicities}
+    filenames = makesyntheticfiles(args.outputdir, args.nfiles, args.nevents,
+                  multiplicities=multiplicities, data=args.data, overlap=args.overlap,
+                  year=args.year, seed=args.seed)
+    for filename in filenames:
+        print('Written {} ({:.1f} MB)'.format(filename, os.path.getsize(filename)/1e6))
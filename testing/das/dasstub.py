@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+##############################################
+# Stub replacement for dasgoclient (testing) #
+##############################################
+# Answers the DAS queries used in tools/dastools.py from a local json file,
+# given by the environment variable DASSTUB_DB, with the format:
+# {"files": {"<lfn>": {"<run>": [lumi, ...]}, ...},
+#  "datasets": {"<dataset>": ["<lfn>", ...], ...}}
+# Optionally, the environment variable DASSTUB_DELAY (in seconds)
+# simulates the latency of a DAS query.
+# Usage: python dasstub.py -query '<query>' --limit 0
+
+# imports
+import os, sys
+import json
+import time
+import argparse
+
+# input arguments
+parser = argparse.ArgumentParser(description='Stub DAS client')
+parser.add_argument('-query', required=True)
+parser.add_argument('--limit', default=0)
+args = parser.parse_args()
+
+# read the database
+with open(os.environ['DASSTUB_DB']) as f: db = json.load(f)
+time.sleep(float(os.environ.get('DASSTUB_DELAY', 0)))
+
+# answer the query
+(fields, condition) = args.query.split(' ', 1)
+(key, value) = condition.split('=', 1)
+if key=='file':
+    if value not in db['files']:
+        sys.stderr.write('file {} not found\n'.format(value))
+        sys.exit(1)
+    runsls = db['files'][value]
+    if fields=='run':
+        for run in runsls.keys(): print(run)
+    elif fields=='lumi':
+        for lumis in runsls.values():
+            for lumi in lumis: print(lumi)
+    else: sys.exit(1)
+elif key=='dataset':
+    lfns = db['datasets'].get(value, [])
+    if fields=='file':
+        for lfn in lfns: print(lfn)
+    elif fields=='file,run,lumi':
+        if os.environ.get('DASSTUB_NOBATCH', '0')=='1': sys.exit(1)
+        for lfn in lfns:
+            for run, lumis in db['files'][lfn].items():
+                print('{} {} {}'.format(lfn, run, lumis))
+    else: sys.exit(1)
+else: sys.exit(1)
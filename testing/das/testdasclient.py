@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+######################################################
+# Testing script for the parallel, cached DAS client #
+######################################################
+# Compares the output of the DASClient (tools/dastools.py)
+# with the original sequential implementation,
+# using a local stub script instead of dasgoclient (see dasstub.py).
+# Usage: python testdasclient.py [--nfiles <n>] [--delay <seconds>] [--jobs <n>]
+
+# imports
+import os, sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import numpy as np
+
+# import local tools
+from PhysicsTools.nanoSkimming.tools.dastools import DASClient
+
+
+def get_lumis_das_sequential(dasfile, dascommand):
+    ### original implementation of getjson.get_lumis_das (for comparison)
+    dascmd = "{} -query 'lumi file={}' --limit 0".format(dascommand, dasfile)
+    dasstdout = os.popen(dascmd).read()
+    lumis = sorted([el.strip(' \t') for el in dasstdout.strip('\n').split('\n')])
+    dascmd = "{} -query 'run file={}' --limit 0".format(dascommand, dasfile)
+    dasstdout = os.popen(dascmd).read()
+    runs = sorted([el.strip(' \t') for el in dasstdout.strip('\n').split('\n')])
+    if len(runs)!=1:
+        msg = 'ERROR: found {} runs ({}), which is unexpected.'.format(len(runs), runs)
+        raise Exception(msg)
+    run = int(runs[0])
+    lumis = sorted([int(el) for el in set(lumis)])
+    runsls = {run: []}
+    for lumi in lumis: runsls[run].append([lumi,lumi])
+    return runsls
+
+
+if __name__=='__main__':
+
+    # input arguments
+    parser = argparse.ArgumentParser(description='Test DAS client')
+    parser.add_argument('--nfiles', default=50, type=int)
+    parser.add_argument('--delay', default=0.1, type=float)
+    parser.add_argument('--jobs', default=16, type=int)
+    args = parser.parse_args()
+
+    # make a stub database
+    workdir = tempfile.mkdtemp()
+    rng = np.random.default_rng(1)
+    dataset = '/Stub/Run2018A-UL2018/NANOAOD'
+    files = {}
+    for i in range(args.nfiles):
+        lfn = '/store/data/stub/file_{}.root'.format(i)
+        lumis = rng.integers(1, 1000, size=rng.integers(1, 50)).tolist()
+        files[lfn] = {str(315000 + i//10): lumis}
+    db = {'files': files, 'datasets': {dataset: sorted(files.keys())}}
+    dbpath = os.path.join(workdir, 'db.json')
+    with open(dbpath, 'w') as f: json.dump(db, f)
+    os.environ['DASSTUB_DB'] = dbpath
+    os.environ['DASSTUB_DELAY'] = str(args.delay)
+    dascommand = '{} {}'.format(sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dasstub.py'))
+    lfns = sorted(files.keys())
+
+    # reference
+    starttime = time.time()
+    reference = {lfn: get_lumis_das_sequential(lfn, dascommand) for lfn in lfns}
+    print('Sequential queries: {:.2f} s'.format(time.time()-starttime))
+
+    # concurrent queries without cache
+    cachedir = os.path.join(workdir, 'cache')
+    client = DASClient(command=dascommand, cachedir=cachedir, jobs=args.jobs)
+    starttime = time.time()
+    res = client.getfileslumis(lfns)
+    print('Concurrent queries: {:.2f} s'.format(time.time()-starttime))
+    assert res==reference
+
+    # cached queries
+    starttime = time.time()
+    res = client.getfileslumis(lfns)
+    print('Cached queries: {:.2f} s'.format(time.time()-starttime))
+    assert res==reference
+
+    # batched dataset query
+    client = DASClient(command=dascommand, cachedir=None, jobs=args.jobs)
+    starttime = time.time()
+    res = client.getdatasetlumis(dataset)
+    print('Batched dataset query: {:.2f} s'.format(time.time()-starttime))
+    assert res==reference
+
+    # fallback when batched queries are not supported
+    os.environ['DASSTUB_NOBATCH'] = '1'
+    res = client.getdatasetlumis(dataset)
+    assert res==reference
+
+    shutil.rmtree(workdir)
+    print('All results are identical to the sequential queries.')
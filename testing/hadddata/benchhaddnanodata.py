@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+#############################################################
+# Benchmark the scaling of haddnanodata.py with input size #
+#############################################################
+# Writes N synthetic data files with overlapping events
+# (each file shares a fraction of its events with the files before it,
+#  as for events recorded in several primary datasets),
+# merges the first 1, 2, 4, ... N files with haddnanodata,
+# and prints the time per input event and the peak memory for each merge.
+# For linear scaling, the time per input event should stay roughly constant.
+# With --jobs, the merges are run in parallel mode, and the largest merge
+# is repeated in serial mode to check that the output is identical.
+# The number of written events is checked against the number of distinct events.
+
+# imports
+import os, sys
+import time
+import argparse
+import concurrent.futures
+import multiprocessing
+from pathlib import Path
+import numpy as np
+import uproot
+
+# import local tools
+sys.path.append(str(Path(__file__).parents[2]))
+from merging.haddnanodata import haddnanodata, peak_memory
+
+
+def make_synthetic_files(outputdir, nfiles, nevents, overlap, seed=1):
+    ### write synthetic data files with overlapping events
+    # returns:
+    # a tuple of the list of file names,
+    # and the cumulative number of distinct events after each file
+    rng = np.random.default_rng(seed)
+    filenames = []
+    ndistinct = []
+    previous = np.zeros((0,3), dtype=np.int64)
+    nextevent = 0
+    for i in range(nfiles):
+        # draw overlapping events from the previous files and add new ones
+        noverlap = int(overlap*nevents) if len(previous)>0 else 0
+        overlapping = previous[rng.choice(len(previous), size=noverlap, replace=False)] if noverlap>0 else previous[:0]
+        nnew = nevents - noverlap
+        new = np.zeros((nnew,3), dtype=np.int64)
+        new[:,0] = rng.integers(315000, 325000, size=nnew)
+        new[:,1] = rng.integers(1, 2000, size=nnew)
+        new[:,2] = nextevent + np.arange(nnew)
+        nextevent += nnew
+        keys = np.concatenate((overlapping, new))
+        keys = keys[np.lexsort((keys[:,2], keys[:,1], keys[:,0]))]
+        previous = np.concatenate((previous, new))
+        ndistinct.append(len(previous))
+        # write the file
+        filename = os.path.join(outputdir, 'synthetic_data_{}.root'.format(i))
+        with uproot.recreate(filename) as f:
+            f['Events'] = {'run': keys[:,0].astype(np.uint32),
+                           'luminosityBlock': keys[:,1].astype(np.uint32),
+                           'event': keys[:,2].astype(np.uint64),
+                           'MET_pt': rng.exponential(30., size=len(keys)).astype(np.float32),
+                           'nMuon': rng.poisson(1., size=len(keys)).astype(np.int32)}
+        filenames.append(filename)
+    return (filenames, ndistinct)
+
+
+def run_merge(outputfile, inputfiles, step_size, jobs):
+    ### run a single merge (meant to be called in a fresh process)
+    start = time.time()
+    (n_written, n_overlap) = haddnanodata(outputfile, inputfiles, force=True,
+                               step_size=step_size, jobs=jobs)
+    return (time.time()-start, n_written, n_overlap, peak_memory())
+
+
+if __name__=='__main__':
+
+    # input arguments
+    parser = argparse.ArgumentParser(description='Benchmark haddnanodata scaling')
+    parser.add_argument('-n', '--nfiles', type=int, default=8)
+    parser.add_argument('-e', '--nevents', type=int, default=200000,
+                        help='Number of events per file')
+    parser.add_argument('-r', '--overlap', type=float, default=0.3,
+                        help='Fraction of events in each file also present in previous files')
+    parser.add_argument('-s', '--step_size', type=int, default=100000)
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of parallel processes per merge'
+                             +' (if larger than 1, the output is also compared to a merge with 1 process)')
+    parser.add_argument('-o', '--outputdir', default='synthetic_hadddata')
+    args = parser.parse_args()
+
+    # print arguments
+    print('Running with following configuration:')
+    for arg in vars(args):
+        print('  - {}: {}'.format(arg,getattr(args,arg)))
+
+    # make the synthetic input files
+    if not os.path.exists(args.outputdir): os.makedirs(args.outputdir)
+    (inputfiles, ndistinct) = make_synthetic_files(args.outputdir, args.nfiles, args.nevents, args.overlap)
+
+    # run the merges, each in a separate process to measure the peak memory
+    nmerge = [2**i for i in range(args.nfiles.bit_length()) if 2**i<=args.nfiles]
+    if nmerge[-1]!=args.nfiles: nmerge.append(args.nfiles)
+    print('Results:')
+    context = multiprocessing.get_context('spawn')
+    for n in nmerge:
+        outputfile = os.path.join(args.outputdir, 'merged_{}.root'.format(n))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            (duration, n_written, n_overlap, memory) = executor.submit(
+              run_merge, outputfile, inputfiles[:n], args.step_size, args.jobs).result()
+        ninput = n*args.nevents
+        msg = '  - {} files ({} events): {:.2f} s, {:.2f} us/event'.format(
+                n, ninput, duration, duration/ninput*1e6)
+        msg += ', written {} (expected {}), overlapping {}'.format(n_written, ndistinct[n-1], n_overlap)
+        if memory is not None: msg += ', peak memory {:.0f} MB'.format(memory/1e6)
+        print(msg)
+
+    # compare to the serial merge if requested
+    if args.jobs > 1:
+        outputfile = os.path.join(args.outputdir, 'merged_{}_serial.root'.format(args.nfiles))
+        (duration, _, _, _) = run_merge(outputfile, inputfiles, args.step_size, 1)
+        with uproot.open(outputfile) as f1, uproot.open(os.path.join(args.outputdir,
+          'merged_{}.root'.format(args.nfiles))) as f2:
+            serial = f1['Events'].arrays(library='np')
+            parallel = f2['Events'].arrays(library='np')
+        identical = ( sorted(serial.keys())==sorted(parallel.keys())
+                      and all([np.array_equal(serial[key], parallel[key]) for key in serial.keys()]) )
+        msg = '  - serial merge of {} files: {:.2f} s'.format(args.nfiles, duration)
+        msg += ' (output identical to parallel merge: {})'.format(identical)
+        print(msg)
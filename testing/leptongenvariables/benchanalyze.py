@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+################################################################
+# Benchmark the per-event analyze of LeptonGenVariablesModule #
+################################################################
+# Generates synthetic events with leptons and gen particles (as lists of objects)
+# and compares the throughput of:
+# - the baseline analyze (per-object matching, copied below),
+# - the current LeptonGenVariablesModule.analyze,
+# - the vectorized computeArrays per event, including the conversion
+#   of the objects to numpy arrays that it needs in a per-event loop.
+# The results of all methods are checked to be identical to the baseline.
+# note: to run without the NanoAODTools event loop, the collections are given
+#       as prebuilt lists of lightweight objects (see tools/chunktools.ChunkObject);
+#       attribute access on real nanoAODTools proxies is slower,
+#       which makes the conversion to numpy arrays relatively more expensive.
+
+# imports
+import os, sys
+import time
+import argparse
+import numpy as np
+
+# import local tools
+import PhysicsTools.nanoSkimming.processing.leptongenvariables as leptongenvariables
+from PhysicsTools.nanoSkimming.processing.leptongenvariables import LeptonGenVariablesModule
+from PhysicsTools.nanoSkimming.tools.chunktools import ChunkObject
+
+
+class OutputRecorder(object):
+    ### stand-in for the wrapped output tree, recording the filled values
+    def __init__(self):
+        self.values = []
+    def fillBranch(self, name, value):
+        self.values.append((name, [v.item() if hasattr(v, 'item') else v for v in value]))
+
+
+def make_synthetic_events(nevents, ngenrange, nleptonrange, seed=1):
+    ### make synthetic events with gen particles and leptons close to some of them
+    # returns:
+    # a list of dicts with keys 'Electron', 'Muon' and 'GenPart' (lists of ChunkObjects)
+    rng = np.random.default_rng(seed)
+    pdgids = [11, -11, 13, -13, 22, 22, 211, -211, 21, 1, -2, 23, 24]
+    events = []
+    for _ in range(nevents):
+        ngen = int(rng.integers(ngenrange[0], ngenrange[1]+1))
+        genparticles = []
+        for i in range(ngen):
+            genparticles.append(ChunkObject(
+              pt=float(rng.exponential(20.)), eta=float(rng.uniform(-3., 3.)),
+              phi=float(rng.uniform(-np.pi, np.pi)), pdgId=int(rng.choice(pdgids)),
+              status=int(rng.choice([1, 1, 1, 2, 23])), statusFlags=int(rng.integers(0, 1<<15)),
+              genPartIdxMother=int(rng.integers(-1, i)) if i>0 else -1))
+        event = {'GenPart': genparticles}
+        for collection, pdgid in [('Electron', 11), ('Muon', 13)]:
+            leptons = []
+            for _ in range(int(rng.integers(nleptonrange[0], nleptonrange[1]+1))):
+                sign = int(rng.choice([-1, 1]))
+                if( ngen>0 and rng.uniform() < 0.8 ):
+                    # lepton close to a gen particle, with or without builtin match
+                    igen = int(rng.integers(0, ngen))
+                    gen = genparticles[igen]
+                    leptons.append(ChunkObject(
+                      eta=gen.eta + float(rng.normal(0., 0.05)),
+                      phi=gen.phi + float(rng.normal(0., 0.05)),
+                      pdgId=sign*pdgid, genPartIdx=igen if rng.uniform() < 0.5 else -1))
+                else:
+                    leptons.append(ChunkObject(
+                      eta=float(rng.uniform(-2.5, 2.5)), phi=float(rng.uniform(-np.pi, np.pi)),
+                      pdgId=sign*pdgid, genPartIdx=-1))
+            event[collection] = leptons
+        events.append(event)
+    return events
+
+
+def baseline_analyze(module, event, out):
+    ### copy of the baseline LeptonGenVariablesModule.analyze
+    # (with the collections taken from the synthetic event)
+    electrons = event['Electron']
+    muons = event['Muon']
+    genparticles = event['GenPart']
+
+    # do custom matching
+    electron_matches = [module.findmatch(e, 11, genparticles) for e in electrons]
+    muon_matches = [module.findmatch(m, 13, genparticles) for m in muons]
+
+    # isPrompt
+    if 'isPrompt' in module.variables:
+        out.fillBranch('Electron_isPrompt', [module.genpart_is_prompt(g) for g in electron_matches])
+        out.fillBranch('Muon_isPrompt', [module.genpart_is_prompt(g) for g in muon_matches])
+
+    # matchPdgId
+    if 'matchPdgId' in module.variables:
+        out.fillBranch('Electron_matchPdgId', [(g.pdgId if g is not None else 0) for g in electron_matches])
+        out.fillBranch('Muon_matchPdgId', [(g.pdgId if g is not None else 0) for g in muon_matches])
+
+    if 'provenanceConversion' in module.variables:
+        out.fillBranch('Electron_provenanceConversion',
+                       [module.provenanceconversion(g, genparticles) for g in electron_matches])
+        out.fillBranch('Muon_provenanceConversion',
+                       [module.provenanceconversion(g, genparticles) for g in muon_matches])
+
+    # motherPdgId
+    if 'motherPdgId' in module.variables:
+        out.fillBranch('Electron_motherPdgId', [module.motherpdgid(g, genparticles) for g in electron_matches])
+        out.fillBranch('Muon_motherPdgId', [module.motherpdgid(g, genparticles) for g in muon_matches])
+
+    # isChargeFlip
+    if 'isChargeFlip' in module.variables:
+        electron_ischargeflip = [False]*len(electrons)
+        for i,(e,g) in enumerate(zip(electrons, electron_matches)):
+            if g is None: continue
+            if g.pdgId==-e.pdgId: electron_ischargeflip[i] = True
+        muon_ischargeflip = [False]*len(muons)
+        for i,(m,g) in enumerate(zip(muons, muon_matches)):
+            if g is None: continue
+            if g.pdgId==-m.pdgId: muon_ischargeflip[i] = True
+        out.fillBranch('Electron_isChargeFlip', electron_ischargeflip)
+        out.fillBranch('Muon_isChargeFlip', muon_ischargeflip)
+
+
+def bench_baseline(module, events):
+    ### baseline analyze
+    out = OutputRecorder()
+    start = time.time()
+    for event in events: baseline_analyze(module, event, out)
+    return (time.time()-start, out.values)
+
+
+def bench_analyze(module, events):
+    ### current analyze
+    # (the nanoAODTools Collection is replaced by a lookup in the synthetic event)
+    out = OutputRecorder()
+    module.out = out
+    collection = leptongenvariables.Collection
+    leptongenvariables.Collection = lambda event, name: event[name]
+    try:
+        start = time.time()
+        for event in events: module.analyze(event)
+        duration = time.time()-start
+    finally:
+        leptongenvariables.Collection = collection
+    return (duration, out.values)
+
+
+def bench_arrays(module, events):
+    ### vectorized computeArrays per event, including the conversion to arrays
+    def columns(objects, fields):
+        return ({field: np.array([getattr(obj, field) for obj in objects]) for field in fields},
+                np.array([len(objects)], dtype=np.int64))
+    out = OutputRecorder()
+    start = time.time()
+    for event in events:
+        values = module.computeArrays(columns(event['Electron'], module.leptonfields),
+                                      columns(event['Muon'], module.leptonfields),
+                                      columns(event['GenPart'], module.genfields))
+        for name, val in values.items(): out.fillBranch(name, val.tolist())
+    return (time.time()-start, out.values)
+
+
+if __name__=='__main__':
+
+    # input arguments
+    parser = argparse.ArgumentParser(description='Benchmark LeptonGenVariablesModule.analyze')
+    parser.add_argument('-n', '--nevents', type=int, default=2000)
+    parser.add_argument('-g', '--ngen', type=int, nargs=2, default=[0, 60],
+                        help='Minimum and maximum number of gen particles per event')
+    parser.add_argument('-l', '--nleptons', type=int, nargs=2, default=[0, 2],
+                        help='Minimum and maximum number of electrons (and of muons) per event')
+    args = parser.parse_args()
+
+    # print arguments
+    print('Running with following configuration:')
+    for arg in vars(args):
+        print('  - {}: {}'.format(arg,getattr(args,arg)))
+
+    # make the module and the synthetic input
+    module = LeptonGenVariablesModule()
+    events = make_synthetic_events(args.nevents, args.ngen, args.nleptons)
+
+    # run the benchmarks
+    results = {}
+    results['baseline analyze'] = bench_baseline(module, events)
+    results['analyze'] = bench_analyze(module, events)
+    results['computeArrays per event'] = bench_arrays(module, events)
+
+    # check consistency and print results
+    # (note: the fill order of the branches differs between the methods)
+    (refduration, reference) = results['baseline analyze']
+    print('Results:')
+    for name, (duration, values) in results.items():
+        identical = (sorted(values, key=lambda v: v[0])==sorted(reference, key=lambda v: v[0]))
+        msg = '  - {}: {:.3f} s, {:.0f} events/s, {:.2f}x the baseline time'.format(
+                name, duration, args.nevents/duration, duration/refduration)
+        msg += ' (identical to baseline: {})'.format(identical)
+        print(msg)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+##############################################################
+# Benchmark recursive versus table-based mother pdgId lookup #
+##############################################################
+# Generates synthetic gen particle records with deep chains of same-flavour copies
+# (as in samples with a lot of final state radiation),
+# and compares the throughput of:
+# - the recursive per-lepton walk (LeptonGenVariablesModule.motherpdgid, as used in analyze),
+# - the ancestor table computed per event, including the conversion of the objects
+#   to numpy arrays that a per-event loop would need,
+# - the ancestor table computed per chunk of events (as used in process_chunk,
+#   where the input is already columnar, so no conversion is needed).
+# The per-event methods both start from the same lists of objects, built outside the timing
+# (see tools/chunktools.ChunkObject; attribute access on real nanoAODTools proxies is slower,
+#  which affects both per-event methods).
+# The results of the three methods are checked to be identical.
+
+# imports
+import os, sys
+import time
+import argparse
+import numpy as np
+
+# import local tools
+from PhysicsTools.nanoSkimming.processing.leptongenvariables import LeptonGenVariablesModule
+from PhysicsTools.nanoSkimming.tools.chunktools import ChunkObject
+
+
+def make_synthetic_events(nevents, nleptons, depth, seed=1):
+    ### make synthetic gen particle records
+    # each event contains a number of bosons, each decaying to a lepton,
+    # which is copied depth times (with a radiated photon attached to each copy);
+    # one lepton per event is matched to the last copy of each chain.
+    # returns:
+    # a tuple of a dict of flat gen particle arrays, the number of gen particles per event,
+    # and the flat index of the matched gen particle per lepton
+    rng = np.random.default_rng(seed)
+    pdgids = []
+    mothers = []
+    counts = []
+    matches = []
+    offset = 0
+    for _ in range(nevents):
+        eventpdgids = []
+        eventmothers = []
+        for _ in range(nleptons):
+            eventpdgids.append(int(rng.choice([23, 24, -24])))
+            eventmothers.append(-1)
+            leptonpdgid = int(rng.choice([-13, -11, 11, 13]))
+            for i in range(depth):
+                eventpdgids.append(leptonpdgid)
+                eventmothers.append(len(eventpdgids)-2 if i==0 else len(eventpdgids)-3)
+                eventpdgids.append(22)
+                eventmothers.append(len(eventpdgids)-2)
+            matches.append(offset + len(eventpdgids)-2)
+        pdgids += eventpdgids
+        mothers += eventmothers
+        counts.append(len(eventpdgids))
+        offset += len(eventpdgids)
+    gen = {'pdgId': np.array(pdgids, dtype=np.int32),
+           'genPartIdxMother': np.array(mothers, dtype=np.int32)}
+    return (gen, np.array(counts, dtype=np.int64), np.array(matches, dtype=np.int64))
+
+
+def make_objects(gen, counts):
+    ### convert the gen particle records to lists (one per event) of objects
+    offsets = np.cumsum(counts) - counts
+    return [[ChunkObject(pdgId=int(gen['pdgId'][i]), genPartIdxMother=int(gen['genPartIdxMother'][i]))
+             for i in range(offset, offset+count)] for offset, count in zip(offsets, counts)]
+
+
+def bench_recursive(module, genobjects, counts, matches):
+    ### recursive walk per lepton over lists of objects
+    offsets = np.cumsum(counts) - counts
+    events = np.repeat(np.arange(len(counts)), len(matches)//len(counts))
+    start = time.time()
+    result = []
+    for event, match in zip(events, matches):
+        genparticles = genobjects[event]
+        result.append(module.motherpdgid(genparticles[match-offsets[event]], genparticles))
+    return (time.time()-start, result)
+
+
+def bench_perevent(module, genobjects, counts, matches):
+    ### ancestor table per event, including the conversion of the objects to arrays
+    offsets = np.cumsum(counts) - counts
+    nleptons = len(matches)//len(counts)
+    start = time.time()
+    result = []
+    for i, (offset, genparticles) in enumerate(zip(offsets, genobjects)):
+        eventgen = {field: np.array([getattr(g, field) for g in genparticles], dtype=np.int64)
+                    for field in ['pdgId', 'genPartIdxMother']}
+        ancestors = module.getancestors(eventgen, np.array([0]), np.array([len(genparticles)]))
+        eventmatches = matches[i*nleptons:(i+1)*nleptons] - offset
+        result += module.motherpdgids(eventmatches, ancestors, eventgen).tolist()
+    return (time.time()-start, result)
+
+
+def bench_chunk(module, gen, counts, matches):
+    ### ancestor table for all events at once
+    start = time.time()
+    ancestors = module.getancestors(gen, np.cumsum(counts) - counts, counts)
+    result = module.motherpdgids(matches, ancestors, gen).tolist()
+    return (time.time()-start, result)
+
+
+if __name__=='__main__':
+
+    # input arguments
+    parser = argparse.ArgumentParser(description='Benchmark mother pdgId lookup')
+    parser.add_argument('-n', '--nevents', type=int, default=2000)
+    parser.add_argument('-l', '--nleptons', type=int, default=3)
+    parser.add_argument('-d', '--depth', type=int, default=50,
+                        help='Number of same-flavour copies per lepton')
+    args = parser.parse_args()
+
+    # print arguments
+    print('Running with following configuration:')
+    for arg in vars(args):
+        print('  - {}: {}'.format(arg,getattr(args,arg)))
+
+    # make the module and the synthetic input
+    module = LeptonGenVariablesModule(variables=['motherPdgId'])
+    (gen, counts, matches) = make_synthetic_events(args.nevents, args.nleptons, args.depth)
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 2*args.depth+100))
+
+    # run the benchmarks
+    results = {}
+    genobjects = make_objects(gen, counts)
+    results['recursive'] = bench_recursive(module, genobjects, counts, matches)
+    results['table per event'] = bench_perevent(module, genobjects, counts, matches)
+    results['table per chunk'] = bench_chunk(module, gen, counts, matches)
+
+    # check consistency and print results
+    (_, reference) = results['recursive']
+    print('Results:')
+    for name, (duration, result) in results.items():
+        identical = (result==reference)
+        msg = '  - {}: {:.3f} s, {:.0f} events/s'.format(name, duration, args.nevents/duration)
+        msg += ' (identical to recursive: {})'.format(identical)
+        print(msg)
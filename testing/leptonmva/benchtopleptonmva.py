@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+##########################################################
+# Benchmark per-lepton versus batched TOP lepton MVA     #
+##########################################################
+# Writes a small synthetic NanoAOD-like file with uproot
+# (only the Electron and Muon branches needed by the MVA),
+# and compares the throughput of:
+# - reference per-lepton scoring (one DMatrix and one predict call per lepton,
+#   the old behaviour of getElectronMvaScore and getMuonMvaScore, copied below),
+# - per-lepton scoring with the current getElectronMvaScore and getMuonMvaScore
+#   (wrappers around the batched scoring, for backward compatibility),
+# - per-event batched scoring (one predict call per event, as used in analyze),
+# - block batched scoring (one predict call per block of events).
+# The scores of all methods are compared to the reference per-lepton scores.
+
+# imports
+import os, sys
+import time
+import argparse
+import types
+import numpy as np
+import awkward as ak
+import uproot
+import xgboost as xgb
+
+# import local tools
+from PhysicsTools.nanoSkimming.processing.topleptonmva import TopLeptonMvaModule
+
+
+def make_synthetic_file(path, nevents, variables, seed=1):
+    ### write a synthetic file with random lepton features
+    rng = np.random.default_rng(seed)
+    branches = {}
+    for collection in ['Electron', 'Muon']:
+        counts = rng.poisson(2., size=nevents)
+        ntot = int(np.sum(counts))
+        fields = {}
+        for var in variables[collection]:
+            values = rng.exponential(1., size=ntot).astype(np.float32)
+            if var in ['dxy', 'dz']: values = (values - 1.) * 0.01
+            if var in ['eta']: values = rng.uniform(-2.5, 2.5, size=ntot).astype(np.float32)
+            if var in ['pt']: values = (values * 30. + 10.).astype(np.float32)
+            fields[var] = ak.unflatten(values, counts)
+        branches[collection] = ak.zip(fields)
+    with uproot.recreate(path) as f:
+        # (note: use mktree + extend rather than direct assignment,
+        #  as the former gives the nanoAOD branch naming convention)
+        f.mktree('Events', {key: val.type.content for key, val in branches.items()})
+        f['Events'].extend(branches)
+
+
+def read_columns(path):
+    ### read the lepton features per event as flat arrays
+    with uproot.open(path) as f:
+        tree = f['Events']
+        arrays = tree.arrays(library='ak')
+    return arrays
+
+
+def reference_electron_score(module, electron):
+    ### get the MVA score for an electron with one DMatrix and predict call
+    # (copy of the old per-lepton TopLeptonMvaModule.getElectronMvaScore)
+    features = ([[
+        electron.pt,
+        electron.eta,
+        electron.jetNDauCharged,
+        electron.miniPFRelIso_chg,
+        electron.miniPFRelIso_all - electron.miniPFRelIso_chg,
+        electron.jetPtRelv2,
+        electron.jetPtRatio,
+        electron.pfRelIso03_all,
+        electron.jetBTagDeepFlavor,
+        electron.sip3d,
+        np.log(abs(electron.dxy)),
+        np.log(abs(electron.dz)),
+        electron.mvaFall17V2noIso,
+    ]])
+    if module.version=='ULv2': features[0].append( electron.lostHits )
+    features = np.array(features)
+    fmatrix = xgb.DMatrix(features, nthread=1)
+    return module.electronmva.predict(fmatrix)[0]
+
+
+def reference_muon_score(module, muon):
+    ### get the MVA score for a muon with one DMatrix and predict call
+    # (copy of the old per-lepton TopLeptonMvaModule.getMuonMvaScore)
+    features = ([[
+        muon.pt,
+        muon.eta,
+        muon.jetNDauCharged,
+        muon.miniPFRelIso_chg,
+        muon.miniPFRelIso_all - muon.miniPFRelIso_chg,
+        muon.jetPtRelv2,
+        muon.jetPtRatio,
+        muon.pfRelIso03_all,
+        muon.jetBTagDeepFlavor,
+        muon.sip3d,
+        np.log(abs(muon.dxy)),
+        np.log(abs(muon.dz)),
+        muon.segmentComp
+    ]])
+    features = np.array(features)
+    fmatrix = xgb.DMatrix(features, nthread=1)
+    return module.muonmva.predict(fmatrix)[0]
+
+
+def bench_reference(module, arrays):
+    ### one DMatrix and predict call per lepton (old behaviour)
+    return bench_perlepton(module, arrays,
+             electronscore=lambda el: reference_electron_score(module, el),
+             muonscore=lambda mu: reference_muon_score(module, mu))
+
+
+def bench_perlepton(module, arrays, electronscore=None, muonscore=None):
+    ### one scoring call per lepton
+    # (default: the current per-lepton methods of the module)
+    if electronscore is None: electronscore = module.getElectronMvaScore
+    if muonscore is None: muonscore = module.getMuonMvaScore
+    events = ak.to_list(arrays)
+    start = time.time()
+    escores = []
+    mscores = []
+    for event in events:
+        electrons = [types.SimpleNamespace(**{k[len('Electron_'):]: v[i]
+                       for k, v in event.items() if k.startswith('Electron_')})
+                     for i in range(event['nElectron'])]
+        muons = [types.SimpleNamespace(**{k[len('Muon_'):]: v[i]
+                   for k, v in event.items() if k.startswith('Muon_')})
+                 for i in range(event['nMuon'])]
+        escores.append([float(electronscore(el)) for el in electrons])
+        mscores.append([float(muonscore(mu)) for mu in muons])
+    return (time.time()-start, escores, mscores)
+
+
+def bench_perevent(module, arrays):
+    ### one predict call per event
+    events = ak.to_list(arrays)
+    start = time.time()
+    escores = []
+    mscores = []
+    for event in events:
+        electrons = {var: np.array(event['Electron_'+var], dtype=np.float64)
+                     for var in module.electronvariables}
+        muons = {var: np.array(event['Muon_'+var], dtype=np.float64)
+                 for var in module.muonvariables}
+        escores.append(module.getElectronMvaScores(electrons).tolist())
+        mscores.append(module.getMuonMvaScores(muons).tolist())
+    return (time.time()-start, escores, mscores)
+
+
+def bench_block(module, arrays, blocksize):
+    ### one predict call per block of events
+    start = time.time()
+    escores = []
+    mscores = []
+    for first in range(0, len(arrays), blocksize):
+        block = arrays[first:first+blocksize]
+        electrons = {var: ak.flatten(block['Electron_'+var]) for var in module.electronvariables}
+        muons = {var: ak.flatten(block['Muon_'+var]) for var in module.muonvariables}
+        escores.append(ak.unflatten(module.getElectronMvaScores(electrons), block['nElectron']))
+        mscores.append(ak.unflatten(module.getMuonMvaScores(muons), block['nMuon']))
+    escores = ak.to_list(ak.concatenate(escores))
+    mscores = ak.to_list(ak.concatenate(mscores))
+    return (time.time()-start, escores, mscores)
+
+
+if __name__=='__main__':
+
+    # input arguments
+    parser = argparse.ArgumentParser(description='Benchmark TOP lepton MVA scoring')
+    parser.add_argument('-n', '--nevents', type=int, default=10000)
+    parser.add_argument('-b', '--blocksize', type=int, default=1000)
+    parser.add_argument('-y', '--year', default='2018')
+    parser.add_argument('-v', '--version', default='ULv1')
+    parser.add_argument('-f', '--file', default='synthetic_leptonmva.root')
+    args = parser.parse_args()
+
+    # print arguments
+    print('Running with following configuration:')
+    for arg in vars(args):
+        print('  - {}: {}'.format(arg,getattr(args,arg)))
+
+    # make the module and the synthetic input file
+    module = TopLeptonMvaModule(args.year, args.version)
+    variables = {'Electron': module.electronvariables, 'Muon': module.muonvariables}
+    make_synthetic_file(args.file, args.nevents, variables)
+    arrays = read_columns(args.file)
+
+    # run the benchmarks
+    results = {}
+    results['reference per-lepton'] = bench_reference(module, arrays)
+    results['per-lepton'] = bench_perlepton(module, arrays)
+    results['per-event'] = bench_perevent(module, arrays)
+    results['block ({} events)'.format(args.blocksize)] = bench_block(module, arrays, args.blocksize)
+
+    # check consistency and print results
+    (refduration, refescores, refmscores) = results['reference per-lepton']
+    refscores = np.array(sum(refescores, []) + sum(refmscores, []))
+    print('Results:')
+    for name, (duration, escores, mscores) in results.items():
+        scores = np.array(sum(escores, []) + sum(mscores, []))
+        identical = (escores==refescores and mscores==refmscores)
+        maxdiff = np.max(np.abs(scores-refscores)) if len(scores)>0 else 0.
+        msg = '  - {}: {:.3f} s, {:.0f} events/s, speedup {:.1f}x'.format(
+                name, duration, args.nevents/duration, refduration/duration)
+        msg += ' (scores identical to reference: {}, max. difference: {:.2e})'.format(
+                identical, maxdiff)
+        print(msg)
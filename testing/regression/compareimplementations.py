@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+
+########################################################################
+# Compare the output of two implementations of the same skimming modules #
+########################################################################
+# Runs a reference and a candidate implementation over the same input file
+# and compares every output branch element-wise (exactly for integer and boolean branches,
+# within a configurable tolerance for floating point branches),
+# reporting the first differing events for each branch.
+# By default, the same modules are run through the NanoAODTools PostProcessor
+# (per-event analyze methods) as reference and through the ColumnarProcessor
+# (columnar mask and process_chunk methods) as candidate;
+# other implementations can be given as module specifications of the form
+# '<python module>:<expression>', e.g.
+# 'PhysicsTools.nanoSkimming.processing.leptonvariables:LeptonVariablesModule()'
+# (several specifications are run in the given order).
+# Instead of running the reference, an existing reference output file can be given
+# (e.g. made with an earlier version of the code), so that the tool can gate each change.
+# Without an input file, a synthetic file is made (see testing/benchmark/makesyntheticnano.py).
+# The exit code is 0 if the outputs agree and 1 otherwise.
+# Usage: python compareimplementations.py -m <module specifications> [-c <candidate specifications>]
+#        [-i <input file>] [--referencefile <file>] [--rtol <rtol>] [--atol <atol>]
+
+# imports
+import os, sys
+import fnmatch
+import argparse
+import importlib
+from pathlib import Path
+import numpy as np
+import awkward as ak
+import uproot
+
+# import local tools
+sys.path.append(str(Path(__file__).parents[1] / 'benchmark'))
+from makesyntheticnano import makesyntheticfile
+
+
+def makemodules(specs):
+    ### make a list of modules from module specifications
+    # (each specification is of the form '<python module>:<expression>',
+    #  where the expression is evaluated in the namespace of the python module)
+    modules = []
+    for spec in specs:
+        if ':' not in spec:
+            raise Exception('ERROR: module specification {} not recognized'.format(spec)
+                            + ' (expected <python module>:<expression>).')
+        (modulepath, expression) = spec.split(':', 1)
+        namespace = vars(importlib.import_module(modulepath))
+        modules.append(eval(expression, dict(namespace)))
+    return modules
+
+
+def runmodules(specs, inputfile, outputdir, postfix, mode):
+    ### run a list of modules over an input file
+    # input arguments:
+    # - specs: module specifications (see makemodules)
+    # - inputfile: input file
+    # - outputdir: directory for the output file
+    # - postfix: postfix for the output file name
+    # - mode: 'postprocessor' (per-event) or 'columnar'
+    # returns:
+    # the name of the output file
+    modules = makemodules(specs)
+    if mode=='postprocessor':
+        from PhysicsTools.NanoAODTools.postprocessing.framework.postprocessor import PostProcessor
+        p = PostProcessor(outputdir, [inputfile], modules=modules, postfix=postfix)
+        p.run()
+    elif mode=='columnar':
+        from PhysicsTools.nanoSkimming.processing.columnarprocessor import ColumnarProcessor
+        p = ColumnarProcessor(outputdir, [inputfile], modules=modules, postfix=postfix, verbose=False)
+        p.run()
+    else: raise Exception('ERROR: mode {} not recognized.'.format(mode))
+    return os.path.join(outputdir, os.path.basename(inputfile).replace('.root', postfix+'.root'))
+
+
+def comparearrays(reference, candidate, rtol=0., atol=0.):
+    ### compare two arrays event by event
+    # input arguments:
+    # - reference, candidate: flat or jagged (one level) arrays with the same number of events
+    # - rtol, atol: relative and absolute tolerance for floating point values
+    # returns:
+    # a boolean numpy array with one entry per event, True where the arrays differ
+    reference = ak.Array(reference)
+    candidate = ak.Array(candidate)
+    if reference.ndim==1 and candidate.ndim==1:
+        (values1, values2) = (ak.to_numpy(reference), ak.to_numpy(candidate))
+        return ~equalvalues(values1, values2, rtol, atol)
+    if reference.ndim!=candidate.ndim: return np.ones(len(reference), dtype=bool)
+    counts1 = ak.to_numpy(ak.num(reference))
+    counts2 = ak.to_numpy(ak.num(candidate))
+    differ = (counts1 != counts2)
+    same = ~differ
+    values1 = ak.to_numpy(ak.flatten(reference[same]))
+    values2 = ak.to_numpy(ak.flatten(candidate[same]))
+    bad = ak.unflatten(~equalvalues(values1, values2, rtol, atol), counts1[same])
+    differ[same] = ak.to_numpy(ak.any(bad, axis=1))
+    return differ
+
+
+def equalvalues(values1, values2, rtol, atol):
+    ### element-wise comparison of two flat numpy arrays
+    # (within tolerance if any of them is floating point, exact otherwise)
+    if( np.issubdtype(values1.dtype, np.floating) or np.issubdtype(values2.dtype, np.floating) ):
+        return np.isclose(values1, values2, rtol=rtol, atol=atol, equal_nan=True)
+    return (values1 == values2)
+
+
+def compareoutputs(referencefile, candidatefile, branches=None, rtol=0., atol=0.,
+                   nreport=5, treename='Events'):
+    ### compare the output trees of two files
+    # input arguments:
+    # - referencefile, candidatefile: the output files to compare
+    # - branches: list of branch name patterns to compare (default: all branches)
+    # - rtol, atol: relative and absolute tolerance for floating point values
+    # - nreport: number of differing events to report per branch
+    # - treename: name of the tree to compare
+    # returns:
+    # a dict matching the names of differing branches to a description of the difference
+    differences = {}
+    with uproot.open(referencefile) as f1, uproot.open(candidatefile) as f2:
+        tree1 = f1[treename]
+        tree2 = f2[treename]
+        names1 = tree1.keys()
+        names2 = tree2.keys()
+        if branches is not None:
+            names1 = [b for b in names1 if any([fnmatch.fnmatchcase(b, p) for p in branches])]
+            names2 = [b for b in names2 if any([fnmatch.fnmatchcase(b, p) for p in branches])]
+        for name in names1:
+            if name not in names2: differences[name] = 'missing in candidate output'
+        for name in names2:
+            if name not in names1: differences[name] = 'missing in reference output'
+        if tree1.num_entries!=tree2.num_entries:
+            differences['(number of events)'] = '{} in reference, {} in candidate'.format(
+                                                tree1.num_entries, tree2.num_entries)
+            return differences
+        names = [name for name in names1 if name in names2]
+        keys = tree1.arrays(['run', 'luminosityBlock', 'event'], library='np') if 'event' in names1 else None
+        for name in names:
+            reference = tree1[name].array(library='ak')
+            candidate = tree2[name].array(library='ak')
+            differ = comparearrays(reference, candidate, rtol=rtol, atol=atol)
+            ndiffer = int(np.sum(differ))
+            if ndiffer==0: continue
+            msg = '{} differing events'.format(ndiffer)
+            for idx in np.nonzero(differ)[0][:nreport]:
+                msg += '\n      - entry {}'.format(idx)
+                if keys is not None:
+                    msg += ' (run {}, lumisection {}, event {})'.format(
+                           keys['run'][idx], keys['luminosityBlock'][idx], keys['event'][idx])
+                msg += ': {} vs {}'.format(ak.to_list(reference[idx]), ak.to_list(candidate[idx]))
+            differences[name] = msg
+    return differences
+
+
+if __name__=='__main__':
+
+    # input arguments
+    parser = argparse.ArgumentParser(description='Compare two implementations of skimming modules')
+    parser.add_argument('-m', '--modules', required=True, nargs='+',
+                        help='Reference module specifications (<python module>:<expression>)')
+    parser.add_argument('-c', '--candidate', default=None, nargs='+',
+                        help='Candidate module specifications (default: same as the reference)')
+    parser.add_argument('--referencemode', default='postprocessor', choices=['postprocessor', 'columnar'],
+                        help='Processor for the reference modules')
+    parser.add_argument('--candidatemode', default='columnar', choices=['postprocessor', 'columnar'],
+                        help='Processor for the candidate modules')
+    parser.add_argument('--referencefile', default=None,
+                        help='Existing reference output file (instead of running the reference modules)')
+    parser.add_argument('-i', '--inputfile', default=None,
+                        help='Input file (default: make a synthetic file)')
+    parser.add_argument('-e', '--nevents', type=int, default=10000,
+                        help='Number of events for the synthetic input file')
+    parser.add_argument('-b', '--branches', default=None, nargs='+',
+                        help='Branch name patterns to compare (default: all branches)')
+    parser.add_argument('--rtol', type=float, default=0.,
+                        help='Relative tolerance for floating point branches (default: bit-exact)')
+    parser.add_argument('--atol', type=float, default=0.,
+                        help='Absolute tolerance for floating point branches (default: bit-exact)')
+    parser.add_argument('--nreport', type=int, default=5,
+                        help='Number of differing events to report per branch')
+    parser.add_argument('-o', '--outputdir', default='regression')
+    args = parser.parse_args()
+
+    # print arguments
+    print('Running with following configuration:')
+    for arg in vars(args):
+        print('  - {}: {}'.format(arg,getattr(args,arg)))
+
+    # make the input file
+    if not os.path.exists(args.outputdir): os.makedirs(args.outputdir)
+    inputfile = args.inputfile
+    if inputfile is None:
+        inputfile = makesyntheticfile(os.path.join(args.outputdir, 'synthetic.root'), args.nevents)
+
+    # run the implementations
+    referencefile = args.referencefile
+    if referencefile is None:
+        referencefile = runmodules(args.modules, inputfile, args.outputdir, '_reference', args.referencemode)
+    candidate = args.candidate if args.candidate is not None else args.modules
+    candidatefile = runmodules(candidate, inputfile, args.outputdir, '_candidate', args.candidatemode)
+
+    # compare the outputs
+    differences = compareoutputs(referencefile, candidatefile, branches=args.branches,
+                    rtol=args.rtol, atol=args.atol, nreport=args.nreport)
+    if len(differences)==0:
+        print('The outputs of {} and {} are identical'.format(referencefile, candidatefile)
+              + ' (within rtol={}, atol={}).'.format(args.rtol, args.atol))
+        sys.exit(0)
+    print('Found differences between {} and {}:'.format(referencefile, candidatefile))
+    for name, msg in sorted(differences.items()):
+        print('  - {}: {}'.format(name, msg))
+    sys.exit(1)
@@ -5,6 +5,19 @@
 
 import sys
 import os
+import argparse
+
+# import local executor for running in parallel
+sys.path.append(os.path.abspath('../../condor'))
+import localexecutor as le
+
+# command line arguments
+parser = argparse.ArgumentParser(description='Run testrun.py on test files')
+parser.add_argument('-j', '--jobs', default=1, type=int,
+                    help='Number of test files to process in parallel')
+parser.add_argument('--retries', default=0, type=int,
+                    help='Number of times to retry a failed test run')
+args = parser.parse_args()
 
 # common settings
 nentries = 1000
@@ -48,6 +61,9 @@ if dodata2018:
 inputfiles = [redirector+f for f in inputfiles]
 
 # loop over input files
+# (the commands are run in parallel after the loop, see condor/localexecutor.py;
+#  the output of each command is written to a log file in local_logs)
+executor = le.LocalExecutor(jobs=args.jobs, logfolder='local_logs', retries=args.retries)
 for f in inputfiles:
     # make the command
     cmd = 'python testrun.py'
@@ -58,5 +74,7 @@ for f in inputfiles:
     # print the command
     print('Will run following command:')
     print(cmd)
-    # run the command
-    os.system(cmd)
+    # add the command to the executor
+    executor.submit('testrun', cmd)
+nfailed = executor.run()
+if nfailed>0: sys.exit(1)